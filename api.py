@@ -0,0 +1,140 @@
+import datetime
+import hashlib
+import json
+from decimal import Decimal
+
+from flask import Blueprint, current_app, request, session, url_for, abort
+from werkzeug.exceptions import HTTPException
+
+from inventory import filters_from_args, load_vehicle_details, report_rows
+from pagination import Page, page_links
+from sql import cars
+
+
+# JSON versions of the listing, details and report pages for the kiosks and the website sync
+# Registered under /api/v1 and, for whatever the current version is, /api
+api = Blueprint('api', __name__)
+
+# URL name -> report name used by report_rows and the snapshot tables
+REPORTS = {
+    'sales': 'sale',
+    'seller': 'seller',
+    'statistics': 'statistics',
+}
+
+
+# What the dealer paid and the state it came in, only for signed in staff
+DEALER_FIELDS = ('purchase_price', 'total_cost', 'vehicle_condition')
+
+
+def strip_dealer_fields(rows):
+    if session.get('role'):
+        return rows
+    return [{k: v for k, v in row.items() if k not in DEALER_FIELDS} for row in rows]
+
+
+def get_db():
+    return current_app.extensions['db']
+
+
+def encode(value):
+    # Money stays exact as a string, dates go out as ISO 8601
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+# Compact JSON with a strong ETag over the exact bytes, a matching If-None-Match gets an empty 304
+def json_response(payload, status=200):
+    body = json.dumps(payload, separators=(',', ':'), default=encode, ensure_ascii=False).encode()
+    response = current_app.response_class(body, status=status, mimetype='application/json')
+    if status == 200:
+        response.set_etag(hashlib.sha256(body).hexdigest())
+        # Clients may keep the body but have to check back before using it
+        response.headers['Cache-Control'] = 'no-cache'
+        response.make_conditional(request)
+    return response
+
+
+# ?fields=vin,model_name keeps just those keys, asking for one the rows don't have is a 400
+def select_fields(rows):
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    if not fields or not rows:
+        return rows
+    unknown = [f for f in fields if f not in rows[0]]
+    if unknown:
+        abort(400, description=f'Unknown field(s): {", ".join(unknown)}')
+    return [{f: row[f] for f in fields} for row in rows]
+
+
+@api.errorhandler(HTTPException)
+def api_error(e):
+    return json_response({'error': e.name, 'message': e.description}, status=e.code)
+
+
+# Same listings as the HTML pages: ?status=sellable|unsold|all, defaulting to what home() shows the role
+@api.route('/vehicles')
+def vehicles():
+    qSQL = cars.vehicleSQL()
+    filters = filters_from_args(request.args)
+
+    status = request.args.get('status') or ('unsold' if session.get('role') == 'Buyer' else 'sellable')
+    if status == 'sellable':
+        sql_for_page = lambda page: qSQL.sellable_vehicles(filters or None, page)
+    elif status == 'unsold':
+        sql_for_page = lambda page: qSQL.unsold_vehicles(filters or None, page)
+    elif status == 'all':
+        # Sold vehicles are for the owner, same as /all_vehicles
+        if session.get('role') != 'Owner':
+            abort(403, description='status=all is only for the owner')
+        if filters:
+            abort(400, description='Filters only apply to the sellable and unsold listings')
+        sql_for_page = qSQL.display_vehicles
+    else:
+        abort(400, description='status must be one of sellable, unsold, all')
+
+    page = Page.from_args(request.args, default_size=current_app.config['PAGE_SIZE'])
+    rows, next_cursor, prev_cursor = page.finish(get_db().query(sql_for_page(page)))
+    links = page_links(url_for(request.endpoint), request.args, next_cursor, prev_cursor)
+
+    return json_response({
+        'data': select_fields(strip_dealer_fields(rows)),
+        'next': links['next_url'],
+        'prev': links['prev_url'],
+    })
+
+
+@api.route('/vehicles/<int:vehicle_id>')
+def vehicle(vehicle_id):
+    details = load_vehicle_details(get_db(), vehicle_id)
+    if details is None:
+        abort(404, description=f'No vehicle {vehicle_id}')
+
+    # Same as the details page: parts for the owner and buyers, seller and buyer only for the owner
+    role = session.get('role')
+    if role not in ('Owner', 'Buyer'):
+        details.pop('parts')
+    if role != 'Owner':
+        details.pop('seller')
+        details.pop('buyer')
+        details['car'] = {k: v for k, v in details['car'].items() if not k.startswith(('seller_', 'buyer_'))}
+
+    # Field selection applies to the vehicle itself, parts and customers come along as they are
+    details['car'] = select_fields(strip_dealer_fields([details['car']]))[0]
+    return json_response(details)
+
+
+# Reports are for the owner, same as /metrics
+@api.route('/reports/<name>')
+def report(name):
+    if session.get('role') not in ('Owner', 'Admin'):
+        abort(403)
+    if name not in REPORTS:
+        abort(404, description=f'No report {name}, try one of {", ".join(REPORTS)}')
+
+    rows, as_of = report_rows(get_db(), REPORTS[name])
+    return json_response({'as_of': as_of, 'data': select_fields(rows)})
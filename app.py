@@ -1,9 +1,25 @@
-from flask import Flask, render_template, render_template_string, request, redirect, url_for, flash, session
+import io
+import os
+import click
+from flask import Flask, render_template, render_template_string, stream_template, stream_with_context, request, redirect, url_for, flash, session, jsonify, abort
 from datetime import timedelta
 from database import MyDatabase
-from sql import cars
+from sql import cars, rollup, reports, users, parts, customers
 from dotenv import load_dotenv
 from decimal import Decimal
+from markupsafe import Markup
+from cache import RefCache
+from fragments import FragmentCache
+from pagination import Page, page_links
+from facets import count_facets, facet_key
+from inventory import filters_from_args, load_vehicle_details, report_rows
+from search import SearchIndex, SearchDocument
+from ingest import Ingest, READERS
+from sessions import SignedSessionInterface
+from api import api
+from migrate import Migrator
+from export import EXPORTS, FORMATS, export_chunks, export_filename
+import auth
 
 load_dotenv()
 
@@ -11,35 +27,160 @@ app = Flask(__name__, static_url_path='/static', template_folder='templates')
 
 db = MyDatabase(app)
 
+# Signs the session cookie, has to be the same for every worker and stay put across restarts
+app.secret_key = os.getenv('SECRET_KEY')
+if not app.secret_key:
+    raise RuntimeError('Set SECRET_KEY (e.g. in .env) to a long random string')
+
+# Session data (role and name) rides in the signed cookie, identity never costs a query
+app.session_interface = SignedSessionInterface(
+    idle_timeout=int(os.getenv('SESSION_IDLE_TIMEOUT', 3600)),
+)
+
+
+# JSON API, /api always points at the newest version
+app.register_blueprint(api, url_prefix='/api/v1')
+app.register_blueprint(api, url_prefix='/api', name='api_latest')
+
+
+# Cache for the reference data behind the dropdowns and customer lists
+ref_cache = RefCache(
+    max_entries=int(os.getenv('REF_CACHE_MAX_ENTRIES', 64)),
+    default_ttl=int(os.getenv('REF_CACHE_TTL', 300)),
+)
+
+# Key -> (vehicleSQL method, TTL in seconds, invalidation tags)
+# Dropdown data barely changes so it can live for an hour
+REFERENCE_QUERIES = {
+    'manufacturer': ('vehicle_names', 3600, ('inventory',)),
+    'vehicle_types': ('vehicle_type', 3600, ('inventory',)),
+    'vehicle_years': ('vehicle_years', 3600, ('inventory',)),
+    'fuel_types': ('vehicle_fuel_type', 3600, ('inventory',)),
+    'colors': ('colors', 3600, ('inventory',)),
+}
+
+for key, (method, ttl, tags) in REFERENCE_QUERIES.items():
+    ref_cache.register(key, ttl=ttl, tags=tags)
+
+# Filter bar counts, cached per ('facets', listing, filters) key and dropped with the inventory
+ref_cache.register('facets', ttl=int(os.getenv('FACET_CACHE_TTL', 60)), tags=('inventory', 'parts'))
+
+# Loads search documents for the whole inventory (streamed, it can be big) or for one vehicle
+def search_documents(vehicle_id=None):
+    statement = cars.vehicleSQL().search_documents(vehicle_id)
+    rows = db.query(statement) if vehicle_id is not None else db.stream(statement, batch_size=app.config['STREAM_BATCH_SIZE'])
+    for row in rows:
+        yield SearchDocument._make(row[field] for field in SearchDocument._fields)._replace(sold=bool(row['sold']))
+
+
+# Text search over VIN, model, manufacturer, type, colors and description, answered from memory
+search_index = SearchIndex(search_documents, max_age=int(os.getenv('SEARCH_INDEX_MAX_AGE', 600)))
+
+# Rendered vehicle cards for the listing pages. A card only changes when its vehicle_rollup row does,
+# and every rollup write bumps row_version, so (vehicleID, row_version) is a safe key even across processes
+fragment_cache = FragmentCache(max_entries=int(os.getenv('FRAGMENT_CACHE_MAX_ENTRIES', 5000)))
 
-# Function that returns all the SQL queries
-def sql_queries():
 
+@app.template_global()
+def vehicle_card(car, display_color=False):
+    display_color = display_color == True
+    if car.get('row_version') is None:
+        # No rollup row yet, nothing to key the card on
+        return Markup(render_template('vehicle_card.html', car=car, display_color=display_color))
+    key = (car['vehicleID'], car['row_version'], display_color)
+    return fragment_cache.render(car['vehicleID'], key, 'vehicle_card.html', car=car, display_color=display_color)
+
+
+# Most customers the typeahead returns per request, and how much has to be typed before it searches
+app.config['CUSTOMER_SEARCH_LIMIT'] = int(os.getenv('CUSTOMER_SEARCH_LIMIT', 10))
+CUSTOMER_SEARCH_MIN_CHARS = 2
+
+# Number of vehicle cards per listing page, ?per_page= can override it up to pagination.MAX_PAGE_SIZE
+app.config['PAGE_SIZE'] = int(os.getenv('PAGE_SIZE', 24))
+
+# Rows pulled off the server-side cursor at a time when streaming the full inventory
+app.config['STREAM_BATCH_SIZE'] = int(os.getenv('STREAM_BATCH_SIZE', 200))
+
+# Vehicles per transaction for bulk ingest
+app.config['INGEST_CHUNK_SIZE'] = int(os.getenv('INGEST_CHUNK_SIZE', 500))
+
+
+# Returns the result for one reference query, only hitting the database on a cache miss
+def cached_query(key):
+    method = REFERENCE_QUERIES[key][0]
     vSQL = cars.vehicleSQL()
+    return ref_cache.get(key, lambda: db.query(getattr(vSQL, method)()))
+
+
+# Dictionary that only runs (or reads from cache) the reference queries a page actually uses
+class ReferenceData(dict):
+
+    def __missing__(self, key):
+        if key not in REFERENCE_QUERIES:
+            raise KeyError(key)
+        self[key] = cached_query(key)
+        return self[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+# Function that returns all the SQL queries
+def sql_queries():
 
     # To loop through sql queries:
     # https://stackoverflow.com/questions/16947276/flask-sqlalchemy-iterate-column-values-on-a-single-row
-    queries = {
-        'all_vehicles': vSQL.display_vehicles(),
-        'vehicles': vSQL.all_vehicles(),
-        'manufacturer': vSQL.vehicle_names(),
-        'vehicle_types': vSQL.vehicle_type(),
-        'vehicle_years': vSQL.vehicle_years(),
-        'fuel_types': vSQL.vehicle_fuel_type(),
-        'colors': vSQL.colors(),
-        'users': vSQL.users(),
-        'customers': vSQL.customers(),
-    }
 
-    # Dictionary for car queries
-    all_cars = {}
+    # Keys are filled in on first access so listing pages never pull the whole inventory just for the dropdowns
+    return ReferenceData()
+
+
+# Reference data the filter bar needs
+FILTER_REFERENCES = ('manufacturer', 'vehicle_types', 'vehicle_years', 'fuel_types', 'colors')
+
+
+# Cacheable loads for paged_query: name -> (cache key, statement, transform applied to the rows or None)
+def reference_loads(keys):
+    vSQL = cars.vehicleSQL()
+    return {key: (key, getattr(vSQL, REFERENCE_QUERIES[key][0])(), None) for key in keys}
+
+
+# Runs one keyset page of a listing query and returns the rows plus prev/next links
+# Anything in `cached` that isn't in ref_cache is queried at the same time as the page and cached,
+# the loaded values come back as a dict (a failed one is just missing from it)
+def paged_query(sql_for_page, endpoint, cached=None):
+    page = Page.from_args(request.args, default_size=app.config['PAGE_SIZE'])
+    queries = {'listing': sql_for_page(page)}
+    loaded = {}
+    generations = {}
+    for name, (cache_key, statement, transform) in (cached or {}).items():
+        generations[name] = ref_cache.generation(cache_key)
+        hit, value = ref_cache.peek(cache_key)
+        if hit:
+            loaded[name] = value
+        else:
+            queries[name] = statement
+
+    results = db.query_parallel(queries)
+
+    # The page is what the user came for: if it timed out or failed next to the others, run it again
+    # on its own (the request's connection, no deadline) and only fail if that fails too
+    if 'listing' in results.errors:
+        app.logger.warning('Parallel listing query failed (%r), running it serially', results.errors['listing'])
+        results['listing'] = db.query(queries['listing'])
 
-    # Loop through queries dictionary and match the data key to the sql value
-    for key, sql in queries.items():
-        all_cars[key] = db.query(sql)
+    for name in queries:
+        if name == 'listing' or name in results.errors:
+            continue
+        cache_key, statement, transform = cached[name]
+        loaded[name] = transform(results[name]) if transform else results[name]
+        ref_cache.put(cache_key, loaded[name], generations[name])
 
-    # Return the dictionary
-    return all_cars
+    rows, next_cursor, prev_cursor = page.finish(results['listing'])
+    return rows, page_links(url_for(endpoint), request.args, next_cursor, prev_cursor), loaded
 
 
 @app.route('/')
@@ -47,138 +188,88 @@ def sql_queries():
 def home():
 
     # Filter help from my boi ezi as well
+    filters = filters_from_args(request.args)
 
-    # First get the information related to the key from the URL
-    manID = request.args.get('manufacturer_name')
-    vehicletypeID = request.args.get('vehicle_type')
-    modelyear = request.args.get('model_year')
-    fueltype = request.args.get('fuel_type')
-    colorid = request.args.get('color_selection')
+    qSQL = cars.vehicleSQL()
 
-    # Dictionary for the filters
-    filters = {}
+    # For Buyers, show all unsold vehicles otherwise see sellable vehicles
+    sellable = session.get('role') != 'Buyer'
+    if sellable:
+        listing = qSQL.sellable_vehicles
+    else:
+        listing = qSQL.unsold_vehicles
 
-    # Add the information to the dictionary if it exists
-    try:
-        if manID:
-            filters['manID'] = int(manID)
-    except ValueError:
-        pass
-    try:
-        if vehicletypeID:
-            filters['vehicletypeID'] = int(vehicletypeID)
-    except ValueError:
-        pass
-    try:
-        if modelyear:
-            filters['model_year'] = int(modelyear)
-    except ValueError:
-        pass
-    if fueltype:
-        filters['fueltype'] = fueltype
-    try:
-        if colorid:
-            filters['colorid'] = int(colorid)
-    except ValueError:
-        pass
+    # The page, the filter bar's reference data and the facet counts don't depend on each other,
+    # so whatever isn't cached is fetched side by side
+    cached = reference_loads(FILTER_REFERENCES)
 
-    qSQL = cars.vehicleSQL()
+    # How many of the listed vehicles each dropdown option would leave
+    cached['facets'] = (facet_key(filters, sellable), qSQL.facet_counts(filters if filters else None, sellable), count_facets)
 
-    car_query = sql_queries()
+    output, pager, loaded = paged_query(lambda page: listing(filters if filters else None, page), 'home', cached)
 
-    # For Buyers, show all unsold vehicles otherwise see sellable vehicles
-    if session.get('role') == 'Buyer':
-        output = db.query(qSQL.unsold_vehicles(filters if filters else None))
-    else:
-        output = db.query(qSQL.sellable_vehicles(filters if filters else None))
+    # A reference query that failed is retried on its own when the template asks for it
+    car_query = ReferenceData({key: loaded[key] for key in FILTER_REFERENCES if key in loaded})
+    facets = loaded.get('facets')
 
-    return render_template('display.html', cars=car_query, vehicles=output, include_filters=True, display_color=True)
+    return render_template('display.html', cars=car_query, vehicles=output, pager=pager, include_filters=True, display_color=True,
+                           facets=facets, selected=filters)
 
-# Route for the vehicle details, takes a dynamic paramter for the sql query
-@app.route('/vehicle/<vehicle_id>')
-def vehicle_details(vehicle_id):
+# Same visibility as the listings: owners see everything, buyers every unsold car, everyone else sellable cars
+def search_visible(role):
+    if role == 'Owner':
+        return None
+    if role == 'Buyer':
+        return lambda doc: not doc.sold
+    return lambda doc: not doc.sold and not doc.pending_parts
 
-    qSQL = cars.vehicleSQL()
-    car_query = qSQL.vehicle_details(vehicle_id)
-    output = db.query(car_query)
 
-    # Get the first item in the dictionary which is only 1 car long but anyways then display it on the details template
-    car = output[0]
+def run_search():
+    q = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', default=50, type=int), 200))
 
-    
-    # Get parts for the vehicle, excepct some don't have parts so handle that
-    try:
-        vid = int(vehicle_id)
-    except (TypeError, ValueError):
-        vid = None
+    # The first search starts the background rebuilder (and waits for its first build), so CLI
+    # commands, the bench and workers that never search don't load the inventory at all
+    search_index.start(app.app_context)
+    total, results = search_index.search(q, limit=limit, visible=search_visible(session.get('role')))
+    return q, total, results
 
-    # Dictionary for car parts
-    parts = []
-    
-    # If there is a vechile id
-    if vid is not None:
-        parts_sql = qSQL.parts_for_vehicle(vid)
-        parts = db.query(parts_sql)
-
-
-    seller = None
-    buyer = None
-    if vid is not None:
-
-        # Get cusomter information
-        tc_sql = qSQL.transaction_customers(vid)
-        tc_res = db.query(tc_sql)
-
-        # If database returne result
-        if tc_res and len(tc_res) > 0:
-
-            # Take the first row(Should only be 1)
-            row = tc_res[0]
-
-            # Populater seller then buyer with the correct information
-            if row.get('seller_customerID') is not None:
-                seller = {
-                    'first_name': row.get('seller_first_name'),
-                    'last_name': row.get('seller_last_name'),
-                    'street': row.get('seller_street'),
-                    'city': row.get('seller_city'),
-                    'state': row.get('seller_state'),
-                    'postal_code': row.get('seller_postal_code'),
-                    'phone_number': row.get('seller_phone_number'),
-                    'email_address': row.get('seller_email_address')
-                }
-            if row.get('buyer_customerID') is not None:
-                buyer = {
-                    'first_name': row.get('buyer_first_name'),
-                    'last_name': row.get('buyer_last_name'),
-                    'street': row.get('buyer_street'),
-                    'city': row.get('buyer_city'),
-                    'state': row.get('buyer_state'),
-                    'postal_code': row.get('buyer_postal_code'),
-                    'phone_number': row.get('buyer_phone_number'),
-                    'email_address': row.get('buyer_email_address')
-                }
-
-    # Determine sale eligibility; asked Gemini for help on this logic
-    sold = buyer is not None
-    all_parts_installed = True
-    for p in parts or []:
-        if p.get('status') != 'Installed':
-            all_parts_installed = False
-            break
-    eligible_for_sale = (not sold) and all_parts_installed
-
-    return render_template('details.html', car=car, parts=parts, seller=seller, buyer=buyer, eligible_for_sale=eligible_for_sale)
+
+@app.route('/search')
+def search():
+    q, total, results = run_search()
+    # Same cards as the listings. The documents carry every field the card shows but no row_version,
+    # so these render uncached
+    vehicles = [doc._asdict() for doc in results]
+    return render_template('search.html', q=q, total=total, vehicles=vehicles, display_color=True)
+
+
+@app.route('/search.json')
+def search_json():
+    q, total, results = run_search()
+    return jsonify(query=q, total=total, results=[doc._asdict() for doc in results])
+
+
+# Route for the vehicle details, takes a dynamic paramter for the sql query
+@app.route('/vehicle/<int:vehicle_id>')
+def vehicle_details(vehicle_id):
+
+    details = load_vehicle_details(db, vehicle_id)
+    if details is None:
+        abort(404)
+
+    return render_template('details.html', **details)
 
 # Page to select a customer with dynamic routing for buy or sell
 @app.route('/select_customer/<int:vehicle_id>/<action>', methods=['GET', 'POST'])
 def select_customer(vehicle_id, action):
 
-    vSQL = cars.vehicleSQL()
-    customers = db.query(vSQL.customers())
-
     # This is to display the a newly created customer(with help from Gemini ofc)
     selected_customer_id = request.args.get('selected_customer_id', default=None, type=int)
+    selected_customer = None
+    if selected_customer_id:
+        rows = db.query(customers.customerSQL().by_id(selected_customer_id))
+        selected_customer = rows[0] if rows else None
 
     # If posting back, redirect to buy or sell page with selected customer
     if request.method == 'POST':
@@ -192,7 +283,7 @@ def select_customer(vehicle_id, action):
             else:
                 return redirect(url_for('buy_vehicle', customer_id=cust_id, vehicle_id=vehicle_id))
 
-    return render_template('select_customer.html', customers=customers, vehicle_id=vehicle_id, action=action, selected_customer_id=selected_customer_id)
+    return render_template('select_customer.html', vehicle_id=vehicle_id, action=action, selected_customer=selected_customer)
 
 
 # Buy vehicle page
@@ -207,7 +298,7 @@ def buy_vehicle(customer_id, vehicle_id):
 
     # Get the userID
     try:
-        cur = db.mysql.connection.cursor()
+        cur = db.cursor('app.buy_vehicle')
         cur.execute("SELECT userID FROM csc206cars.salestransactions WHERE vehicleID = %s LIMIT 1", (vehicle_id,))
         row = cur.fetchone()
         if row:
@@ -234,10 +325,6 @@ def buy_vehicle(customer_id, vehicle_id):
 @app.route('/sell_vehicle/<int:vehicle_id>', methods=['GET', 'POST'])
 def sell_vehicle(vehicle_id):
 
-    
-    qSQL = cars.vehicleSQL()
-    customers = db.query(qSQL.customers())
-
     # Get the customer & sale date
     if request.method == 'POST':
         cust_id = request.form.get('customerID', type=int)
@@ -248,7 +335,7 @@ def sell_vehicle(vehicle_id):
             flash('Sale details captured. Completing sale coming soon.')
             return redirect(url_for('vehicle_details', vehicle_id=vehicle_id))
 
-    return render_template('sell_vehicle.html', customers=customers, vehicle_id=vehicle_id)
+    return render_template('sell_vehicle.html', vehicle_id=vehicle_id)
 
 
     
@@ -298,9 +385,10 @@ def create_customer():
             flash(f"Missing required fields: {', '.join(missing)}")
             return render_template('create_customer.html', vehicle_id=vehicle_id, action=action)
 
-        # Insert into database
+        # Insert into database, and keep this session on the primary so the redirect sees the new customer
+        db.pin_primary()
         try:
-            cur = db.mysql.connection.cursor()
+            cur = db.cursor('app.create_customer')
 
             insert_sql = (
                 "INSERT INTO csc206cars.customers "
@@ -319,7 +407,7 @@ def create_customer():
                 postal_code,
                 business_name,
             ))
-            db.mysql.connection.commit()
+            db.connection.commit()
             # Get the newly inserted customer's id
             new_customer_id = cur.lastrowid
             cur.close()
@@ -337,11 +425,20 @@ def create_customer():
 def all_vehicles():
     
     qSQL = cars.vehicleSQL()
-    output = db.query(qSQL.display_vehicles())
 
-    car_query = sql_queries()
+    # ?stream=1 sends the whole inventory, streaming cards to the browser as rows arrive
+    if request.args.get('stream') == '1':
+        car_query = sql_queries()
+        vehicles = db.stream(qSQL.display_vehicles(), batch_size=app.config['STREAM_BATCH_SIZE'])
+        return app.response_class(
+            stream_template('all_vehicles.html', vehicles=vehicles, cars=car_query, pager=None, streaming=True, include_filters=True, display_color=True),
+            mimetype='text/html',
+        )
+
+    output, pager, loaded = paged_query(qSQL.display_vehicles, 'all_vehicles', reference_loads(FILTER_REFERENCES))
+    car_query = ReferenceData(loaded)
 
-    return render_template('all_vehicles.html', vehicles=output, cars=car_query, include_filters=True, display_color=True)
+    return render_template('all_vehicles.html', vehicles=output, cars=car_query, pager=pager, include_filters=True, display_color=True)
 
 
 
@@ -349,32 +446,68 @@ def all_vehicles():
 @app.route('/sales')
 def sales():
 
-    qSQL = cars.vehicleSQL()
-    output = db.query(qSQL.sale())
+    output, as_of = report_rows(db, 'sale')
 
-    return render_template('reports.html', info=output)
+    return render_template('reports.html', info=output, as_of=as_of)
 
 
 @app.route('/seller')
 def seller():
 
-    qSQL = cars.vehicleSQL()
-    output = db.query(qSQL.seller())
+    output, as_of = report_rows(db, 'seller')
 
-    return render_template('seller.html', info=output)
+    return render_template('seller.html', info=output, as_of=as_of)
 
 
 @app.route('/statistics')
 def stats():
 
-    qSQL = cars.vehicleSQL()
-    output = db.query(qSQL.statistics())
+    output, as_of = report_rows(db, 'statistics')
+
+    return render_template('statistics.html', info=output, as_of=as_of)
+
+
+# Spreadsheet downloads of the reports and the whole inventory, e.g. /export/sales.csv or
+# /export/inventory.jsonl?gzip=1. Rows go out as they come off the cursor, in a chunked response
+@app.route('/export/<name>.<fmt>')
+def export(name, fmt):
+    if session.get('role') not in ('Owner', 'Admin'):
+        abort(403)
+    if name not in EXPORTS or fmt not in FORMATS:
+        abort(404)
+
+    compress = request.args.get('gzip') == '1'
+    chunks = export_chunks(db, name, fmt, compress, batch_size=app.config['STREAM_BATCH_SIZE'])
+    response = app.response_class(stream_with_context(chunks), mimetype='application/gzip' if compress else FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{export_filename(name, fmt, compress)}"'
+    return response
+
+
+# Query stats, slow query log, connection pool, replica and cache stats, only for the owner/admin
+@app.route('/metrics')
+def metrics():
+    if session.get('role') not in ('Owner', 'Admin'):
+        abort(403)
+    return jsonify(db=db.instrumentation.snapshot(), pool=db.pool.stats(), parallel_pool=db.parallel_pool.stats(),
+                   replicas=db.replicas.stats(), ref_cache=ref_cache.stats(), fragments=fragment_cache.stats(),
+                   search=search_index.stats(), queries=cars.INVENTORY_QUERIES.fingerprints())
+
+
+# Typeahead behind the customer pickers: customers whose name, phone, email or ID number starts with ?q=
+@app.route('/customers/search.json')
+def customer_search():
+    # Customer contact details are for signed in staff only
+    if not session.get('role'):
+        abort(403)
 
-    return render_template('statistics.html', info=output)
+    term = ' '.join(request.args.get('q', '').split())
+    if len(term) < CUSTOMER_SEARCH_MIN_CHARS:
+        return jsonify(customers=[])
 
+    limit = request.args.get('limit', default=app.config['CUSTOMER_SEARCH_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['CUSTOMER_SEARCH_LIMIT']))
+    return jsonify(customers=db.query(customers.customerSQL().search(term, limit)))
 
-# Modified sessions.py code with render template instaed of returning a html snippet
-app.secret_key = 'BAD_SECRET_KEY' 
 
 # Defines length of permanent sessions
 app.permanent_session_lifetime = timedelta(minutes=1)
@@ -388,17 +521,17 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
 
-        # Query from sql_queries method
-        car_query = sql_queries()
-        users = car_query.get('users', [])
-
-        # Find matching user from DB results
-        user = next((u for u in users if u.get('username') == username), None)
+        # Single lookup on the unique username index
+        rows = db.query(users.userSQL().by_username(username or ''))
+        user = rows[0] if rows else None
 
-        # If the username and password have corrosponding matches in the database
-        if user and user.get('password') == password:
+        # If the username exists and the password matches its hash
+        if auth.verify_password(user, password or ''):
             session.permanent = False
 
+            # Fresh session for the logged in user
+            app.session_interface.regenerate(session)
+
             # Store information from the user dictionary in session object
             session['role'] = user.get('role')
             session['first_name'] = user.get('first_name')
@@ -440,18 +573,36 @@ def delete_session():
     return redirect(url_for('login'))
 
 
+# Who may change part statuses, the roles templates/details.html shows the parts table to
+PARTS_ROLES = ('Owner', 'Buyer')
+
 # Marks a part as installed and updates the database
 @app.route('/install_part/<int:part_id>', methods=['POST'])
 def install_part(part_id):
+    if session.get('role') not in PARTS_ROLES:
+        abort(403)
+
     vehicle_id = request.form.get('vehicle_id')
 
-    # Connect to database and update part
+    # Connect to database and update part, the details page we redirect to reads from the primary
+    db.pin_primary()
     try:
-        cur = db.mysql.connection.cursor()
+        cur = db.cursor('app.install_part')
+
+        # Keep the vehicle rollup (and its inventory state) in step, in the same transaction as the part update
+        for statement in rollup.rollupSQL().part_installed(part_id):
+            cur.execute(*statement)
+
         update_sql = "UPDATE csc206cars.parts SET status = 'Installed' WHERE partID = %s"
         cur.execute(update_sql, (part_id,))
-        db.mysql.connection.commit()
+        db.connection.commit()
         cur.close()
+
+        # Cached inventory rows include part totals, so drop them
+        ref_cache.invalidate_tag('parts')
+        if vehicle_id and vehicle_id.isdigit():
+            fragment_cache.invalidate(int(vehicle_id))
+            search_index.refresh(int(vehicle_id))
         flash('Part marked as Installed.')
     except Exception as e:
         flash(f'Error installing part: {e}')
@@ -462,5 +613,225 @@ def install_part(part_id):
     return redirect(url_for('home'))
 
 
+# Moves a batch of a vehicle's parts forward (Ordered -> Received -> Installed) in one UPDATE:
+# the parts ticked on the details page (scope=selected), one part order (scope=order) or all of them (scope=vehicle)
+@app.route('/vehicle/<int:vehicle_id>/parts', methods=['POST'])
+def update_parts(vehicle_id):
+    # Same roles the details page shows the parts form to
+    if session.get('role') not in PARTS_ROLES:
+        abort(403)
+
+    status = request.form.get('status', 'Installed')
+    scope = request.form.get('scope', 'selected')
+    wants_json = request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+    batch, problem = {}, None
+    if scope == 'selected':
+        batch['part_ids'] = request.form.getlist('part_ids', type=int)
+        if not batch['part_ids']:
+            problem = 'Select at least one part.'
+    elif scope == 'order':
+        batch['part_order_id'] = request.form.get('part_order_id', type=int)
+        if batch['part_order_id'] is None:
+            problem = 'Pick a part order.'
+    elif scope != 'vehicle':
+        problem = 'Scope must be selected, order or vehicle.'
+    if status not in parts.PART_STATUSES:
+        problem = 'Status must be one of ' + ', '.join(parts.PART_STATUSES) + '.'
+
+    if problem:
+        if wants_json:
+            return jsonify(error=problem), 400
+        flash(problem)
+        return redirect(url_for('vehicle_details', vehicle_id=vehicle_id))
+
+    pSQL = parts.partSQL()
+    db.pin_primary()
+    try:
+        cur = db.cursor('app.update_parts')
+        cur.execute(*pSQL.transition(vehicle_id, status, **batch))
+        updated = cur.rowcount
+
+        # Recount the rollup in the same transaction, a batch can move parts in and out of "uninstalled"
+        cur.execute(*rollup.rollupSQL().rebuild(vehicle_id))
+        cur.execute(*pSQL.eligibility(vehicle_id))
+        ordered, received, installed, eligible = cur.fetchone()
+        db.connection.commit()
+        cur.close()
+
+        state = {
+            'vehicle_id': vehicle_id,
+            'status': status,
+            'updated': updated,
+            'ordered': int(ordered or 0),
+            'received': int(received or 0),
+            'installed': int(installed or 0),
+            'eligible_for_sale': bool(eligible),
+        }
+        ref_cache.invalidate_tag('parts')
+        fragment_cache.invalidate(vehicle_id)
+        search_index.refresh(vehicle_id)
+    except Exception as e:
+        db.connection.rollback()
+        if wants_json:
+            return jsonify(error=str(e)), 500
+        flash(f'Error updating parts: {e}')
+        return redirect(url_for('vehicle_details', vehicle_id=vehicle_id))
+
+    if wants_json:
+        return jsonify(state)
+
+    flash(f"{updated} part{'' if updated == 1 else 's'} marked {status}.")
+    return redirect(url_for('vehicle_details', vehicle_id=vehicle_id))
+
+
+# Runs a bulk ingest and lets the caches and search index know about the new vehicles
+def run_ingest(stream, fmt, chunk_size):
+    # The lookups and VIN checks have to see what earlier chunks just wrote
+    db.pin_primary()
+    job = Ingest(db, chunk_size=chunk_size)
+    report = job.run(READERS[fmt](stream))
+    if job.vehicle_ids:
+        ref_cache.invalidate_tag('inventory', 'parts')
+        if len(job.vehicle_ids) <= 200:
+            search_index.refresh(*job.vehicle_ids)
+        else:
+            search_index.expire()
+    return report
+
+
+# Upload a CSV or JSONL file of vehicles (see ingest.py for the layout), answers with a JSON report
+@app.route('/ingest', methods=['POST'])
+def ingest_upload():
+    if session.get('role') not in ('Owner', 'Admin', 'Inventory Clerk'):
+        abort(403)
+
+    upload = request.files.get('file')
+    if upload is None:
+        abort(400, description='Send the file as multipart field "file"')
+    fmt = request.form.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+    if fmt not in READERS:
+        abort(400, description='Format must be csv or jsonl')
+    chunk_size = request.form.get('chunk_size', default=app.config['INGEST_CHUNK_SIZE'], type=int)
+
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+    return jsonify(run_ingest(stream, fmt, chunk_size))
+
+
+# Bulk loads vehicles from a file: flask --app app ingest lot.csv
+@app.cli.command('ingest')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(sorted(READERS)), help='defaults to the file extension')
+@click.option('--chunk-size', type=int, default=None, help='vehicles per transaction')
+def ingest_file(path, fmt, chunk_size):
+    fmt = fmt or path.rsplit('.', 1)[-1].lower()
+    if fmt not in READERS:
+        raise click.UsageError('Pass --format csv or --format jsonl')
+    with open(path, encoding='utf-8', newline='') as f:
+        report = run_ingest(f, fmt, chunk_size or app.config['INGEST_CHUNK_SIZE'])
+
+    print(f"Loaded {report['vehicles']} vehicles, {report['colors']} colors, {report['purchases']} purchases, "
+          f"{report['part_orders']} part orders and {report['parts']} parts "
+          f"in {report['seconds']}s ({report['rows_per_second']} rows/s)")
+    for error in report['errors']:
+        print(f"  line {error['line']} ({error['vin']}): {error['error']}")
+    if report['error_count'] > len(report['errors']):
+        print(f"  ... and {report['error_count'] - len(report['errors'])} more errors")
+
+
+# Applies pending schema migrations (sql/migrations.py): flask --app app migrate
+# --to N stops at version N, --down rolls back everything newer than N, --status only lists them
+@app.cli.command('migrate')
+@click.option('--to', 'target', type=int, default=None, help='version to stop at')
+@click.option('--down', is_flag=True, help='roll back to --to (default 0, i.e. everything)')
+@click.option('--status', is_flag=True, help='list migrations and when they were applied')
+def migrate(target, down, status):
+    migrator = Migrator(db)
+    if status:
+        for version, name, applied_at in migrator.status():
+            print(f"{version:4}  {name:32} {applied_at or 'pending'}")
+        return
+
+    if down:
+        done = migrator.downgrade(target or 0)
+        verb = 'Rolled back'
+    else:
+        done = migrator.upgrade(target)
+        verb = 'Applied'
+
+    for migration in done:
+        print(f'{verb} {migration.version} {migration.name}')
+    if not done:
+        print('Nothing to do')
+
+
+# Writes a report or the whole inventory to a file or stdout as it streams in:
+# flask --app app export sales --format csv --gzip -o sales.csv.gz
+@app.cli.command('export')
+@click.argument('name', type=click.Choice(list(EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='gzip the output')
+@click.option('--out', '-o', type=click.Path(dir_okay=False), default='-', help='defaults to stdout')
+def export_file(name, fmt, compress, out):
+    with click.open_file(out, 'wb') as f:
+        for chunk in export_chunks(db, name, fmt, compress, batch_size=app.config['STREAM_BATCH_SIZE']):
+            f.write(chunk)
+
+
+# Widens users.password and replaces plaintext passwords with salted hashes: flask --app app hash-passwords
+@app.cli.command('hash-passwords')
+def hash_passwords():
+    uSQL = users.userSQL()
+    cur = db.cursor('app.hash_passwords')
+    try:
+        # Widen first, a hash written into the old varchar(50) would be cut off
+        # (MySQL commits the ALTER on its own, running it again is harmless)
+        cur.execute(uSQL.widen_password_column())
+
+        # Plain cursor, so rows are (userID, password) tuples
+        cur.execute(uSQL.all_passwords())
+        plaintext = [(user_id, password) for user_id, password in cur.fetchall() if not auth.is_hashed(password)]
+        for user_id, password in plaintext:
+            cur.execute(*uSQL.set_password(user_id, auth.hash_password(password)))
+
+        # All of the passwords or none of them
+        db.connection.commit()
+    except Exception:
+        db.connection.rollback()
+        raise
+    finally:
+        cur.close()
+    print(f'Hashed {len(plaintext)} passwords')
+
+
+# Creates the vehicle_rollup table if needed and backfills it: flask --app app rebuild-rollup
+@app.cli.command('rebuild-rollup')
+def rebuild_rollup():
+    rSQL = rollup.rollupSQL()
+    cur = db.cursor('app.rebuild_rollup')
+    cur.execute(rSQL.create_table())
+    cur.execute(rSQL.rebuild())
+    db.connection.commit()
+    print(f'Rebuilt vehicle rollup ({cur.rowcount} rows affected)')
+    cur.close()
+    ref_cache.invalidate_tag('parts')
+
+
+# Creates the report snapshot tables if needed and recomputes them: flask --app app rebuild-reports
+@app.cli.command('rebuild-reports')
+def rebuild_reports():
+    reSQL = reports.reportSQL()
+    cur = db.cursor('app.rebuild_reports')
+    for sql in reSQL.create_tables():
+        cur.execute(sql)
+
+    # Swap the contents in one transaction so readers never see a half built report
+    for sql in reSQL.rebuild():
+        cur.execute(sql)
+    db.connection.commit()
+    cur.close()
+    print('Rebuilt sales, seller and statistics snapshots')
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,36 @@
+import hmac
+import os
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# werkzeug method string, raise the iteration count as hardware gets faster
+HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+
+# Prefixes werkzeug writes in front of a hash, anything else in the column is a legacy plaintext password
+HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+
+# Checked against when the username doesn't exist so a miss takes as long as a wrong password
+_DUMMY_HASH = generate_password_hash('not a real password', method=HASH_METHOD)
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=HASH_METHOD)
+
+
+def is_hashed(stored):
+    return bool(stored) and stored.startswith(HASH_PREFIXES)
+
+
+# True if the password matches the user row (or None for an unknown username)
+def verify_password(user, password):
+    if user is None:
+        check_password_hash(_DUMMY_HASH, password)
+        return False
+
+    stored = user.get('password') or ''
+    if is_hashed(stored):
+        return check_password_hash(stored, password)
+
+    # Rows not yet converted by `flask --app app hash-passwords`
+    return hmac.compare_digest(stored.encode(), password.encode())
@@ -0,0 +1,54 @@
+'''
+Plan check: runs EXPLAIN on every vehicleSQL query (the same cases bench/run.py times, with ids and
+filter values picked from the loaded data) and exits 1 if any of them reads a whole table that holds
+more than --max-rows rows. Point it at a realistic dataset (e.g. one loaded with bench/run.py --load),
+on a tiny one the planner scans everything because that's cheapest:
+
+    python bench/explain.py --max-rows 1000
+'''
+import argparse
+import sys
+
+from run import app, db, dataset_counts, sample_arguments, query_cases
+from sql.builder import Statement
+
+
+# Plan rows for a full table scan that are over the limit. <derived2>, <subquery3> and friends are
+# MySQL's own temporary tables, the scans that fill them show up as rows of their own
+def full_scans(plan, max_rows):
+    return [row for row in plan
+            if row.get('type') == 'ALL'
+            and not str(row.get('table') or '').startswith('<')
+            and (row.get('rows') or 0) > max_rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fail if a vehicleSQL query plans a large full table scan')
+    parser.add_argument('--max-rows', type=int, default=1000,
+                        help='full scans estimated at more rows than this fail the check')
+    parser.add_argument('--unpaged', action='store_true',
+                        help='also check the [all] cases, which return the whole inventory by design')
+    args = parser.parse_args(argv)
+
+    failures = 0
+    with app.app_context():
+        sample = sample_arguments(dataset_counts())
+        for name, statement in query_cases(sample):
+            if name.endswith('[all]') and not args.unpaged:
+                continue
+            sql, params = statement if isinstance(statement, Statement) else (statement, None)
+            scans = full_scans(db.explain(sql, params), args.max_rows)
+            if not scans:
+                print(f'  ok    {name}')
+                continue
+
+            failures += 1
+            for row in scans:
+                print(f"  FAIL  {name}: full scan of {row['table']} (~{row['rows']} rows, Extra: {row.get('Extra')})")
+
+    print(f'{failures} queries with full table scans over {args.max_rows} rows', file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+'''
+Seeded synthetic data generator for the csc206cars schema.
+
+Learns its distributions from instance/GenevaAuto.sql (manufacturer/model mix, years, fuel types,
+colors per vehicle, part orders per vehicle, part costs, prices, who buys and sells) and writes a
+SQL file with the same tables at any size. Load GenevaAuto.sql first for the schema and the
+reference tables (colors, manufacturers, vehicletypes, vendors, users), then the generated file:
+
+    python bench/generate.py --vehicles 100000 --out bench/data/geneva_100k.sql
+    mysql csc206cars < bench/data/geneva_100k.sql
+
+Every statement sits on a single line so bench/run.py --load can replay the file.
+'''
+import argparse
+import ast
+import bisect
+import datetime
+import os
+import random
+import re
+import string
+import sys
+from collections import Counter
+
+
+SEED_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'GenevaAuto.sql')
+
+# The tables this script replaces, in foreign key order
+GENERATED_TABLES = ['vehicles', 'customers', 'vehiclecolors', 'purchasetransactions',
+                    'salestransactions', 'partorders', 'parts']
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+INSERT_PATTERN = re.compile(r"INSERT INTO `csc206cars`\.`(\w+)` \(([^)]*)\) VALUES (.*);\n")
+
+
+# Reads every INSERT in the seed dump into {table: [row dict, ...]}
+def load_seed(path=SEED_FILE):
+    tables = {}
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    for match in INSERT_PATTERN.finditer(text):
+        table, columns, values = match.groups()
+        columns = [c.strip('` ') for c in columns.split(',')]
+        rows = ast.literal_eval('[' + values.replace('NULL', 'None') + ']')
+        tables[table] = [dict(zip(columns, row)) for row in rows]
+    return tables
+
+
+class Sampler():
+
+    def __init__(self, values):
+        ''' Draws from the empirical distribution of a list of observed values'''
+        counts = Counter(values)
+        self.values = list(counts)
+        self.cumulative = []
+        total = 0
+        for value in self.values:
+            total += counts[value]
+            self.cumulative.append(total)
+        self.total = total
+
+    def __call__(self, rng):
+        return self.values[bisect.bisect_right(self.cumulative, rng.random() * self.total)]
+
+
+class Generator():
+
+    def __init__(self, seed_tables, vehicles, seed=206, batch_size=1000):
+        self.rng = random.Random(seed)
+        self.vehicles = vehicles
+        self.batch_size = batch_size
+        self.learn(seed_tables)
+
+    def learn(self, t):
+        vehicles = t['vehicles']
+        by_vehicle = {v['vehicleID']: v for v in vehicles}
+
+        # Keep manufacturer, model and type together so we don't invent a Ford Civic
+        self.models = Sampler([(v['manufacturerID'], v['model_name'], v['vehicle_typeID']) for v in vehicles])
+        self.years = Sampler([v['model_year'] for v in vehicles])
+        self.fuel = Sampler([v['fuel_type'] for v in vehicles])
+        self.descriptions = Sampler([v['description'] for v in vehicles])
+        self.mileage = [float(v['mileage']) for v in vehicles]
+
+        colors_per_vehicle = Counter(vc['vehicleID'] for vc in t['vehiclecolors'])
+        self.color_count = Sampler([colors_per_vehicle.get(v, 0) for v in by_vehicle])
+        self.colors = Sampler([vc['colorID'] for vc in t['vehiclecolors']])
+
+        orders_per_vehicle = Counter(po['vehicleID'] for po in t['partorders'])
+        self.order_count = Sampler([orders_per_vehicle.get(v, 0) for v in by_vehicle])
+        self.vendors = Sampler([po['vendorID'] for po in t['partorders']])
+        parts_per_order = Counter(p['part_orderID'] for p in t['parts'])
+        self.part_count = Sampler(list(parts_per_order.values()))
+        self.part_templates = Sampler([(p['part_number'].split('-')[0], p['description'], float(p['cost']), p['quantity'])
+                                       for p in t['parts']])
+        self.open_status = Sampler([p['status'] for p in t['parts'] if p['status'] != 'Installed'] or ['Ordered'])
+        self.installed_share = sum(p['status'] == 'Installed' for p in t['parts']) / max(len(t['parts']), 1)
+
+        purchases = t['purchasetransactions']
+        self.purchase_prices = [float(p['purchase_price']) for p in purchases]
+        self.conditions = Sampler([p['vehicle_condition'] for p in purchases])
+        self.buyers = Sampler([p['userID'] for p in purchases])
+        self.salespeople = Sampler([s['userID'] for s in t['salestransactions']])
+        self.sold_share = len(t['salestransactions']) / max(len(vehicles), 1)
+        self.purchased_share = len(purchases) / max(len(vehicles), 1)
+
+        dates = [datetime.date.fromisoformat(p['purchase_date']) for p in purchases]
+        self.first_date, self.last_date = min(dates), max(dates)
+
+        customers = t['customers']
+        self.customer_ratio = len(customers) / max(len(vehicles), 1)
+        self.first_names = Sampler([c['first_name'] for c in customers])
+        self.last_names = Sampler([c['last_name'] for c in customers])
+        self.places = Sampler([(c['city'], c['state'], c['postal_code']) for c in customers])
+        self.business_share = sum(1 for c in customers if c['business_name']) / max(len(customers), 1)
+        self.customer_total = max(int(self.vehicles * self.customer_ratio), 1)
+
+    def vin(self, index):
+        # Random prefix plus the index in base 36 keeps VINs unique without remembering them
+        digits = string.digits + string.ascii_uppercase
+        tail = ''
+        while index or len(tail) < 7:
+            index, r = divmod(index, 36)
+            tail = digits[r] + tail
+        prefix = ''.join(self.rng.choice(digits) for _ in range(17 - len(tail)))
+        return prefix + tail
+
+    def date_between(self, start, end):
+        return start + datetime.timedelta(days=self.rng.randint(0, max((end - start).days, 0)))
+
+    def customers(self):
+        rng = self.rng
+        for cid in range(1, self.customer_total + 1):
+            first, last = self.first_names(rng), self.last_names(rng)
+            city, state, postal = self.places(rng)
+            yield {
+                'customerID': cid,
+                'phone_number': ''.join(rng.choice(string.digits) for _ in range(10)),
+                'email_address': f'{first[0].lower()}{last.lower()}{cid}@example.com' if rng.random() < 0.8 else None,
+                'street': f'{rng.randint(1, 9999)} {rng.randint(1, 99)}-street',
+                'city': city,
+                'state': state,
+                'postal_code': postal,
+                'id_number': f'C{rng.randint(10**9, 10**10 - 1)}{cid}',
+                'first_name': first,
+                'last_name': last,
+                'business_name': f'{last} Holdings' if rng.random() < self.business_share else None,
+            }
+
+    def customer(self):
+        # Skewed towards low ids: a few repeat customers do a lot of the trading
+        return 1 + int(self.customer_total * self.rng.random() ** 3)
+
+    def rows(self):
+        ''' Yields (table, row) for every generated row, parents before children'''
+        rng = self.rng
+        for row in self.customers():
+            yield 'customers', row
+
+        color_id = order_id = part_id = 0
+        for vid in range(1, self.vehicles + 1):
+            manufacturer, model, vtype = self.models(rng)
+            yield 'vehicles', {
+                'vehicleID': vid,
+                'vin': self.vin(vid),
+                'mileage': round(rng.choice(self.mileage) * rng.uniform(0.8, 1.2), 1),
+                'description': self.descriptions(rng),
+                'model_name': model,
+                'model_year': self.years(rng),
+                'fuel_type': self.fuel(rng),
+                'manufacturerID': manufacturer,
+                'vehicle_typeID': vtype,
+            }
+
+            for colorID in {self.colors(rng) for _ in range(self.color_count(rng))}:
+                color_id += 1
+                yield 'vehiclecolors', {'vehicle_colorID': color_id, 'vehicleID': vid, 'colorID': colorID}
+
+            purchased = rng.random() < self.purchased_share
+            purchase_date = self.date_between(self.first_date, self.last_date)
+            if purchased:
+                yield 'purchasetransactions', {
+                    'purchase_transactionID': vid,
+                    'vehicleID': vid,
+                    'userID': self.buyers(rng),
+                    'customerID': self.customer(),
+                    'purchase_price': round(rng.choice(self.purchase_prices) * rng.uniform(0.85, 1.15), 2),
+                    'purchase_date': purchase_date.isoformat(),
+                    'vehicle_condition': self.conditions(rng),
+                }
+
+            # Only purchased vehicles get sold, and a sold vehicle has every part installed
+            sold = purchased and rng.random() < self.sold_share / max(self.purchased_share, 1e-9)
+            if sold:
+                yield 'salestransactions', {
+                    'sales_transactionID': vid,
+                    'vehicleID': vid,
+                    'userID': self.salespeople(rng),
+                    'customerID': self.customer(),
+                    'sales_date': self.date_between(purchase_date, purchase_date + datetime.timedelta(days=180)).isoformat(),
+                }
+
+            for order_number in range(1, self.order_count(rng) + 1):
+                order_id += 1
+                yield 'partorders', {'part_orderID': order_id, 'order_number': order_number,
+                                     'vehicleID': vid, 'vendorID': self.vendors(rng)}
+                for n in range(self.part_count(rng)):
+                    prefix, description, cost, quantity = self.part_templates(rng)
+                    part_id += 1
+                    installed = sold or rng.random() < self.installed_share
+                    yield 'parts', {
+                        'partID': part_id,
+                        'part_orderID': order_id,
+                        'part_number': f'{prefix}-{order_id:07d}{n:02d}',
+                        'cost': round(cost * rng.uniform(0.9, 1.1), 2),
+                        'description': description,
+                        'quantity': quantity,
+                        'status': 'Installed' if installed else self.open_status(rng),
+                    }
+
+
+def literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+# Writes the rows as batched multi-row INSERTs, one statement per line
+def write_sql(generator, out):
+    out.write('SET FOREIGN_KEY_CHECKS=0;\n')
+    out.write('SET UNIQUE_CHECKS=0;\n')
+    for table in reversed(GENERATED_TABLES):
+        out.write(f'DELETE FROM `csc206cars`.`{table}`;\n')
+
+    pending = {}
+    counts = Counter()
+
+    def flush(table):
+        rows = pending.pop(table, [])
+        if not rows:
+            return
+        columns = ','.join(f'`{c}`' for c in rows[0])
+        values = ','.join('(' + ', '.join(literal(v) for v in row.values()) + ')' for row in rows)
+        out.write(f'INSERT INTO `csc206cars`.`{table}` ({columns}) VALUES {values};\n')
+
+    for table, row in generator.rows():
+        pending.setdefault(table, []).append(row)
+        counts[table] += 1
+        if len(pending[table]) >= generator.batch_size:
+            flush(table)
+
+    for table in GENERATED_TABLES:
+        flush(table)
+
+    out.write('SET UNIQUE_CHECKS=1;\n')
+    out.write('SET FOREIGN_KEY_CHECKS=1;\n')
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic csc206cars dataset')
+    parser.add_argument('--vehicles', default='10k', help='number of vehicles, or one of ' + ', '.join(SCALES))
+    parser.add_argument('--seed', type=int, default=206)
+    parser.add_argument('--batch-size', type=int, default=1000, help='rows per INSERT statement')
+    parser.add_argument('--out', default='-', help='output file, - for stdout')
+    args = parser.parse_args(argv)
+
+    vehicles = SCALES.get(str(args.vehicles).lower()) or int(args.vehicles)
+    generator = Generator(load_seed(), vehicles, seed=args.seed, batch_size=args.batch_size)
+
+    if args.out == '-':
+        counts = write_sql(generator, sys.stdout)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w', encoding='utf-8') as out:
+            counts = write_sql(generator, out)
+
+    print(', '.join(f'{table}: {counts[table]}' for table in GENERATED_TABLES), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+'''
+Benchmark runner: times every vehicleSQL query and every Flask route against whatever
+dataset the configured database holds, and writes a JSON report that can be diffed between runs.
+
+    python bench/run.py --label 100k --load bench/data/geneva_100k.sql --out bench/results/100k.json
+    python bench/run.py --label 100k --out bench/results/100k-after.json
+    python bench/run.py --compare bench/results/100k.json bench/results/100k-after.json
+
+--load replays a file from bench/generate.py, applies pending migrations and rebuilds the rollup
+and report tables first.
+'''
+import argparse
+import datetime
+import inspect
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, ref_cache  # noqa: E402
+from migrate import Migrator  # noqa: E402
+from pagination import Page  # noqa: E402
+from sql import cars, rollup, reports  # noqa: E402
+
+
+# vehicleSQL methods that build pieces of other queries rather than being queries themselves
+HELPERS = {'apply_filters', 'listing_conditions'}
+
+COUNTED_TABLES = ['vehicles', 'customers', 'vehiclecolors', 'purchasetransactions',
+                  'salestransactions', 'partorders', 'parts']
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples, rows=None):
+    ms = [s * 1000 for s in samples]
+    return {
+        'runs': len(ms),
+        'min_ms': round(min(ms), 3),
+        'p50_ms': round(statistics.median(ms), 3),
+        'p95_ms': round(percentile(ms, 95), 3),
+        'max_ms': round(max(ms), 3),
+        'mean_ms': round(statistics.fmean(ms), 3),
+        'rows': rows,
+    }
+
+
+# Replays a generated SQL file one line (= one statement) at a time
+def load_dataset(path):
+    cur = db.connection.cursor()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                cur.execute(line)
+    db.connection.commit()
+
+    Migrator(db).upgrade()
+
+    rSQL = rollup.rollupSQL()
+    cur.execute(rSQL.create_table())
+    cur.execute(rSQL.rebuild())
+    reSQL = reports.reportSQL()
+    for sql in reSQL.create_tables():
+        cur.execute(sql)
+    for sql in reSQL.rebuild():
+        cur.execute(sql)
+    db.connection.commit()
+    cur.close()
+
+
+def dataset_counts():
+    return {table: db.query(f'SELECT COUNT(*) AS n FROM csc206cars.{table}')[0]['n'] for table in COUNTED_TABLES}
+
+
+# Picks real ids and filter values out of the loaded data so every query has something to chew on
+def sample_arguments(counts):
+    vehicle = db.query('SELECT vehicleID, manufacturerID, vehicle_typeID, model_year, fuel_type '
+                       'FROM csc206cars.vehicles ORDER BY vehicleID LIMIT 1 OFFSET %s',
+                       (counts['vehicles'] // 2,))[0]
+    filters = {
+        'manID': vehicle['manufacturerID'],
+        'vehicletypeID': vehicle['vehicle_typeID'],
+        'model_year': vehicle['model_year'],
+        'fueltype': vehicle['fuel_type'],
+    }
+    return {
+        'vehicle_id': vehicle['vehicleID'],
+        'filters': filters,
+        'page': Page(),
+    }
+
+
+# Builds (name, statement) cases covering every query method on vehicleSQL
+def query_cases(args):
+    vSQL = cars.vehicleSQL()
+    cases = []
+    for name, method in inspect.getmembers(vSQL, inspect.ismethod):
+        if name.startswith('_') or name in HELPERS:
+            continue
+        params = inspect.signature(method).parameters
+        if not params:
+            cases.append((name, method()))
+            continue
+
+        call = {}
+        for param in params.values():
+            if param.name in args:
+                call[param.name] = args[param.name]
+            elif param.default is inspect.Parameter.empty:
+                raise SystemExit(f'bench/run.py does not know how to call vehicleSQL.{name}({param.name})')
+        cases.append((name, method(**call)))
+
+        # Listing queries get timed unfiltered and unpaged as well
+        if 'filters' in params or 'page' in params:
+            cases.append((name + '[all]', method(**{k: v for k, v in call.items() if k not in ('filters', 'page')})))
+    return cases
+
+
+def time_queries(cases, repeat):
+    results = {}
+    for name, statement in cases:
+        samples = []
+        rows = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = len(db.query(statement))
+            samples.append(time.perf_counter() - start)
+        results[name] = summarize(samples, rows)
+        print(f'  {name:32} p50 {results[name]["p50_ms"]:10.2f} ms  rows {rows}', file=sys.stderr)
+    return results
+
+
+def route_cases(args):
+    vid = args['vehicle_id']
+    f = args['filters']
+    return [
+        ('GET /home (anonymous)', None, '/home'),
+        ('GET /home (buyer)', 'Buyer', '/home'),
+        ('GET /home?filters', None, f'/home?manufacturer_name={f["manID"]}&model_year={f["model_year"]}'),
+        ('GET /all_vehicles', 'Owner', '/all_vehicles'),
+        ('GET /all_vehicles?stream=1', 'Owner', '/all_vehicles?stream=1'),
+        ('GET /vehicle/<id>', 'Owner', f'/vehicle/{vid}'),
+        ('GET /select_customer', 'Sales', f'/select_customer/{vid}/sell'),
+        ('GET /sell_vehicle', 'Sales', f'/sell_vehicle/{vid}'),
+        ('GET /customers/search.json', 'Sales', '/customers/search.json?q=sm'),
+        ('GET /buy_vehicle', 'Buyer', f'/buy_vehicle/1/{vid}'),
+        ('GET /sales', 'Owner', '/sales'),
+        ('GET /seller', 'Owner', '/seller'),
+        ('GET /statistics', 'Owner', '/statistics'),
+        ('GET /login', None, '/login'),
+    ]
+
+
+def time_routes(cases, repeat, cold):
+    results = {}
+    client = app.test_client()
+    for name, role, url in cases:
+        with client.session_transaction() as sess:
+            sess.clear()
+            if role:
+                sess.update({'role': role, 'first_name': 'Bench', 'last_name': 'Runner'})
+        samples = []
+        status = None
+        for _ in range(repeat):
+            if cold:
+                ref_cache.clear()
+            start = time.perf_counter()
+            response = client.get(url)
+            body = response.get_data()
+            samples.append(time.perf_counter() - start)
+            status = response.status_code
+        results[name] = summarize(samples)
+        results[name].update({'status': status, 'bytes': len(body)})
+        print(f'  {name:32} p50 {results[name]["p50_ms"]:10.2f} ms  HTTP {status}', file=sys.stderr)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Prints p50 changes between two reports, slower than --threshold percent gets flagged
+def compare(before_path, after_path, threshold):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    regressions = 0
+    for section in ('queries', 'routes'):
+        print(f'{section}:')
+        for name, new in after[section].items():
+            old = before[section].get(name)
+            if old is None:
+                print(f'  {name:32} {new["p50_ms"]:10.2f} ms  (new)')
+                continue
+            change = (new['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0.0
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f'  {name:32} {old["p50_ms"]:10.2f} -> {new["p50_ms"]:10.2f} ms  {change:+7.1f}%{flag}')
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time vehicleSQL queries and Flask routes')
+    parser.add_argument('--label', default='current', help='name for the dataset, e.g. 10k, 100k, 1m')
+    parser.add_argument('--load', help='generated SQL file to load before timing')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--cold', action='store_true', help='clear the reference cache before every route request')
+    parser.add_argument('--out', help='where to write the JSON report (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two reports instead of running')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent slowdown --compare flags')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+
+    with app.app_context():
+        if args.load:
+            print(f'Loading {args.load}', file=sys.stderr)
+            start = time.perf_counter()
+            load_dataset(args.load)
+            print(f'  loaded in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+        counts = dataset_counts()
+        sample = sample_arguments(counts)
+
+        print('Queries:', file=sys.stderr)
+        queries = time_queries(query_cases(sample), args.repeat)
+
+    print('Routes:', file=sys.stderr)
+    routes = time_routes(route_cases(sample), args.repeat, args.cold)
+
+    report = {
+        'label': args.label,
+        'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'cold_cache': args.cold,
+        'dataset': counts,
+        'queries': queries,
+        'routes': routes,
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True, default=str)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class RefCache():
+
+    def __init__(self, max_entries=64, default_ttl=300):
+        ''' Small in-process cache for reference data (dropdowns, customer lists, ...)'''
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+
+        # key -> ttl in seconds, and tag -> set of keys that tag covers
+        self.ttls = {}
+        self.tags = {}
+
+        # key -> (expires_at, value), kept in least recently used order
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        # key family -> how many times it was invalidated. A load that started before an invalidation
+        # must not put its (stale) value back afterwards, so put() checks this hasn't moved
+        self.generations = {}
+        self.cleared = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, key, ttl=None, tags=()):
+        # Give a key its own TTL and attach it to invalidation tags
+        # A registered name also covers tuple keys starting with it, e.g. ('facets', <filters>)
+        self.ttls[key] = self.default_ttl if ttl is None else ttl
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+
+    def peek(self, key):
+        # (True, value) if the key is cached and fresh, (False, None) otherwise
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def generation(self, key):
+        # Take this before loading a value and hand it to put()
+        with self.lock:
+            return self.cleared, self.generations.get(self.family(key), 0)
+
+    def put(self, key, value, generation=None):
+        ttl = self.ttls.get(self.family(key), self.default_ttl)
+        if ttl <= 0:
+            return
+        with self.lock:
+            # Invalidated while it was loading, so the value may be from before the write
+            if generation is not None and generation != (self.cleared, self.generations.get(self.family(key), 0)):
+                return
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+
+            # Drop the least recently used keys once we go over the limit
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key, loader):
+        hit, value = self.peek(key)
+        if hit:
+            return value
+
+        # Load outside the lock so a slow query doesn't block every other key
+        generation = self.generation(key)
+        value = loader()
+        self.put(key, value, generation)
+        return value
+
+    def family(self, key):
+        return key[0] if isinstance(key, tuple) and key else key
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+                self.bump(self.family(key))
+
+    def invalidate_tag(self, *tags):
+        keys = set()
+        for tag in tags:
+            keys |= self.tags.get(tag, set())
+        with self.lock:
+            for key in [k for k in self.entries if self.family(k) in keys]:
+                del self.entries[key]
+            for family in keys:
+                self.bump(family)
+
+    def bump(self, family):
+        # Call with the lock held
+        self.generations[family] = self.generations.get(family, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.cleared += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -1,41 +1,493 @@
 import os
-from flask_mysqldb import MySQL
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import g, session, has_request_context
+import MySQLdb
 import MySQLdb.cursors
 
+from pool import ConnectionPool, PoolTimeout
+from replicas import Replica, ReplicaSet
+from instrumentation import Instrumentation, InstrumentedCursor
+from sql.builder import Statement
+
+
+# MySQL error for EXECUTE on a statement the server no longer knows about
+UNKNOWN_STMT_HANDLER = 1243
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+# prepare() turns every %s into a ? placeholder, so a template with any other % (a literal %%, or a
+# %s that isn't a placeholder) would change meaning, those run as plain queries instead
+def preparable(sql):
+    return '%' not in sql.replace('%s', '')
+
+
+# Only plain reads (a UNION may start with a bracket) may go to a replica, anything that writes
+# or takes locks stays on the primary
+def is_read(sql):
+    head = sql.lstrip().lstrip('(').lstrip().upper()
+    return head.startswith('SELECT') and 'FOR UPDATE' not in head and 'LOCK IN SHARE MODE' not in head
+
+
+class QueryResults(dict):
+
+    def __init__(self, *args, **kwargs):
+        ''' Name -> rows from query_parallel, with the queries that failed or timed out in .errors'''
+        super().__init__(*args, **kwargs)
+        self.errors = {}
+
 
 class MyDatabase():
 
     def __init__(self, app):
-        ''' Constructor which connects to the database'''
+        ''' Constructor which sets up the connection pool for the database'''
         self.app = app
 
-        # Define the database connection string
-        self.mysql = MySQL(self.app)
-
-        # Configure MySQL using environment variables and Connect
+        # Configure MySQL using environment variables
         self.app.config['MYSQL_HOST'] = os.getenv('MYSQL_HOST')
+        self.app.config['MYSQL_PORT'] = int(os.getenv('MYSQL_PORT', 3306))
         self.app.config['MYSQL_USER'] = os.getenv('MYSQL_USER')
         self.app.config['MYSQL_PASSWORD'] = os.getenv('MYSQL_PASSWORD')
         self.app.config['MYSQL_DB'] = os.getenv('MYSQL_DB')
 
+        # Pool sizing and recycling, timeouts are in seconds
+        self.app.config['MYSQL_POOL_MIN'] = int(os.getenv('MYSQL_POOL_MIN', 2))
+        self.app.config['MYSQL_POOL_MAX'] = int(os.getenv('MYSQL_POOL_MAX', 10))
+        self.app.config['MYSQL_POOL_MAX_LIFETIME'] = int(os.getenv('MYSQL_POOL_MAX_LIFETIME', 1800))
+        self.app.config['MYSQL_POOL_IDLE_TIMEOUT'] = int(os.getenv('MYSQL_POOL_IDLE_TIMEOUT', 300))
+        self.app.config['MYSQL_POOL_TIMEOUT'] = int(os.getenv('MYSQL_POOL_TIMEOUT', 10))
+
+        # Opt in to server-side prepared statements, cached per connection. Off by default: they go through
+        # SET/EXECUTE (two round trips) and the user variables carry utf8mb4 coercibility that can cost index
+        # range scans on latin1 columns, client-side binding is one round trip with literals the optimizer sees
+        self.app.config['MYSQL_SERVER_PREPARE'] = os.getenv('MYSQL_SERVER_PREPARE', '0') == '1'
+        self.app.config['MYSQL_STMT_CACHE_SIZE'] = int(os.getenv('MYSQL_STMT_CACHE_SIZE', 64))
+
+        self.pool = ConnectionPool(
+            self.connect_args,
+            min_size=self.app.config['MYSQL_POOL_MIN'],
+            max_size=self.app.config['MYSQL_POOL_MAX'],
+            max_lifetime=self.app.config['MYSQL_POOL_MAX_LIFETIME'],
+            idle_timeout=self.app.config['MYSQL_POOL_IDLE_TIMEOUT'],
+            checkout_timeout=self.app.config['MYSQL_POOL_TIMEOUT'],
+        )
+
+        # query_parallel gets its own small pool and one thread per connection in it, so a burst of
+        # parallel queries can't starve request connections and vice versa. Default per-query timeout too
+        self.app.config['MYSQL_PARALLEL_WORKERS'] = int(os.getenv('MYSQL_PARALLEL_WORKERS', 4))
+        self.app.config['MYSQL_QUERY_TIMEOUT'] = float(os.getenv('MYSQL_QUERY_TIMEOUT', 5))
+        self.parallel_pool = ConnectionPool(
+            self.connect_args,
+            min_size=0,
+            max_size=self.app.config['MYSQL_PARALLEL_WORKERS'],
+            max_lifetime=self.app.config['MYSQL_POOL_MAX_LIFETIME'],
+            idle_timeout=self.app.config['MYSQL_POOL_IDLE_TIMEOUT'],
+            checkout_timeout=self.app.config['MYSQL_QUERY_TIMEOUT'],
+        )
+        self.executor = ThreadPoolExecutor(max_workers=self.parallel_pool.max_size,
+                                           thread_name_prefix='db-parallel')
+
+        # Read replicas as host[:port],host[:port], same user, password and database as the primary.
+        # SELECTs go to the least busy one that is up and at most MYSQL_REPLICA_MAX_LAG seconds behind
+        # (checked every MYSQL_REPLICA_CHECK_INTERVAL seconds), anything else or no such replica means the primary
+        self.app.config['MYSQL_REPLICAS'] = os.getenv('MYSQL_REPLICAS', '')
+        self.app.config['MYSQL_REPLICA_MAX_LAG'] = float(os.getenv('MYSQL_REPLICA_MAX_LAG', 5))
+        self.app.config['MYSQL_REPLICA_CHECK_INTERVAL'] = float(os.getenv('MYSQL_REPLICA_CHECK_INTERVAL', 5))
+
+        # After a write, the same session reads from the primary for this many seconds so the
+        # page it gets redirected to shows the write even if the replicas haven't caught up
+        self.app.config['MYSQL_READ_YOUR_WRITES'] = float(os.getenv('MYSQL_READ_YOUR_WRITES', 5))
+
+        self.replicas = ReplicaSet(
+            [Replica(host, port, self.replica_pool(host, port)) for host, port in self.replica_hosts()],
+            max_lag=self.app.config['MYSQL_REPLICA_MAX_LAG'],
+            check_interval=self.app.config['MYSQL_REPLICA_CHECK_INTERVAL'],
+        )
+
+        # Statements slower than this (ms) go to the slow query log with their EXPLAIN
+        self.app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 200))
+        self.instrumentation = Instrumentation(self.app, slow_ms=self.app.config['SLOW_QUERY_MS'])
+
+        # Hand the request's connection back to the pool once the request is done
+        self.app.teardown_appcontext(self.release)
+
+        # Lets blueprints get at the database without importing app.py
+        self.app.extensions['db'] = self
+
+    def connect_args(self):
+        config = self.app.config
+        args = {
+            'host': config['MYSQL_HOST'] or 'localhost',
+            'port': config['MYSQL_PORT'],
+            'user': config['MYSQL_USER'],
+            'passwd': config['MYSQL_PASSWORD'] or '',
+            'charset': 'utf8mb4',
+        }
+        if config['MYSQL_DB']:
+            args['db'] = config['MYSQL_DB']
+        return args
+
+    def replica_hosts(self):
+        hosts = []
+        for entry in self.app.config['MYSQL_REPLICAS'].split(','):
+            entry = entry.strip()
+            if entry:
+                host, _, port = entry.partition(':')
+                hosts.append((host, int(port or 3306)))
+        return hosts
+
+    def replica_pool(self, host, port):
+        # Same settings as the primary's pool, only the server differs
+        return ConnectionPool(
+            lambda: {**self.connect_args(), 'host': host, 'port': port},
+            min_size=0,
+            max_size=self.app.config['MYSQL_POOL_MAX'],
+            max_lifetime=self.app.config['MYSQL_POOL_MAX_LIFETIME'],
+            idle_timeout=self.app.config['MYSQL_POOL_IDLE_TIMEOUT'],
+            checkout_timeout=self.app.config['MYSQL_POOL_TIMEOUT'],
+        )
+
+    def pin_primary(self):
+        ''' Called by the write paths: the rest of this request, and this session's requests for the
+            next MYSQL_READ_YOUR_WRITES seconds, read from the primary'''
+        g.db_pinned = True
+        if has_request_context():
+            session['primary_until'] = time.time() + self.app.config['MYSQL_READ_YOUR_WRITES']
+
+    def pinned(self):
+        if g.get('db_pinned'):
+            return True
+        return has_request_context() and session.get('primary_until', 0) > time.time()
+
+    def replica(self, sql):
+        # The replica this request reads from, picked once and kept for the whole request so its pages
+        # don't mix two replicas' views. None means the primary
+        if not self.replicas or not is_read(sql) or self.pinned():
+            return None
+        if 'db_replica' not in g:
+            g.db_replica = self.replicas.pick()
+        return g.db_replica
+
+    def replica_pooled(self, replica):
+        # The request's connection to its replica, checked out on first use like the primary one
+        if 'db_replica_conn' not in g:
+            g.db_replica_conn = replica.pool.acquire()
+        return g.db_replica_conn
+
+    def replica_failed(self, replica):
+        # Drop the replica for the rest of the request (and, until its next check, everyone else's)
+        self.replicas.failed(replica)
+        pooled = g.pop('db_replica_conn', None)
+        if pooled is not None:
+            replica.pool.release(pooled, discard=True)
+        g.db_replica = None
+
+    @property
+    def connection(self):
+        # One pooled connection per request, every query in the request reuses it
+        if 'db_conn' not in g:
+            g.db_conn = self.pool.acquire()
+        return g.db_conn.conn
+
+    def request_pooled(self):
+        # The request's PooledConnection, checked out on first use
+        self.connection
+        return g.db_conn
+
+    def release(self, exception=None):
+        pooled = g.pop('db_conn', None)
+        if pooled is not None:
+            # A connection that errored out might be in a bad state so don't reuse it
+            self.pool.release(pooled, discard=isinstance(exception, MySQLdb.OperationalError))
+
+        replica = g.pop('db_replica', None)
+        pooled = g.pop('db_replica_conn', None)
+        if pooled is not None:
+            replica.pool.release(pooled, discard=isinstance(exception, MySQLdb.OperationalError))
+
     def connect(self):
-        # Connect to the database -DictCursor will return a cursor
+        # Get a cursor on the request's connection -DictCursor will return a cursor
         # containing data as a python dictionary that can be
         # iterated over in application code
-        self.cur = self.mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+        return self.connection.cursor(MySQLdb.cursors.DictCursor)
+
+    def cursor(self, name=None):
+        # Plain cursor on the request's connection for hand written SQL, still counted by the instrumentation
+        return InstrumentedCursor(self, self.connection.cursor(), name)
+
+    def query(self, sql, params=None):
+
+        # vehicleSQL hands back a Statement holding the template and its values
+        if isinstance(sql, Statement):
+            sql, params = sql
+
+        start = time.perf_counter()
+        result = None
+        try:
+            result = self.read(sql, params)
+        finally:
+            self.instrumentation.record(sql, params, time.perf_counter() - start,
+                                        len(result) if result is not None else 0, error=result is None,
+                                        explain=lambda: self.explain(sql, params))
 
-    def query(self, sql):
+        return result
+
+    def read(self, sql, params=None):
+        # Runs on the request's replica when it has one, otherwise on the primary
+        replica = self.replica(sql)
+        if replica is None:
+            return self.execute(sql, params)
+
+        try:
+            result = self.execute(sql, params, self.replica_pooled(replica))
+        except (MySQLdb.OperationalError, PoolTimeout):
+            # The replica went away or is out of connections, the primary can still answer
+            self.replica_failed(replica)
+            return self.execute(sql, params)
+        self.replicas.read(replica)
+        return result
+
+    def execute(self, sql, params=None, pooled=None):
+        # Runs one statement on the given pooled connection, or the request's one
+        if self.app.config['MYSQL_SERVER_PREPARE'] and isinstance(params, tuple) and preparable(sql):
+            return self.query_prepared(sql, params, pooled)
+        return self.query_plain(sql, params, pooled)
+
+    def query_plain(self, sql, params=None, pooled=None):
 
         # Connect to database
-        self.connect()
+        cur = pooled.conn.cursor(MySQLdb.cursors.DictCursor) if pooled else self.connect()
+
+        try:
+            # Execute query, letting MySQLdb escape any bound parameters
+            cur.execute(sql, params)
+
+            # Return Results
+            result = cur.fetchall()
+        finally:
+            # Close the cursor, the connection goes back to the pool at the end of the request
+            cur.close()
+
+        return result
+
+    def explain(self, sql, params=None, conn=None):
+        # Query plan for a statement, for the slow query log
+        cur = (conn or self.connection).cursor(MySQLdb.cursors.DictCursor)
+        try:
+            cur.execute('EXPLAIN ' + sql, params)
+            return [dict(row) for row in cur.fetchall()]
+        finally:
+            cur.close()
+
+    def prepare(self, pooled, sql):
+        # Returns the name of the server-side statement for this template, preparing it on first use
+        if not preparable(sql):
+            raise ValueError('Prepared statement templates may not contain a literal %')
+        statements = pooled.statements
+        name = statements.get(sql)
+        if name is not None:
+            statements.move_to_end(sql)
+            return name
 
-        # Execute query
-        self.cur.execute(sql)
+        name = 'stmt_' + hashlib.sha1(sql.encode('utf-8')).hexdigest()[:16]
+        cur = pooled.conn.cursor()
+        try:
+            cur.execute(f"PREPARE {name} FROM %s", (sql.replace('%s', '?'),))
 
-        # Return Results
-        result = self.cur.fetchall()
+            # The server caps prepared statements per connection, so drop the least recently used ones
+            while len(statements) >= self.app.config['MYSQL_STMT_CACHE_SIZE']:
+                old_sql, old_name = statements.popitem(last=False)
+                cur.execute(f"DEALLOCATE PREPARE {old_name}")
+        finally:
+            cur.close()
 
-        # Close the connection
-        self.cur.close()
+        statements[sql] = name
+        return name
+
+    def query_prepared(self, sql, params, pooled=None, retry=True):
+        pooled = pooled or self.request_pooled()
+        name = self.prepare(pooled, sql)
+
+        cur = pooled.conn.cursor(MySQLdb.cursors.DictCursor)
+        try:
+            if params:
+                # Bind through user variables, then execute with them
+                names = [f'@p{i}' for i in range(len(params))]
+                assignments = ', '.join(f'{var} = %s' for var in names)
+                cur.execute(f"SET {assignments}", params)
+                cur.execute(f"EXECUTE {name} USING {', '.join(names)}")
+            else:
+                cur.execute(f"EXECUTE {name}")
+            result = cur.fetchall()
+        except (MySQLdb.OperationalError, MySQLdb.ProgrammingError) as e:
+            # The server forgot our statement (e.g. it was reset), prepare it again once
+            if not retry or e.args[0] != UNKNOWN_STMT_HANDLER:
+                raise
+            pooled.statements.pop(sql, None)
+            cur.close()
+            return self.query_prepared(sql, params, pooled, retry=False)
+        finally:
+            cur.close()
 
         return result
+
+    def query_parallel(self, queries, timeout=None):
+        ''' Runs a dict of independent queries (name -> SQL or Statement) side by side, each on its
+            own pooled connection, and returns QueryResults with the same names. A query that fails or
+            runs past its timeout (seconds, or a dict of them per name) is killed and left out, with
+            the exception in .errors, the others still come back. The timeout counts from the call, so
+            waiting for a thread or a connection spends it too'''
+        if timeout is None:
+            timeout = self.app.config['MYSQL_QUERY_TIMEOUT']
+        results = QueryResults()
+
+        # Not worth a thread hop for a single query
+        if len(queries) <= 1:
+            for name, sql in queries.items():
+                try:
+                    results[name] = self.query(sql)
+                except Exception as e:
+                    results.errors[name] = e
+            return results
+
+        # name -> server thread id of the connection running it, so an overdue query can be killed,
+        # and the names given up on before they even got a connection
+        running = {}
+        cancelled = set()
+        lock = threading.Lock()
+
+        # name -> when the query got its connection, for the timings
+        began = {}
+
+        def run(name, sql, params, pool):
+            # Waiting for a connection can't outlast the query's deadline, the caller has given up by then
+            pooled = pool.acquire(timeout=max(started + limits[name] - time.perf_counter(), 0))
+            discard = False
+            try:
+                with lock:
+                    if name in cancelled:
+                        return None
+                    running[name] = pooled.conn.thread_id()
+                    start = began[name] = time.perf_counter()
+                try:
+                    return self.execute(sql, params, pooled), time.perf_counter() - start
+                finally:
+                    with lock:
+                        running.pop(name, None)
+            except MySQLdb.Error:
+                # Covers the "query interrupted" error after a kill, don't hand that connection out again
+                discard = True
+                raise
+            finally:
+                pool.release(pooled, discard=discard)
+
+        statements = {name: (sql if isinstance(sql, Statement) else Statement(sql, None)) for name, sql in queries.items()}
+        started = time.perf_counter()
+        limits = {name: (timeout.get(name, self.app.config['MYSQL_QUERY_TIMEOUT']) if isinstance(timeout, dict) else timeout)
+                  for name in queries}
+        # The pools are picked here, the worker threads can't see the request to know it's pinned
+        pools = {name: getattr(self.replica(sql), 'pool', self.parallel_pool) for name, (sql, params) in statements.items()}
+        futures = {self.executor.submit(run, name, *statement, pools[name]): name for name, statement in statements.items()}
+
+        deadlines = {name: started + limits[name] for name in queries}
+
+        pending = set(futures)
+        while pending:
+            now = time.perf_counter()
+            overdue = {f for f in pending if deadlines[futures[f]] <= now}
+            for future in overdue:
+                name = futures[future]
+                future.cancel()
+                with lock:
+                    cancelled.add(name)
+                self.kill(running, lock, name, pools[name])
+                results.errors[name] = QueryTimeout(f'{name} ran past {limits[name]:.1f}s')
+                sql, params = statements[name]
+                self.instrumentation.record(sql, params, now - began.get(name, started), 0, error=True, name=name)
+            pending -= overdue
+            if not pending:
+                break
+
+            done, pending = wait(pending, timeout=min(deadlines[futures[f]] for f in pending) - now,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures[future]
+                sql, params = statements[name]
+                try:
+                    rows, seconds = future.result()
+                except Exception as e:
+                    results.errors[name] = e
+                    self.instrumentation.record(sql, params, time.perf_counter() - started, 0, error=True, name=name)
+                    continue
+                results[name] = rows
+                self.instrumentation.record(sql, params, seconds, len(rows), name=name,
+                                            explain=lambda sql=sql, params=params: self.explain(sql, params))
+
+        return results
+
+    def kill(self, running, lock, name, pool):
+        # Stops the statement on the server it runs on, the worker then gets an error and drops its connection.
+        # Primary queries are killed from the request's own connection, the parallel pool may be all busy
+        with lock:
+            thread_id = running.get(name)
+            if thread_id is None:
+                return
+            conn = self.connection if pool is self.parallel_pool else None
+            pooled = None
+            try:
+                if conn is None:
+                    pooled = pool.acquire(timeout=1)
+                    conn = pooled.conn
+                cur = conn.cursor()
+                try:
+                    cur.execute('KILL QUERY %s', (thread_id,))
+                finally:
+                    cur.close()
+            except (MySQLdb.Error, PoolTimeout):
+                pass
+            finally:
+                if pooled is not None:
+                    pool.release(pooled)
+
+    def stream(self, sql, params=None, batch_size=200):
+        ''' Yields rows from an unbuffered server-side cursor as they come off the wire'''
+        if isinstance(sql, Statement):
+            sql, params = sql
+
+        # Streams get their own pooled connection, the request's connection stays free for other queries.
+        # They read from the request's replica too, falling back to the primary if it has no connection to spare
+        pool = getattr(self.replica(sql), 'pool', self.pool)
+        try:
+            pooled = pool.acquire()
+        except (MySQLdb.OperationalError, PoolTimeout):
+            if pool is self.pool:
+                raise
+            pool = self.pool
+            pooled = pool.acquire()
+        finished = False
+        count = 0
+        start = time.perf_counter()
+        try:
+            cur = pooled.conn.cursor(MySQLdb.cursors.SSDictCursor)
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                count += len(rows)
+                yield from rows
+            cur.close()
+            finished = True
+        finally:
+            # Timed from execute to the last row, which includes however long the template took to render them
+            self.instrumentation.record(sql, params, time.perf_counter() - start, count, error=not finished,
+                                        explain=(lambda: self.explain(sql, params, pooled.conn)) if finished else None)
+
+            # If the client went away mid-stream, draining the rest of the result could take ages,
+            # so drop the connection instead of reusing it
+            pool.release(pooled, discard=not finished)
@@ -0,0 +1,105 @@
+import csv
+import io
+import json
+import zlib
+
+from api import encode
+from inventory import report_statement
+from sql import cars
+
+
+# Export name -> report name used by report_statement and the snapshot tables, None for the inventory
+EXPORTS = {
+    'sales': 'sale',
+    'seller': 'seller',
+    'statistics': 'statistics',
+    'inventory': None,
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# Rows are written into a buffer and handed on once it holds about this many bytes
+CHUNK_SIZE = 64 * 1024
+
+
+def export_statement(db, name):
+    report = EXPORTS[name]
+    if report is None:
+        return cars.vehicleSQL().display_vehicles()
+    return report_statement(db, report)[0]
+
+
+# Spreadsheets run a cell starting with one of these as a formula, so a customer named
+# "=HYPERLINK(...)" would turn into a live link. Some strip a leading tab or carriage return first
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+# The header comes from the first row's keys, so an empty export is an empty file
+def csv_chunks(rows, chunk_size=CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header = None
+    for row in rows:
+        if header is None:
+            header = list(row)
+            writer.writerow(header)
+        writer.writerow([csv_cell(row[key]) for key in header])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+# One JSON object per line, money and dates encoded like the JSON API does
+def jsonl_chunks(rows, chunk_size=CHUNK_SIZE):
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row, separators=(',', ':'), default=encode, ensure_ascii=False) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(lines).encode('utf-8')
+            lines = []
+            size = 0
+    if lines:
+        yield ''.join(lines).encode('utf-8')
+
+
+WRITERS = {
+    'csv': csv_chunks,
+    'jsonl': jsonl_chunks,
+}
+
+
+# Compresses as it goes, wbits=31 gives a gzip header and trailer so the result is a .gz file
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(db, name, fmt, compress=False, batch_size=200):
+    ''' Bytes of a report or the whole inventory as CSV or JSONL, streamed off an unbuffered server-side
+        cursor so only one batch of rows and one chunk of output are in memory at a time'''
+    rows = db.stream(export_statement(db, name), batch_size=batch_size)
+    chunks = WRITERS[fmt](rows)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_filename(name, fmt, compress=False):
+    return f'{name}.{fmt}' + ('.gz' if compress else '')
@@ -0,0 +1,35 @@
+# Filter fields the facet query groups by -> column it comes back as
+FACET_COLUMNS = {
+    'manufacturer': 'manufacturerID',
+    'vehicle_type': 'vehicle_typeID',
+    'model_year': 'model_year',
+    'fuel_type': 'fuel_type',
+}
+
+
+# Turns the rows from vehicleSQL.facet_counts into {field: {value: vehicle count}}
+# Colors are keyed by name because that is what the rollup's color list holds
+def count_facets(rows):
+    counts = {field: {} for field in FACET_COLUMNS}
+    counts['color'] = {}
+    total = 0
+
+    for row in rows:
+        n = row['vehicle_count']
+        total += n
+        for field, column in FACET_COLUMNS.items():
+            value = row[column]
+            counts[field][value] = counts[field].get(value, 0) + n
+
+        # A vehicle counts once for each of its colors
+        for color in (row['concatenated_colors'] or '').split(', '):
+            if color:
+                counts['color'][color] = counts['color'].get(color, 0) + n
+
+    counts['total'] = total
+    return counts
+
+
+# Same filters always give the same cache key, whatever order they were added in
+def facet_key(filters, sellable):
+    return ('facets', 'sellable' if sellable else 'unsold', tuple(sorted((filters or {}).items())))
@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+from flask import render_template
+from markupsafe import Markup
+
+
+class FragmentCache():
+
+    def __init__(self, max_entries=5000):
+        ''' Bounded LRU of rendered template fragments, grouped by an owner (e.g. a vehicleID) for invalidation'''
+        self.max_entries = max_entries
+
+        # key -> (owner, rendered Markup) in least recently used order, and owner -> its keys
+        self.entries = OrderedDict()
+        self.owners = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, owner, key, template, **context):
+        ''' The fragment cached under key, rendering template with context on a miss.
+            The key has to change whenever anything the template shows changes, e.g. a row version'''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Render outside the lock, two requests racing on the same fragment just both render it
+        html = Markup(render_template(template, **context))
+
+        with self.lock:
+            self.entries[key] = (owner, html)
+            self.entries.move_to_end(key)
+            self.owners.setdefault(owner, set()).add(key)
+
+            while len(self.entries) > self.max_entries:
+                old_key, (old_owner, _) = self.entries.popitem(last=False)
+                self.forget(old_owner, old_key)
+        return html
+
+    def forget(self, owner, key):
+        keys = self.owners.get(owner)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.owners[owner]
+
+    def invalidate(self, *owners):
+        # Drops every fragment of these owners, e.g. after a write to the vehicle
+        with self.lock:
+            for owner in owners:
+                for key in self.owners.pop(owner, ()):
+                    self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.owners.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,371 @@
+'''
+Bulk ingest of vehicles with their colors, purchase transaction and part orders.
+
+Input, one vehicle per JSONL line:
+
+    {"vin": "...", "mileage": 1200.5, "description": "...", "model_name": "DB9", "model_year": 2014,
+     "fuel_type": "Gas", "manufacturer": "Aston Martin", "vehicle_type": "Coupe", "colors": ["Black"],
+     "purchase": {"customerID": 12, "username": "buyer1", "purchase_price": 50000,
+                  "purchase_date": "2024-05-01", "vehicle_condition": "Good"},
+     "part_orders": [{"vendor": "Napa", "order_number": 1,
+                      "parts": [{"part_number": "A-1", "cost": 12.5, "description": "...", "quantity": 1}]}]}
+
+or CSV with one row per part (vehicle columns repeated, consecutive rows with the same VIN are one
+vehicle), colors separated by ';' and the purchase and part columns flattened:
+
+    vin, mileage, description, model_name, model_year, fuel_type, manufacturer, vehicle_type, colors,
+    customerID, username, purchase_price, purchase_date, vehicle_condition,
+    vendor, order_number, part_number, cost, part_description, quantity, status
+'''
+import csv
+import datetime
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+import MySQLdb
+
+from sql.ingest import ingestSQL
+from sql.parts import PART_STATUSES
+from sql import rollup, reports
+
+
+# Allowed values of the enum columns, checked before anything is sent to MySQL
+FUEL_TYPES = ('Gas', 'Diesel', 'Natural Gas', 'Hybrid', 'Plugin Hybrid', 'Battery', 'Fuel Cell')
+CONDITIONS = ('Excellent', 'Very Good', 'Good', 'Fair')
+
+# Errors kept in the report, the count keeps going past it
+MAX_REPORTED_ERRORS = 1000
+
+
+class RowError(Exception):
+    pass
+
+
+# Bytes that aren't UTF-8 break the decoder for the rest of the file, so reading stops there.
+# Whatever came before it has already gone in, the report says where it stopped
+def not_utf8(e, line_no):
+    return RowError(f'File is not valid UTF-8 after line {line_no} ({e.reason}), stopped reading there')
+
+
+def read_jsonl(stream):
+    line_no = 0
+    try:
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, RowError(f'Bad JSON: {e}')
+    except UnicodeDecodeError as e:
+        yield line_no + 1, not_utf8(e, line_no)
+
+
+def csv_vehicle(row):
+    vehicle = {key: row.get(key) for key in ('vin', 'mileage', 'description', 'model_name', 'model_year',
+                                            'fuel_type', 'manufacturer', 'vehicle_type')}
+    vehicle['colors'] = [c.strip() for c in (row.get('colors') or '').split(';') if c.strip()]
+    if row.get('purchase_price'):
+        vehicle['purchase'] = {key: row.get(key) for key in ('customerID', 'userID', 'username', 'purchase_price',
+                                                             'purchase_date', 'vehicle_condition')}
+    vehicle['part_orders'] = []
+    return vehicle
+
+
+def csv_add_part(vehicle, row):
+    if not row.get('part_number'):
+        return
+    key = (row.get('vendor'), row.get('order_number') or None)
+    for order in vehicle['part_orders']:
+        if (order['vendor'], order['order_number']) == key:
+            break
+    else:
+        order = {'vendor': key[0], 'order_number': key[1], 'parts': []}
+        vehicle['part_orders'].append(order)
+    order['parts'].append({
+        'part_number': row.get('part_number'),
+        'cost': row.get('cost'),
+        'description': row.get('part_description'),
+        'quantity': row.get('quantity'),
+        'status': row.get('status') or None,
+    })
+
+
+def read_csv(stream):
+    vehicle, first_line = None, None
+    # Line 1 is the header
+    line_no = 1
+    try:
+        for line_no, row in enumerate(csv.DictReader(stream), 2):
+            row = {key.strip(): (value.strip() if isinstance(value, str) else value) for key, value in row.items() if key}
+            if vehicle is None or row.get('vin') != vehicle['vin']:
+                if vehicle is not None:
+                    yield first_line, vehicle
+                vehicle, first_line = csv_vehicle(row), line_no
+            csv_add_part(vehicle, row)
+    except UnicodeDecodeError as e:
+        # The vehicle being read may be missing part rows, so it doesn't go in either
+        yield line_no + 1, not_utf8(e, line_no)
+        return
+    if vehicle is not None:
+        yield first_line, vehicle
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+class Lookups():
+
+    def __init__(self, db):
+        ''' Name -> ID maps for manufacturers, types, colors, vendors and users, loaded once per ingest'''
+        iSQL = ingestSQL()
+        self.maps = {}
+        for name, sql in iSQL.lookups().items():
+            self.maps[name] = {str(row['name']).strip().lower(): row['id'] for row in db.query(sql)}
+        self.customers = {row['customerID'] for row in db.query(iSQL.customer_ids())}
+
+    def resolve(self, kind, name):
+        if name is None or str(name).strip() == '':
+            raise RowError(f'Missing {kind}')
+        found = self.maps[kind].get(str(name).strip().lower())
+        if found is None:
+            raise RowError(f'Unknown {kind} {name!r}')
+        return found
+
+
+def required(record, key):
+    value = record.get(key)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise RowError(f'Missing {key}')
+    return value.strip() if isinstance(value, str) else value
+
+
+def as_int(record, key):
+    value = required(record, key)
+    try:
+        number = int(value)
+        # int() would quietly cut 2014.7 down to 2014 (and take True as 1)
+        if isinstance(value, bool) or number != value and not isinstance(value, str):
+            raise ValueError(value)
+        return number
+    except (TypeError, ValueError, OverflowError):
+        raise RowError(f'{key} must be a whole number')
+
+
+def as_decimal(record, key):
+    try:
+        return Decimal(str(required(record, key)))
+    except InvalidOperation:
+        raise RowError(f'{key} must be a number')
+
+
+def as_choice(record, key, choices, default=None):
+    value = record.get(key) or default
+    if value not in choices:
+        raise RowError(f'{key} must be one of {", ".join(choices)}')
+    return value
+
+
+def as_date(record, key):
+    try:
+        return datetime.date.fromisoformat(str(required(record, key)))
+    except ValueError:
+        raise RowError(f'{key} must be a YYYY-MM-DD date')
+
+
+# Checks one input record and resolves its names, returning the rows to insert (minus the generated IDs)
+def prepare(record, lookups):
+    if not isinstance(record, dict):
+        raise RowError('Expected an object')
+
+    vehicle = (
+        required(record, 'vin'),
+        as_decimal(record, 'mileage'),
+        record.get('description') or None,
+        required(record, 'model_name'),
+        as_int(record, 'model_year'),
+        as_choice(record, 'fuel_type', FUEL_TYPES),
+        lookups.resolve('manufacturer', record.get('manufacturer')),
+        lookups.resolve('vehicle_type', record.get('vehicle_type')),
+    )
+
+    colors = sorted({lookups.resolve('color', name) for name in record.get('colors') or []})
+
+    purchase = None
+    if record.get('purchase'):
+        p = record['purchase']
+        customer_id = as_int(p, 'customerID')
+        if customer_id not in lookups.customers:
+            raise RowError(f'Unknown customerID {customer_id}')
+        user_id = as_int(p, 'userID') if p.get('userID') else lookups.resolve('user', p.get('username'))
+        purchase = (user_id, customer_id, as_decimal(p, 'purchase_price'), as_date(p, 'purchase_date'),
+                    as_choice(p, 'vehicle_condition', CONDITIONS))
+
+    orders = []
+    seen_numbers = set()
+    for n, order in enumerate(record.get('part_orders') or [], 1):
+        number = as_int(order, 'order_number') if order.get('order_number') else n
+        if number in seen_numbers:
+            raise RowError(f'Duplicate order_number {number}')
+        seen_numbers.add(number)
+
+        parts, seen_parts = [], set()
+        for part in order.get('parts') or []:
+            part_number = required(part, 'part_number')
+            if part_number in seen_parts:
+                raise RowError(f'Duplicate part_number {part_number} in order {number}')
+            seen_parts.add(part_number)
+            parts.append((part_number, as_decimal(part, 'cost'), required(part, 'description'),
+                          as_int(part, 'quantity'), as_choice(part, 'status', PART_STATUSES, default='Ordered')))
+        orders.append((number, lookups.resolve('vendor', order.get('vendor')), parts))
+
+    return {'vehicle': vehicle, 'colors': colors, 'purchase': purchase, 'orders': orders}
+
+
+class Ingest():
+
+    def __init__(self, db, chunk_size=500):
+        ''' Loads vehicles with their colors, purchase and part orders in chunks of chunk_size vehicles,
+            one transaction and a handful of multi-row INSERTs per chunk'''
+        self.db = db
+        self.chunk_size = max(1, chunk_size)
+        self.iSQL = ingestSQL()
+        self.counts = dict.fromkeys(('vehicles', 'colors', 'purchases', 'part_orders', 'parts'), 0)
+        self.vehicle_ids = []
+        self.errors = []
+        self.error_count = 0
+
+        # Only keep the report snapshots up to date if they have been built
+        try:
+            self.snapshots = bool(db.query(reports.reportSQL().as_of('seller')))
+        except MySQLdb.Error:
+            self.snapshots = False
+
+    def error(self, line, vin, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'vin': vin, 'error': str(message)})
+
+    def run(self, records):
+        ''' Takes (line number, record) pairs and returns a report of what went in and what didn't'''
+        start = time.perf_counter()
+        lookups = Lookups(self.db)
+        chunk, seen_vins = [], set()
+
+        for line, record in records:
+            vin = record.get('vin') if isinstance(record, dict) else None
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                item = prepare(record, lookups)
+            except RowError as e:
+                self.error(line, vin, e)
+                continue
+            if item['vehicle'][0] in seen_vins:
+                self.error(line, vin, 'VIN appears earlier in the file')
+                continue
+            seen_vins.add(item['vehicle'][0])
+
+            chunk.append((line, item))
+            if len(chunk) >= self.chunk_size:
+                self.flush(chunk)
+                chunk = []
+        if chunk:
+            self.flush(chunk)
+
+        seconds = time.perf_counter() - start
+        rows = sum(self.counts.values())
+        return {
+            **self.counts,
+            'rows': rows,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(rows / seconds) if seconds else None,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def flush(self, chunk):
+        cur = self.db.cursor('ingest.flush')
+        try:
+            # VINs already in the database would fail the whole multi-row INSERT, weed them out first
+            cur.execute(*self.iSQL.existing_vins([item['vehicle'][0] for _, item in chunk]))
+            existing = {row[0] for row in cur.fetchall()}
+            for line, item in chunk:
+                if item['vehicle'][0] in existing:
+                    self.error(line, item['vehicle'][0], 'VIN already exists')
+            chunk = [(line, item) for line, item in chunk if item['vehicle'][0] not in existing]
+            if not chunk:
+                return
+
+            try:
+                counts, ids = self.insert(cur, [item for _, item in chunk])
+                self.db.connection.commit()
+                self.done(counts, ids)
+                return
+            except MySQLdb.Error:
+                self.db.connection.rollback()
+
+            # Something in the chunk broke a constraint, redo it a vehicle at a time to find out which
+            for line, item in chunk:
+                try:
+                    counts, ids = self.insert(cur, [item])
+                    self.db.connection.commit()
+                    self.done(counts, ids)
+                except MySQLdb.Error as e:
+                    self.db.connection.rollback()
+                    self.error(line, item['vehicle'][0], e.args[-1] if e.args else e)
+        finally:
+            cur.close()
+
+    def done(self, counts, ids):
+        for key, n in counts.items():
+            self.counts[key] += n
+        self.vehicle_ids.extend(ids)
+
+    def insert(self, cur, items):
+        iSQL = self.iSQL
+        vins = [item['vehicle'][0] for item in items]
+
+        cur.executemany(iSQL.insert_vehicles(), [item['vehicle'] for item in items])
+        cur.execute(*iSQL.vehicle_ids(vins))
+        vehicle_ids = dict(cur.fetchall())
+        ids = [vehicle_ids[vin] for vin in vins]
+
+        colors = [(vid, color) for vid, item in zip(ids, items) for color in item['colors']]
+        if colors:
+            cur.executemany(iSQL.insert_vehicle_colors(), colors)
+
+        purchases = [(vid, *item['purchase']) for vid, item in zip(ids, items) if item['purchase']]
+        if purchases:
+            cur.executemany(iSQL.insert_purchases(), purchases)
+
+        orders = [(number, vid, vendor) for vid, item in zip(ids, items) for number, vendor, _ in item['orders']]
+        parts = []
+        order_ids = []
+        if orders:
+            cur.executemany(iSQL.insert_part_orders(), orders)
+            cur.execute(*iSQL.part_order_ids(ids))
+            order_id_map = {(vid, number): po_id for po_id, vid, number in cur.fetchall()}
+            for vid, item in zip(ids, items):
+                for number, _, order_parts in item['orders']:
+                    po_id = order_id_map[(vid, number)]
+                    order_ids.append(po_id)
+                    parts.extend((po_id, *part) for part in order_parts)
+            if parts:
+                cur.executemany(iSQL.insert_parts(), parts)
+
+        # Rollup and report snapshots move in the same transaction as the rows they summarize
+        cur.execute(*rollup.rollupSQL().rebuild(ids))
+        if self.snapshots:
+            reSQL = reports.reportSQL()
+            if purchases:
+                for statement in reSQL.record_purchase([p[0] for p in purchases]):
+                    cur.execute(*statement)
+            if parts:
+                for statement in reSQL.record_part_order(order_ids):
+                    cur.execute(*statement)
+
+        counts = {'vehicles': len(items), 'colors': len(colors), 'purchases': len(purchases),
+                  'part_orders': len(orders), 'parts': len(parts)}
+        return counts, ids
@@ -0,0 +1,186 @@
+import time
+import threading
+import logging
+from collections import deque
+
+from flask import g, request, has_request_context
+
+from sql.builder import query_name
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets, the last one catches everything slower
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float('inf'))
+
+
+# What the slow log keeps of the bound values: just their types. The values themselves can be
+# usernames, customer search terms and the like, and the log is shown on /metrics
+def redact(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+class QueryStats():
+
+    def __init__(self):
+        ''' Running totals and a latency histogram for one query name'''
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def add(self, ms, rows, error):
+        self.count += 1
+        self.errors += int(error)
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.rows += rows or 0
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'rows': self.rows,
+            'histogram': {('+Inf' if bound == float('inf') else f'le_{bound}ms'): n
+                          for bound, n in zip(BUCKETS_MS, self.buckets)},
+        }
+
+
+class Instrumentation():
+
+    def __init__(self, app, slow_ms=200, slow_log_size=100, explain_interval=60):
+        ''' Per-request query accounting, per-query-name stats and a slow query log'''
+        self.slow_ms = slow_ms
+        self.explain_interval = explain_interval
+        self.lock = threading.Lock()
+        self.by_query = {}
+        self.by_route = {}
+        self.slow_log = deque(maxlen=slow_log_size)
+
+        # template -> last time we ran EXPLAIN for it, so a hot slow query doesn't EXPLAIN every time
+        self.explained = {}
+
+        app.after_request(self.server_timing)
+
+    def record(self, sql, params, seconds, rows, error=False, name=None, explain=None):
+        ''' Called by MyDatabase after every statement'''
+        ms = seconds * 1000
+        name = query_name(sql) or name or 'raw'
+        route = (request.endpoint or request.path) if has_request_context() else 'cli'
+
+        with self.lock:
+            self.by_query.setdefault(name, QueryStats()).add(ms, rows, error)
+            self.by_route.setdefault(route, QueryStats()).add(ms, rows, error)
+
+        if has_request_context():
+            g.setdefault('query_log', []).append((name, ms, rows))
+
+        if ms >= self.slow_ms:
+            self.slow(name, route, sql, params, ms, rows, explain)
+
+    def slow(self, name, route, sql, params, ms, rows, explain):
+        plan = None
+        now = time.monotonic()
+        if explain is not None and sql.lstrip().upper().startswith('SELECT'):
+            with self.lock:
+                due = now - self.explained.get(sql, -self.explain_interval) >= self.explain_interval
+                if due:
+                    self.explained[sql] = now
+            if due:
+                try:
+                    plan = explain()
+                except Exception as e:
+                    plan = f'EXPLAIN failed: {e}'
+
+        entry = {
+            'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'name': name,
+            'route': route,
+            'ms': round(ms, 3),
+            'rows': rows,
+            'sql': ' '.join(sql.split()),
+            'params': redact(params),
+            'explain': plan,
+        }
+        with self.lock:
+            self.slow_log.append(entry)
+        logger.warning('Slow query %s on %s took %.1f ms (%s rows)', name, route, ms, rows)
+
+    def server_timing(self, response):
+        # Total DB time plus the slowest few statements, readable in the browser's network tab
+        log = g.pop('query_log', None)
+        if not log:
+            return response
+
+        total = sum(ms for _, ms, _ in log)
+        parts = [f'db;dur={total:.1f};desc="{len(log)} queries"']
+        for i, (name, ms, rows) in enumerate(sorted(log, key=lambda entry: -entry[1])[:5]):
+            parts.append(f'q{i};dur={ms:.1f};desc="{name}"')
+        response.headers.add('Server-Timing', ', '.join(parts))
+        return response
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'slow_query_ms': self.slow_ms,
+                'queries': {name: stats.as_dict() for name, stats in sorted(self.by_query.items())},
+                'routes': {name: stats.as_dict() for name, stats in sorted(self.by_route.items())},
+                'slow_log': list(self.slow_log),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.by_query.clear()
+            self.by_route.clear()
+            self.slow_log.clear()
+            self.explained.clear()
+
+
+class InstrumentedCursor():
+
+    def __init__(self, db, cursor, name=None):
+        ''' Wraps a raw MySQLdb cursor so hand written SQL in app.py is counted too'''
+        self.db = db
+        self.cursor = cursor
+        self.name = name
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        error = True
+        try:
+            result = self.cursor.execute(sql, params)
+            error = False
+            return result
+        finally:
+            self.db.instrumentation.record(sql, params, time.perf_counter() - start, self.cursor.rowcount,
+                                           error=error, name=self.name,
+                                           explain=lambda: self.db.explain(sql, params))
+
+    def executemany(self, sql, rows):
+        # One entry for the whole batch, MySQLdb turns an INSERT ... VALUES into multi-row statements
+        start = time.perf_counter()
+        error = True
+        try:
+            result = self.cursor.executemany(sql, rows)
+            error = False
+            return result
+        finally:
+            self.db.instrumentation.record(sql, None, time.perf_counter() - start, self.cursor.rowcount,
+                                           error=error, name=self.name)
+
+    def __getattr__(self, attr):
+        # fetchone, lastrowid, rowcount, close, ... go straight to the real cursor
+        return getattr(self.cursor, attr)
@@ -0,0 +1,119 @@
+import json
+from decimal import Decimal
+
+import MySQLdb
+
+from sql import cars, reports
+
+
+# Turns the filter bar's query string into the filters dict the vehicleSQL listings take
+def filters_from_args(args):
+
+    # First get the information related to the key from the URL
+    manID = args.get('manufacturer_name')
+    vehicletypeID = args.get('vehicle_type')
+    modelyear = args.get('model_year')
+    fueltype = args.get('fuel_type')
+    colorid = args.get('color_selection')
+    min_price = args.get('min_price')
+    max_price = args.get('max_price')
+
+    # Dictionary for the filters
+    filters = {}
+
+    # Add the information to the dictionary if it exists
+    try:
+        if manID:
+            filters['manID'] = int(manID)
+    except ValueError:
+        pass
+    try:
+        if vehicletypeID:
+            filters['vehicletypeID'] = int(vehicletypeID)
+    except ValueError:
+        pass
+    try:
+        if modelyear:
+            filters['model_year'] = int(modelyear)
+    except ValueError:
+        pass
+    if fueltype:
+        filters['fueltype'] = fueltype
+    try:
+        if colorid:
+            filters['colorid'] = int(colorid)
+    except ValueError:
+        pass
+
+    # Price range, whole cents and never below zero
+    for key, value in (('min_price', min_price), ('max_price', max_price)):
+        try:
+            if value:
+                price = Decimal(value).quantize(Decimal('0.01'))
+                if price.is_finite() and price >= 0:
+                    filters[key] = price
+        except ArithmeticError:
+            pass
+
+    return filters
+
+
+# Customer fields the details page shows for the seller and buyer
+PARTY_FIELDS = ('first_name', 'last_name', 'street', 'city', 'state', 'postal_code', 'phone_number', 'email_address')
+
+
+# Pulls the seller_* or buyer_* columns out of the details row, None if there is no such customer
+def party_from_row(row, prefix):
+    if row.get(f'{prefix}_customerID') is None:
+        return None
+    return {field: row.get(f'{prefix}_{field}') for field in PARTY_FIELDS}
+
+
+# Loads everything the details page needs with a single query, returns None for an unknown vehicle
+def load_vehicle_details(db, vehicle_id):
+    qSQL = cars.vehicleSQL()
+    output = db.query(qSQL.vehicle_page(vehicle_id))
+    if not output:
+        return None
+
+    car = output[0]
+
+    # Parts come back as a JSON array (NULL when the vehicle has none), keep them in order
+    parts = json.loads(car.pop('parts_json') or '[]')
+    parts.sort(key=lambda p: (p['part_orderID'], p['partID']))
+
+    return {
+        'car': car,
+        'parts': parts,
+        'seller': party_from_row(car, 'seller'),
+        'buyer': party_from_row(car, 'buyer'),
+
+        # Sale eligibility is the vehicle's stored inventory state (vehicle_rollup), nothing to work out here
+        'eligible_for_sale': bool(car.pop('eligible_for_sale')),
+    }
+
+
+# MySQL's "table doesn't exist" error number
+NO_SUCH_TABLE = 1146
+
+
+# The statement for a report along with its "as of" time: the snapshot table,
+# or the live aggregation if the snapshots have never been built
+def report_statement(db, name):
+    reSQL = reports.reportSQL()
+    try:
+        meta = db.query(reSQL.as_of(name))
+    except MySQLdb.ProgrammingError as e:
+        # rebuild-reports hasn't created the snapshot tables yet
+        if e.args[0] != NO_SUCH_TABLE:
+            raise
+        meta = None
+    if not meta:
+        return getattr(cars.vehicleSQL(), name)(), None
+    return getattr(reSQL, name)(), meta[0]['as_of']
+
+
+# Reads a report from its snapshot table along with its "as of" time
+def report_rows(db, name):
+    statement, as_of = report_statement(db, name)
+    return db.query(statement), as_of
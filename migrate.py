@@ -0,0 +1,94 @@
+from sql.migrations import Column, Drop, Index, MIGRATIONS, migrationSQL
+
+
+class Migrator():
+
+    def __init__(self, db, migrations=MIGRATIONS):
+        ''' Applies and rolls back the schema migrations in sql/migrations.py, in version order'''
+        self.db = db
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        self.mSQL = migrationSQL()
+
+        versions = [m.version for m in self.migrations]
+        if len(set(versions)) != len(versions):
+            raise ValueError(f'Duplicate migration versions in {versions}')
+
+    def applied(self):
+        # version -> applied_at for everything recorded in schema_migrations
+        cur = self.db.cursor('migrate.applied')
+        try:
+            cur.execute(self.mSQL.create_table())
+            cur.execute(self.mSQL.applied())
+            return {version: applied_at for version, name, applied_at in cur.fetchall()}
+        finally:
+            cur.close()
+
+    def status(self):
+        applied = self.applied()
+        return [(m.version, m.name, applied.get(m.version)) for m in self.migrations]
+
+    def upgrade(self, target=None):
+        ''' Runs every pending migration up to and including target (default: the newest)'''
+        applied = self.applied()
+        done = []
+        for migration in self.migrations:
+            if target is not None and migration.version > target:
+                break
+            if migration.version in applied:
+                continue
+            self.run(migration.up, up=True)
+            self.finish(self.mSQL.record(migration.version, migration.name))
+            done.append(migration)
+        return done
+
+    def downgrade(self, target=0):
+        ''' Rolls back every applied migration newer than target, newest first'''
+        applied = self.applied()
+        done = []
+        for migration in reversed(self.migrations):
+            if migration.version <= target:
+                break
+            if migration.version not in applied:
+                continue
+            self.run(migration.down, up=False)
+            self.finish(self.mSQL.forget(migration.version))
+            done.append(migration)
+        return done
+
+    def run(self, steps, up):
+        cur = self.db.cursor('migrate.run')
+        try:
+            for step in steps:
+                add = up
+                if isinstance(step, Drop):
+                    step, add = step.step, not up
+
+                if isinstance(step, Index):
+                    # Only add what's missing and only drop what's there, so a rerun picks up where it stopped
+                    cur.execute(*self.mSQL.index_exists(step.table, step.name))
+                    exists = cur.fetchone() is not None
+                    if add and not exists:
+                        cur.execute(self.mSQL.create_index(step))
+                    elif not add and exists:
+                        cur.execute(self.mSQL.drop_index(step))
+                elif isinstance(step, Column):
+                    cur.execute(*self.mSQL.column_exists(step.table, step.name))
+                    exists = cur.fetchone() is not None
+                    if add and not exists:
+                        cur.execute(self.mSQL.add_column(step))
+                    elif not add and exists:
+                        cur.execute(self.mSQL.drop_column(step))
+                else:
+                    cur.execute(step)
+            self.db.connection.commit()
+        finally:
+            cur.close()
+
+    def finish(self, statement):
+        # The version is only recorded once every step went through
+        cur = self.db.cursor('migrate.finish')
+        try:
+            cur.execute(*statement)
+            self.db.connection.commit()
+        finally:
+            cur.close()
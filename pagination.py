@@ -0,0 +1,114 @@
+import base64
+import binascii
+import json
+from decimal import Decimal
+from urllib.parse import urlencode
+
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 200
+
+
+# Listing orders ?sort= can pick, and the row fields a cursor for each is made of
+SORT_KEYS = {
+    'name': ('model_name', 'manufacturer_name', 'vehicleID'),
+    'price': ('list_price', 'vehicleID'),
+}
+DEFAULT_SORT = 'name'
+
+
+# Cursors are the sort key of a row, packed into a url safe string
+def encode_cursor(row, sort=DEFAULT_SORT):
+    key = [row.get(field) for field in SORT_KEYS[sort]]
+    # A vehicle without a rollup row has no price, the all listing sorts it as 0
+    if sort == 'price' and key[0] is None:
+        key[0] = 0
+    # Prices go as strings so they come back exact
+    key = [str(value) if isinstance(value, Decimal) else value for value in key]
+    raw = json.dumps(key, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+# Vehicle ids in a cursor are JSON integers, not strings, floats or booleans
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def decode_cursor(token, sort=DEFAULT_SORT):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        if sort == 'price':
+            list_price, vehicle_id = json.loads(raw)
+            list_price = Decimal(str(list_price))
+            # NaN and Infinity parse fine but aren't prices
+            if not list_price.is_finite() or not is_id(vehicle_id):
+                return None
+            return list_price, vehicle_id
+        model_name, manufacturer_name, vehicle_id = json.loads(raw)
+        # Names the listing sorts on are always strings, a null or a number didn't come from encode_cursor
+        if not (isinstance(model_name, str) and isinstance(manufacturer_name, str) and is_id(vehicle_id)):
+            return None
+        return model_name, manufacturer_name, vehicle_id
+    except (binascii.Error, ValueError, TypeError, ArithmeticError):
+        # A mangled cursor just means "start from the first page"
+        return None
+
+
+class Page():
+
+    def __init__(self, after=None, before=None, size=DEFAULT_PAGE_SIZE, sort=DEFAULT_SORT):
+        ''' One page of a keyset paginated listing'''
+        self.sort = sort if sort in SORT_KEYS else DEFAULT_SORT
+        self.after = after
+        self.before = before if after is None else None
+        self.size = max(1, min(int(size), MAX_PAGE_SIZE))
+
+    @classmethod
+    def from_args(cls, args, default_size=DEFAULT_PAGE_SIZE):
+        # Build a page from the query string (?after=...&before=...&per_page=...&sort=...)
+        try:
+            size = int(args.get('per_page', default_size))
+        except (TypeError, ValueError):
+            size = default_size
+        sort = args.get('sort') if args.get('sort') in SORT_KEYS else DEFAULT_SORT
+        return cls(after=decode_cursor(args.get('after'), sort), before=decode_cursor(args.get('before'), sort),
+                   size=size, sort=sort)
+
+    @property
+    def backwards(self):
+        return self.before is not None
+
+    @property
+    def cursor(self):
+        return self.after if self.after is not None else self.before
+
+    def finish(self, rows):
+        ''' Trims the look-ahead row and works out the next/prev cursors'''
+        rows = list(rows)
+        has_more = len(rows) > self.size
+        rows = rows[:self.size]
+
+        # Going backwards the query runs in reverse order, so flip it back
+        if self.backwards:
+            rows.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, self.after is not None
+
+        next_cursor = encode_cursor(rows[-1], self.sort) if rows and has_next else None
+        prev_cursor = encode_cursor(rows[0], self.sort) if rows and has_prev else None
+        return rows, next_cursor, prev_cursor
+
+
+# Builds the prev/next links for a template, keeping the current filters in the query string
+def page_links(base_url, args, next_cursor, prev_cursor):
+    kept = [(k, v) for k, v in args.items(multi=True) if k not in ('after', 'before')]
+
+    def link(name, cursor):
+        if cursor is None:
+            return None
+        return base_url + '?' + urlencode(kept + [(name, cursor)])
+
+    return {'next_url': link('after', next_cursor), 'prev_url': link('before', prev_cursor)}
@@ -0,0 +1,211 @@
+import time
+import threading
+from collections import deque, OrderedDict
+
+import MySQLdb
+
+
+class PoolTimeout(Exception):
+    ''' Raised when no connection frees up within the checkout timeout'''
+
+
+class PooledConnection():
+
+    def __init__(self, conn):
+        ''' A raw MySQLdb connection plus the bookkeeping the pool needs'''
+        self.conn = conn
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+        # Server-side prepared statements that live on this connection, see MyDatabase.query
+        self.statements = OrderedDict()
+
+
+class ConnectionPool():
+
+    def __init__(self, connect_args, min_size=1, max_size=10, max_lifetime=1800,
+                 idle_timeout=300, checkout_timeout=10, reap_interval=30):
+        ''' Thread-safe pool of MySQLdb connections'''
+        # connect_args is a callable so the config can be read after the app is set up
+        self.connect_args = connect_args
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.reap_interval = reap_interval
+
+        self.idle = deque()
+        self.lock = threading.Condition()
+
+        # Open = idle + in use
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.created = 0
+        self.closed = 0
+        self.failed_checks = 0
+        self.last_reap = time.monotonic()
+        self.warmed = False
+
+    def _connect(self):
+        return PooledConnection(MySQLdb.connect(**self.connect_args()))
+
+    def _close(self, pooled):
+        try:
+            pooled.conn.close()
+        except MySQLdb.Error:
+            pass
+        with self.lock:
+            self.open -= 1
+            self.closed += 1
+            self.lock.notify()
+
+    def _expired(self, pooled, now):
+        return self.max_lifetime and now - pooled.created > self.max_lifetime
+
+    def _healthy(self, pooled):
+        # Cheap round trip to make sure the server didn't drop us while we sat idle
+        try:
+            pooled.conn.ping()
+            return True
+        except MySQLdb.Error:
+            with self.lock:
+                self.failed_checks += 1
+            return False
+
+    def acquire(self, timeout=None):
+        ''' Checks out a healthy connection, opening one if the pool has room'''
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        # Open the first min_size connections up front on first use
+        if not self.warmed:
+            self.warmed = True
+            self.fill()
+        else:
+            self.reap()
+
+        while True:
+            pooled = None
+            with self.lock:
+                while not self.idle and self.open >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f'No database connection available after {timeout}s')
+                    self.waiting += 1
+                    try:
+                        self.lock.wait(remaining)
+                    finally:
+                        self.waiting -= 1
+
+                if self.idle:
+                    # Most recently used first, it's the least likely to have gone stale
+                    pooled = self.idle.pop()
+                else:
+                    self.open += 1
+                self.in_use += 1
+
+            if pooled is None:
+                try:
+                    pooled = self._connect()
+                except Exception:
+                    with self.lock:
+                        self.open -= 1
+                        self.in_use -= 1
+                        self.lock.notify()
+                    raise
+                with self.lock:
+                    self.created += 1
+                return pooled
+
+            if not self._expired(pooled, time.monotonic()) and self._healthy(pooled):
+                return pooled
+
+            # Dead or too old, throw it away and try again
+            with self.lock:
+                self.in_use -= 1
+            self._close(pooled)
+
+    def release(self, pooled, discard=False):
+        ''' Returns a connection to the pool, rolling back anything left uncommitted'''
+        with self.lock:
+            self.in_use -= 1
+
+        if not discard:
+            try:
+                pooled.conn.rollback()
+            except MySQLdb.Error:
+                discard = True
+
+        now = time.monotonic()
+        if discard or self._expired(pooled, now):
+            self._close(pooled)
+            return
+
+        pooled.last_used = now
+        with self.lock:
+            self.idle.append(pooled)
+            self.lock.notify()
+
+    def reap(self, force=False):
+        ''' Closes idle connections past the idle timeout or max lifetime, keeping min_size around'''
+        now = time.monotonic()
+        reaped = []
+        with self.lock:
+            if not force and now - self.last_reap < self.reap_interval:
+                return 0
+            self.last_reap = now
+
+            # The oldest idle connections sit at the left of the deque
+            keep = deque()
+            while self.idle:
+                pooled = self.idle.popleft()
+                idle_too_long = self.idle_timeout and now - pooled.last_used > self.idle_timeout
+                if self._expired(pooled, now) or (idle_too_long and self.open - len(reaped) > self.min_size):
+                    reaped.append(pooled)
+                else:
+                    keep.append(pooled)
+            self.idle = keep
+
+        for pooled in reaped:
+            self._close(pooled)
+        return len(reaped)
+
+    def fill(self):
+        # Open connections up to min_size so the first requests don't pay for the handshake
+        while True:
+            with self.lock:
+                if self.open >= self.min_size:
+                    return
+                self.open += 1
+            try:
+                pooled = self._connect()
+            except Exception:
+                with self.lock:
+                    self.open -= 1
+                raise
+            with self.lock:
+                self.created += 1
+                self.idle.append(pooled)
+                self.lock.notify()
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = list(self.idle), deque()
+        for pooled in idle:
+            self._close(pooled)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'open': self.open,
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+                'created': self.created,
+                'closed': self.closed,
+                'failed_health_checks': self.failed_checks,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            }
@@ -0,0 +1,136 @@
+import time
+import threading
+import itertools
+
+import MySQLdb
+import MySQLdb.cursors
+
+
+class Replica():
+
+    def __init__(self, host, port, pool):
+        ''' One read replica: its connection pool and what we last saw of its replication lag'''
+        self.host = host
+        self.port = port
+        self.pool = pool
+
+        # Seconds behind the primary at the last check, None until checked or while replication is broken
+        self.lag = None
+        self.healthy = False
+        self.checked = None
+        self.checking = False
+        self.reads = 0
+        self.errors = 0
+
+    @property
+    def name(self):
+        return f'{self.host}:{self.port}'
+
+
+class ReplicaSet():
+
+    def __init__(self, replicas, max_lag=5, check_interval=5):
+        ''' Picks the replica a request reads from: the least busy one that is up and no more than
+            max_lag seconds behind, or None so the caller falls back to the primary'''
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.turn = itertools.count()
+        self.fallbacks = 0
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def pick(self):
+        if not self.replicas:
+            return None
+
+        # Start somewhere different each time so equally busy replicas take turns
+        start = next(self.turn)
+        best = None
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            self.check(replica)
+            if not replica.healthy:
+                continue
+            if best is None or replica.pool.in_use < best.pool.in_use:
+                best = replica
+
+        if best is None:
+            with self.lock:
+                self.fallbacks += 1
+        return best
+
+    def check(self, replica):
+        # Re-measures the lag once per check_interval, one thread at a time. Everyone else goes
+        # on the last reading instead of queueing up behind the check
+        now = time.monotonic()
+        with self.lock:
+            if replica.checking or (replica.checked is not None and now - replica.checked < self.check_interval):
+                return
+            replica.checking = True
+
+        try:
+            lag = self.measure(replica)
+        except MySQLdb.Error:
+            lag = None
+        finally:
+            with self.lock:
+                replica.checking = False
+                replica.checked = time.monotonic()
+
+        replica.lag = lag
+        replica.healthy = lag is not None and lag <= self.max_lag
+
+    def measure(self, replica):
+        pooled = replica.pool.acquire(timeout=1)
+        discard = False
+        try:
+            cur = pooled.conn.cursor(MySQLdb.cursors.DictCursor)
+            try:
+                try:
+                    cur.execute('SHOW REPLICA STATUS')
+                except MySQLdb.ProgrammingError:
+                    # MariaDB and MySQL before 8.0.22 only know the old name
+                    cur.execute('SHOW SLAVE STATUS')
+                row = cur.fetchone()
+            finally:
+                cur.close()
+        except MySQLdb.Error:
+            discard = True
+            raise
+        finally:
+            replica.pool.release(pooled, discard=discard)
+
+        # No row means the server isn't replicating from anything, so its data could be any age
+        if row is None:
+            return None
+        return row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+
+    def failed(self, replica):
+        # A query on it hit a connection error: skip it until the next check says otherwise
+        with self.lock:
+            replica.errors += 1
+            replica.checked = time.monotonic()
+        replica.healthy = False
+
+    def read(self, replica):
+        with self.lock:
+            replica.reads += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max_lag': self.max_lag,
+                'fallbacks_to_primary': self.fallbacks,
+                'replicas': {
+                    r.name: {
+                        'healthy': r.healthy,
+                        'lag': r.lag,
+                        'reads': r.reads,
+                        'errors': r.errors,
+                        'pool': r.pool.stats(),
+                    } for r in self.replicas
+                },
+            }
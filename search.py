@@ -0,0 +1,280 @@
+import bisect
+import contextlib
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+
+
+logger = logging.getLogger(__name__)
+
+
+# What the index keeps per vehicle: enough to draw a result card without going back to MySQL
+SearchDocument = namedtuple('SearchDocument', [
+    'vehicleID', 'vin', 'model_year', 'model_name', 'manufacturer_name', 'vehicle_type_name',
+    'description', 'concatenated_colors', 'purchase_price', 'total_cost', 'list_price', 'sold', 'pending_parts',
+])
+
+# How much a word counts towards a vehicle's score depending on where it was found
+FIELD_WEIGHTS = {
+    'model_name': 3,
+    'manufacturer_name': 3,
+    'vehicle_type_name': 2,
+    'concatenated_colors': 2,
+    'model_year': 2,
+    'description': 1,
+}
+
+# A whole word match beats a prefix match, a VIN hit beats everything
+EXACT_BONUS = 2
+VIN_EXACT_SCORE = 40
+VIN_FRAGMENT_SCORE = 20
+
+# Shortest token that gets prefix or VIN fragment matching, and how many words one prefix may expand to
+MIN_PREFIX = 2
+MIN_VIN_FRAGMENT = 3
+MAX_PREFIX_TERMS = 200
+
+TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    return TOKEN.findall(str(text).lower()) if text is not None else []
+
+
+class SearchIndex():
+
+    def __init__(self, loader, max_age=600):
+        ''' Inverted index over the inventory, kept in memory so searches never touch MySQL
+            loader(vehicle_id=None) yields SearchDocument rows, for everything or one vehicle'''
+        self.loader = loader
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.loaded_at = None
+        self.loading = False
+        self.reset()
+
+        # Set once the first build is in. The background rebuilder (start()) sleeps on wake between builds
+        self.ready = threading.Event()
+        self.wake = threading.Event()
+        self.worker = None
+
+    def reset(self):
+        # vehicleID -> SearchDocument
+        self.docs = {}
+
+        # word -> {vehicleID: weight}, plus every word in sorted order for prefix lookups
+        self.postings = {}
+        self.terms = []
+
+        # (vin, vehicleID) and (reversed vin, vehicleID) sorted, for VIN prefix and tail fragments
+        self.vins = []
+        self.vins_reversed = []
+
+    def document_terms(self, doc):
+        terms = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(getattr(doc, field)):
+                terms[term] = max(terms.get(term, 0), weight)
+        return terms
+
+    def _add(self, doc):
+        vid = doc.vehicleID
+        self.docs[vid] = doc
+        for term, weight in self.document_terms(doc).items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            posting[vid] = weight
+        vin = (doc.vin or '').lower()
+        if vin:
+            bisect.insort(self.vins, (vin, vid))
+            bisect.insort(self.vins_reversed, (vin[::-1], vid))
+
+    def _remove(self, vid):
+        doc = self.docs.pop(vid, None)
+        if doc is None:
+            return
+        for term in self.document_terms(doc):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(vid, None)
+            if not posting:
+                del self.postings[term]
+                i = bisect.bisect_left(self.terms, term)
+                if i < len(self.terms) and self.terms[i] == term:
+                    del self.terms[i]
+        vin = (doc.vin or '').lower()
+        for entries, key in ((self.vins, vin), (self.vins_reversed, vin[::-1])):
+            i = bisect.bisect_left(entries, (key, vid))
+            if i < len(entries) and entries[i] == (key, vid):
+                del entries[i]
+
+    def load(self):
+        # Build the new index on the side and swap it in, searches keep using the old one meanwhile
+        fresh = SearchIndex(self.loader, self.max_age)
+        docs = list(self.loader())
+        for doc in docs:
+            fresh.docs[doc.vehicleID] = doc
+            for term, weight in fresh.document_terms(doc).items():
+                fresh.postings.setdefault(term, {})[doc.vehicleID] = weight
+            vin = (doc.vin or '').lower()
+            if vin:
+                fresh.vins.append((vin, doc.vehicleID))
+                fresh.vins_reversed.append((vin[::-1], doc.vehicleID))
+        fresh.terms = sorted(fresh.postings)
+        fresh.vins.sort()
+        fresh.vins_reversed.sort()
+
+        with self.lock:
+            self.docs, self.postings, self.terms = fresh.docs, fresh.postings, fresh.terms
+            self.vins, self.vins_reversed = fresh.vins, fresh.vins_reversed
+            self.loaded_at = time.monotonic()
+        self.ready.set()
+
+    def rebuild(self):
+        # Builds unless another thread already is, False if it left it to them
+        with self.lock:
+            if self.loading:
+                return False
+            self.loading = True
+        try:
+            self.load()
+        finally:
+            with self.lock:
+                self.loading = False
+        return True
+
+    def start(self, context=None):
+        ''' Builds the index in a background thread now and again every max_age seconds (or when
+            expire() asks), so no search ever waits on a rebuild. context() is entered around each
+            build, e.g. app.app_context for a loader that needs the database. Only the first call
+            starts anything, so it's fine to call on every search'''
+        if self.worker is not None:
+            return
+        with self.lock:
+            if self.worker is not None:
+                return
+            self.worker = threading.Thread(target=self.run, args=(context or contextlib.nullcontext,),
+                                           name='search-index', daemon=True)
+            self.worker.start()
+
+    def run(self, context):
+        while True:
+            try:
+                with context():
+                    self.rebuild()
+            except Exception:
+                # Keep answering from the old index and try again next time
+                logger.exception('Rebuilding the search index failed')
+            self.wake.wait(timeout=self.max_age or None)
+            self.wake.clear()
+
+    def ensure_loaded(self):
+        # Nothing to search until the first build is in, wait for it without holding the lock
+        # (or do it here when nobody else is)
+        while self.loaded_at is None:
+            if self.rebuild():
+                return
+            self.ready.wait(timeout=1)
+
+        # With a background rebuilder running it keeps the index fresh, otherwise whoever finds it
+        # past max_age rebuilds it, picking up changes made outside the app
+        if self.worker is None and self.max_age and time.monotonic() - self.loaded_at > self.max_age:
+            self.rebuild()
+
+    def refresh(self, *vehicle_ids):
+        ''' Re-reads just these vehicles, call after anything that changes them'''
+        if self.loaded_at is None:
+            return
+        for vid in vehicle_ids:
+            docs = list(self.loader(vid))
+            with self.lock:
+                self._remove(vid)
+                for doc in docs:
+                    self._add(doc)
+
+    def expire(self):
+        # After a bulk change: rebuild the whole index instead of re-reading vehicles one by one,
+        # in the background if there's a rebuilder, otherwise on the next search
+        if self.worker is not None:
+            self.wake.set()
+            return
+        with self.lock:
+            if self.loaded_at is not None:
+                self.loaded_at -= self.max_age + 1
+
+    def remove(self, *vehicle_ids):
+        with self.lock:
+            for vid in vehicle_ids:
+                self._remove(vid)
+
+    def _prefix_terms(self, token):
+        i = bisect.bisect_left(self.terms, token)
+        matches = []
+        while i < len(self.terms) and self.terms[i].startswith(token) and len(matches) < MAX_PREFIX_TERMS:
+            matches.append(self.terms[i])
+            i += 1
+        return matches
+
+    def _vin_matches(self, fragment):
+        hits = {}
+        for entries, key in ((self.vins, fragment), (self.vins_reversed, fragment[::-1])):
+            i = bisect.bisect_left(entries, (key,))
+            while i < len(entries) and entries[i][0].startswith(key):
+                vin, vid = entries[i]
+                hits[vid] = VIN_EXACT_SCORE if len(vin) == len(key) else VIN_FRAGMENT_SCORE
+                i += 1
+        return hits
+
+    def _token_scores(self, token):
+        scores = {}
+        if len(token) >= MIN_PREFIX:
+            for term in self._prefix_terms(token):
+                bonus = EXACT_BONUS if term == token else 1
+                for vid, weight in self.postings[term].items():
+                    scores[vid] = max(scores.get(vid, 0), weight * bonus)
+        else:
+            for vid, weight in self.postings.get(token, {}).items():
+                scores[vid] = weight * EXACT_BONUS
+
+        if len(token) >= MIN_VIN_FRAGMENT:
+            for vid, score in self._vin_matches(token).items():
+                scores[vid] = max(scores.get(vid, 0), score)
+        return scores
+
+    def search(self, query, limit=50, visible=None):
+        ''' Returns (total matches, best SearchDocuments first), every word in the query has to match'''
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return 0, []
+
+        self.ensure_loaded()
+        with self.lock:
+            totals = None
+            # Rarest words first keeps the running intersection small
+            for scores in sorted((self._token_scores(t) for t in tokens), key=len):
+                if totals is None:
+                    totals = dict(scores)
+                else:
+                    totals = {vid: total + scores[vid] for vid, total in totals.items() if vid in scores}
+                if not totals:
+                    return 0, []
+
+            docs = [self.docs[vid] for vid in totals]
+
+        if visible is not None:
+            docs = [doc for doc in docs if visible(doc)]
+        docs.sort(key=lambda doc: (-totals[doc.vehicleID], doc.vehicleID))
+        return len(docs), docs[:limit]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'documents': len(self.docs),
+                'terms': len(self.terms),
+                'age_seconds': None if self.loaded_at is None else round(time.monotonic() - self.loaded_at, 1),
+            }
@@ -0,0 +1,36 @@
+import time
+
+from flask.sessions import SecureCookieSessionInterface
+
+
+# Re-sign the cookie with a fresh "last seen" time at most this often for a session that is only being read
+TOUCH_INTERVAL = 60
+
+
+class SignedSessionInterface(SecureCookieSessionInterface):
+
+    def __init__(self, idle_timeout=12 * 3600):
+        ''' Flask's signed cookie sessions: the role and names are read once at login and carried in the
+            cookie, so no request ever goes to the database to find out who it is. On top of that an idle
+            timeout and regenerate() for logins'''
+        self.idle_timeout = idle_timeout
+
+    def open_session(self, app, request):
+        session = super().open_session(app, request)
+        seen = session.get('_seen') if session is not None else None
+
+        # Idle too long: start over, saving the emptied session drops the cookie
+        if seen is not None and time.time() - seen > self.idle_timeout:
+            session.clear()
+        return session
+
+    def save_session(self, app, session, response):
+        if session:
+            now = int(time.time())
+            if session.modified or now - session.get('_seen', 0) >= TOUCH_INTERVAL:
+                session['_seen'] = now
+        super().save_session(app, session, response)
+
+    def regenerate(self, session):
+        # Nothing from before the login (e.g. a session someone planted) carries over into it
+        session.clear()
@@ -0,0 +1,132 @@
+import functools
+import hashlib
+from collections import namedtuple
+
+
+# A fixed SQL template with %s placeholders plus the values bound to them
+# The same template text always comes back for the same shape of query, so the
+# database layer can prepare it once per connection and reuse it
+Statement = namedtuple('Statement', ['sql', 'params'])
+
+
+# One id or a list of them, as the tuple of values to bind
+def id_tuple(value):
+    return tuple(value) if isinstance(value, (list, tuple, set)) else (value,)
+
+
+# '%s, %s, %s' for an IN (...) over these values
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+class SelectBuilder():
+
+    def __init__(self, base):
+        ''' Builds a SELECT from a base query plus optional WHERE conditions'''
+        self.base = base
+        self.conditions = []
+        self.params = []
+        self.tail = ''
+        self.tail_params = []
+
+    def where(self, condition, *params):
+        # Conditions must only ever hold placeholders, never values
+        self.conditions.append(condition)
+        self.params.extend(params)
+        return self
+
+    def end(self, tail, *params):
+        # ORDER BY / LIMIT part of the query
+        self.tail = tail
+        self.tail_params = list(params)
+        return self
+
+    def build(self):
+        sql = self.base
+        if self.conditions:
+            sql += "\nWHERE\n    " + "\n    AND ".join(self.conditions)
+        sql += "\n" + self.tail
+        return Statement(sql, tuple(self.params + self.tail_params))
+
+
+# SQL template -> name of the method that built it, e.g. 'vehicleSQL.sellable_vehicles'
+# Lets the database layer label stats and logs without every caller passing a name around
+QUERY_NAMES = {}
+
+# Templates are a bounded set, this is just a guard against something building unbounded ones
+MAX_QUERY_NAMES = 4096
+
+
+def query_name(sql):
+    return QUERY_NAMES.get(sql)
+
+
+def _remember(name, result):
+    if isinstance(result, Statement):
+        result = result.sql
+    if isinstance(result, str):
+        if result not in QUERY_NAMES and len(QUERY_NAMES) < MAX_QUERY_NAMES:
+            QUERY_NAMES[result] = name
+    elif isinstance(result, list):
+        for item in result:
+            _remember(name, item)
+
+
+# Class decorator for the *SQL classes: remembers which method produced each template
+def named_queries(cls):
+    for attr, method in list(vars(cls).items()):
+        if attr.startswith('_') or not callable(method):
+            continue
+
+        def wrap(method, name):
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                result = method(*args, **kwargs)
+                _remember(name, result)
+                return result
+            return wrapper
+
+        setattr(cls, attr, wrap(method, f'{cls.__name__}.{attr}'))
+    return cls
+
+
+# A query compiled once and looked up after that: a stable name (what stats, logs and caches key on),
+# the SQL template and a fingerprint of the template that is the same in every process
+Query = namedtuple('Query', ['name', 'sql', 'fingerprint'])
+
+
+def fingerprint(sql):
+    return hashlib.sha1(' '.join(sql.split()).encode('utf-8')).hexdigest()[:12]
+
+
+class QueryRegistry():
+
+    def __init__(self):
+        ''' Named SQL templates, each built the first time its name is asked for and reused after that'''
+        self.queries = {}
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __iter__(self):
+        return iter(self.queries.values())
+
+    def __getitem__(self, name):
+        return self.queries[name]
+
+    def add(self, name, sql):
+        query = Query(name, sql, fingerprint(sql))
+        self.queries[name] = query
+        # The registry's name wins over whatever method happened to return the template first
+        QUERY_NAMES[sql] = name
+        return query
+
+    def compiled(self, name, build):
+        # Two threads racing on a new name both build the same template, the second one just replaces it
+        query = self.queries.get(name)
+        if query is None:
+            query = self.add(name, build())
+        return query
+
+    def fingerprints(self):
+        return {query.name: query.fingerprint for query in self.queries.values()}
@@ -1,15 +1,22 @@
-class vehicleSQL():
+from sql.builder import named_queries, QueryRegistry, SelectBuilder, Statement
 
-    
-    def display_vehicles(self):
-        sql = '''SELECT
+
+# The inventory projection the listings, the details page, the single vehicle lookup and the search
+# documents share: the vehicle row, its manufacturer and type names, the purchase and the
+# vehicle_rollup columns. Composed once here, queries that need more add their own columns and joins
+INVENTORY_COLUMNS = '''
                 v.*,
-                vcl.concatenated_colors,
+                vr.concatenated_colors,
                 vtn.vehicle_type_name,
                 m.manufacturer_name,
                 pt.purchase_price AS purchase_price,
+                pt.purchase_date AS purchase_date,
                 pt.vehicle_condition AS vehicle_condition,
-                vpc.total_cost AS total_cost
+                vr.total_cost AS total_cost,
+                vr.list_price,
+                vr.row_version'''
+
+INVENTORY_FROM = '''
             FROM
                 csc206cars.vehicles v
             LEFT JOIN
@@ -25,40 +32,303 @@ class vehicleSQL():
             ON
                 v.vehicleID = pt.vehicleID
             LEFT JOIN
+                csc206cars.vehicle_rollup vr
+            ON
+                v.vehicleID = vr.vehicleID
+        '''
+
+
+# The shared projection plus a query's own columns (after the shared ones) and joins/WHERE (after the shared joins)
+def inventory_select(extra_columns='', extra_joins=''):
+    columns = INVENTORY_COLUMNS + (',' + extra_columns if extra_columns else '')
+    return '''
+            SELECT''' + columns + INVENTORY_FROM + extra_joins
+
+
+INVENTORY_SELECT = inventory_select()
+
+# Which vehicles each listing shows. Unsold vehicles, and for sellable only those with every part
+# installed, both read the inventory state the write paths keep in vehicle_rollup (sql/rollup.py)
+LISTING_CONDITIONS = {
+    'all': None,
+    'sellable': "vr.inventory_state = 'sellable'",
+    'unsold': "vr.inventory_state IN ('in_prep', 'sellable')",
+}
+
+
+# Ewwwww multiple colors
+def color_exists(condition):
+    return f'''EXISTS (
+                    SELECT 1
+                    FROM csc206cars.vehiclecolors vc
+                    INNER JOIN csc206cars.colors c ON vc.colorID = c.colorID
+                    WHERE vc.vehicleID = v.vehicleID AND {condition}
+                )'''
+
+
+# Filter key from app.py -> its placeholder condition. The order is fixed so every combination of
+# filters maps onto one statement template
+FILTER_CONDITIONS = (
+    ('manID', "v.manufacturerID = %s"),
+    ('vehicletypeID', "v.vehicle_typeID = %s"),
+    ('modelname', "v.model_name = %s"),
+    ('model_year', "v.model_year = %s"),
+    ('fueltype', "v.fuel_type = %s"),
+    # Price range on the stored list price, a range scan on ix_vehicle_rollup_state_price
+    ('min_price', "vr.list_price >= %s"),
+    ('max_price', "vr.list_price <= %s"),
+    ('colorid', color_exists("vc.colorID = %s")),
+    ('colorname', color_exists("c.color_name = %s")),
+)
+FILTER_SQL = dict(FILTER_CONDITIONS)
+
+
+# The filters that apply, in template order. A color ID wins over a color name
+def filter_keys(filters):
+    if not filters:
+        return ()
+    return tuple(key for key, condition in FILTER_CONDITIONS
+                 if key in filters and not (key == 'colorname' and 'colorid' in filters))
+
+
+# Keyset pagination per pagination.SORT_KEYS order: the cursor condition and ORDER BY for paging
+# forwards (after) and backwards (before), and the cursor values in placeholder order.
+# name is the listing order (model name, manufacturer name, then vehicleID as a tiebreaker),
+# price is cheapest first, which with the inventory state fixed walks ix_vehicle_rollup_state_price in order
+# ({price} is filled in per listing by price_column)
+KEYSETS = {
+    'name': {
+        'after': '''(
+                    v.model_name < %s
+                    OR (v.model_name = %s AND m.manufacturer_name > %s)
+                    OR (v.model_name = %s AND m.manufacturer_name = %s AND v.vehicleID > %s)
+                )''',
+        'before': '''(
+                    v.model_name > %s
+                    OR (v.model_name = %s AND m.manufacturer_name < %s)
+                    OR (v.model_name = %s AND m.manufacturer_name = %s AND v.vehicleID < %s)
+                )''',
+        'forward': '''
+            ORDER BY
+                v.model_name DESC,
+                m.manufacturer_name ASC,
+                v.vehicleID ASC
+            LIMIT %s
+        ''',
+        'backward': '''
+            ORDER BY
+                v.model_name ASC,
+                m.manufacturer_name DESC,
+                v.vehicleID DESC
+            LIMIT %s
+        ''',
+        'cursor': lambda model, manufacturer, vehicle: (model, model, manufacturer, model, manufacturer, vehicle),
+    },
+    'price': {
+        'after': '''(
+                    {price} > %s
+                    OR ({price} = %s AND v.vehicleID > %s)
+                )''',
+        'before': '''(
+                    {price} < %s
+                    OR ({price} = %s AND v.vehicleID < %s)
+                )''',
+        'forward': '''
+            ORDER BY
+                {price} ASC,
+                v.vehicleID ASC
+            LIMIT %s
+        ''',
+        'backward': '''
+            ORDER BY
+                {price} DESC,
+                v.vehicleID DESC
+            LIMIT %s
+        ''',
+        'cursor': lambda price, vehicle: (price, price, vehicle),
+    },
+}
+
+
+# The price the price keyset sorts on. The state filtered listings only hold vehicles with a rollup row,
+# the all listing also LEFT JOINs ones without, whose price counts as 0 (pagination.encode_cursor agrees)
+def price_column(listing):
+    return 'vr.list_price' if LISTING_CONDITIONS[listing] else 'COALESCE(vr.list_price, 0)'
+
+
+# Filtered listings without a page still come back in listing order
+UNPAGED_ORDER = '''
+            ORDER BY
+                v.model_name DESC,
+                m.manufacturer_name ASC
+        '''
+
+
+# Every inventory query by name, e.g. 'vehicles.sellable[manID+fueltype].price.after'
+INVENTORY_QUERIES = QueryRegistry()
+
+
+# Where a page sits: None for the whole listing, 'first' without a cursor, else 'after' or 'before'
+def page_mode(page):
+    if page is None:
+        return None
+    if page.cursor is None:
+        return 'first'
+    return 'before' if page.backwards else 'after'
+
+
+def listing_name(listing, keys, sort, mode):
+    name = f'vehicles.{listing}'
+    if keys:
+        name += '[' + '+'.join(keys) + ']'
+    if mode is not None:
+        name += f'.{sort}.{mode}'
+    return name
+
+
+def compile_listing(listing, keys, sort, mode):
+    query = SelectBuilder(INVENTORY_SELECT)
+    if LISTING_CONDITIONS[listing]:
+        query.where(LISTING_CONDITIONS[listing])
+    for key in keys:
+        query.where(FILTER_SQL[key])
+
+    if mode is None:
+        # The unfiltered full inventory stays in table order
+        return query.end(UNPAGED_ORDER if query.conditions else '').build().sql
+
+    keyset = {key: fragment.replace('{price}', price_column(listing)) if isinstance(fragment, str) else fragment
+              for key, fragment in KEYSETS[sort].items()}
+    if mode != 'first':
+        query.where(keyset[mode])
+    # One extra row (the LIMIT) tells us whether there is another page
+    return query.end(keyset['backward' if mode == 'before' else 'forward']).build().sql
+
+
+# The compiled template for one listing shape plus the values for this call: filters, cursor, LIMIT
+def listing_statement(listing, filters=None, page=None):
+    keys = filter_keys(filters)
+    mode = page_mode(page)
+    sort = page.sort if page is not None else None
+    query = INVENTORY_QUERIES.compiled(listing_name(listing, keys, sort, mode),
+                                       lambda: compile_listing(listing, keys, sort, mode))
+
+    params = tuple(filters[key] for key in keys)
+    if mode in ('after', 'before'):
+        params += KEYSETS[sort]['cursor'](*page.cursor)
+    if page is not None:
+        params += (page.size + 1,)
+    return Statement(query.sql, params)
+
+
+# Build the unfiltered shapes and the single vehicle lookup at import. Filtered shapes (a few hundred
+# combinations) are built the first time a request uses them
+for _listing in LISTING_CONDITIONS:
+    INVENTORY_QUERIES.compiled(listing_name(_listing, (), None, None), lambda: compile_listing(_listing, (), None, None))
+    for _sort in KEYSETS:
+        for _mode in ('first', 'after', 'before'):
+            INVENTORY_QUERIES.compiled(listing_name(_listing, (), _sort, _mode),
+                                       lambda: compile_listing(_listing, (), _sort, _mode))
+
+INVENTORY_QUERIES.add('vehicles.details', INVENTORY_SELECT + '''
+            WHERE
+                v.vehicleID = %s
+            LIMIT 1
+        ''')
+
+# Everything the details page needs in one round trip: the vehicle row, its seller and buyer,
+# its parts packed into a JSON array, and whether it can be sold (its stored inventory state)
+INVENTORY_QUERIES.add('vehicles.page', inventory_select('''
+                pt.customerID AS seller_customerID,
+                c1.first_name AS seller_first_name,
+                c1.last_name AS seller_last_name,
+                c1.street AS seller_street,
+                c1.city AS seller_city,
+                c1.state AS seller_state,
+                c1.postal_code AS seller_postal_code,
+                c1.phone_number AS seller_phone_number,
+                c1.email_address AS seller_email_address,
+                s.customerID AS buyer_customerID,
+                c2.first_name AS buyer_first_name,
+                c2.last_name AS buyer_last_name,
+                c2.street AS buyer_street,
+                c2.city AS buyer_city,
+                c2.state AS buyer_state,
+                c2.postal_code AS buyer_postal_code,
+                c2.phone_number AS buyer_phone_number,
+                c2.email_address AS buyer_email_address,
                 (
                     SELECT
-                        po.vehicleID,
-                        SUM(p.cost) AS total_cost
+                        JSON_ARRAYAGG(JSON_OBJECT(
+                            'partID', p.partID,
+                            'part_orderID', p.part_orderID,
+                            'part_number', p.part_number,
+                            'cost', p.cost,
+                            'description', p.description,
+                            'quantity', p.quantity,
+                            'status', p.status,
+                            'order_number', po.order_number
+                        ))
                     FROM
                         csc206cars.partorders po
                     INNER JOIN
                         csc206cars.parts p
                     ON
                         po.part_orderID = p.part_orderID
-                    GROUP BY
-                        po.vehicleID
-                ) AS vpc
+                    WHERE
+                        po.vehicleID = v.vehicleID
+                ) AS parts_json,
+                vr.inventory_state,
+                vr.inventory_state <=> 'sellable' AS eligible_for_sale''', '''
+            LEFT JOIN
+                csc206cars.customers c1
             ON
-                v.vehicleID = vpc.vehicleID
+                pt.customerID = c1.customerID
             LEFT JOIN
-                (
-                    SELECT
-                        vc.vehicleID,
-                        GROUP_CONCAT(c.color_name ORDER BY c.color_name ASC SEPARATOR ', ') AS concatenated_colors
-                    FROM
-                        csc206cars.vehiclecolors vc
-                    INNER JOIN
-                        csc206cars.colors c
-                    ON
-                        vc.colorID = c.colorID
-                    GROUP BY
-                        vc.vehicleID
-                ) AS vcl
+                csc206cars.salestransactions s
             ON
-                v.vehicleID = vcl.vehicleID
-                    '''
-        return sql
-    
+                v.vehicleID = s.vehicleID
+            LEFT JOIN
+                csc206cars.customers c2
+            ON
+                s.customerID = c2.customerID
+            WHERE
+                v.vehicleID = %s
+            LIMIT 1
+        '''))
+
+# Rows for the in-process search index (search.py), the whole inventory or one vehicle
+SEARCH_DOCUMENT_COLUMNS = '''
+                vr.inventory_state <=> 'sold' AS sold,
+                COALESCE(vr.uninstalled_part_count, 0) AS pending_parts'''
+INVENTORY_QUERIES.add('vehicles.search_documents', inventory_select(SEARCH_DOCUMENT_COLUMNS))
+INVENTORY_QUERIES.add('vehicles.search_document', inventory_select(SEARCH_DOCUMENT_COLUMNS, '''
+            WHERE
+                v.vehicleID = %s
+        '''))
+
+
+@named_queries
+class vehicleSQL():
+
+    # Applies filters using the filter key from app.py, in FILTER_CONDITIONS order
+    def apply_filters(self, query, filters):
+        for key in filter_keys(filters):
+            query.where(FILTER_SQL[key], filters[key])
+        return query
+
+    # Unsold vehicles, and with sellable=True only those with every part installed, so the query needs vr joined
+    def listing_conditions(self, query, sellable):
+        query.where(LISTING_CONDITIONS['sellable' if sellable else 'unsold'])
+        return query
+
+    # Pass a pagination.Page to get one keyset page instead of the whole inventory
+    def display_vehicles(self, page=None):
+        # Unpaged callers keep getting the whole inventory in table order
+        if page is None:
+            return INVENTORY_QUERIES['vehicles.all'].sql
+
+        return listing_statement('all', page=page)
 
     # Allows display of model and manufacturer not all vehicles im just silly
     def all_vehicles(self):
@@ -77,6 +347,7 @@ class vehicleSQL():
         return sql
 
     # Selects the distinct manufacturer names
+    # (called by name through REFERENCE_QUERIES in app.py)
     def vehicle_names(self):
         sql = '''SELECT DISTINCT 
                     m.manufacturer_name,
@@ -146,377 +417,60 @@ class vehicleSQL():
     # Query figured out with ezra
 
     # passes filters dictionary 
-    def sellable_vehicles(self, filters: dict | None = None):
-
-        # First get all the information from the tables
-        # Include concatednated colors ewwwwww
-        sql_base = '''
-            SELECT
-                v.*,
-                vcl.concatenated_colors,
-                vtn.vehicle_type_name,
-                m.manufacturer_name,
-                pt.purchase_price AS purchase_price, 
-                pt.vehicle_condition AS vehicle_condition,
-                vpc.total_cost AS total_cost        
-            FROM
-                csc206cars.vehicles v
-            LEFT JOIN
-                csc206cars.manufacturers m
-            ON
-                v.manufacturerID = m.manufacturerID
-            LEFT JOIN
-                csc206cars.vehicletypes vtn
-            ON
-                v.vehicle_typeID = vtn.vehicle_typeID
-            LEFT JOIN
-                csc206cars.purchasetransactions pt
-            ON
-                v.vehicleID = pt.vehicleID
-            LEFT JOIN
-                (
-                    SELECT
-                        po.vehicleID,
-                        SUM(p.cost) AS total_cost
-                    FROM
-                        csc206cars.partorders po
-                    INNER JOIN
-                        csc206cars.parts p
-                    ON
-                        po.part_orderID = p.part_orderID
-                    GROUP BY
-                        po.vehicleID
-                ) AS vpc
-            ON
-                v.vehicleID = vpc.vehicleID
-            LEFT JOIN
-                (
-                    SELECT
-                        vc.vehicleID,
-                        GROUP_CONCAT(c.color_name ORDER BY c.color_name ASC SEPARATOR ', ') AS concatenated_colors
-                    FROM
-                        csc206cars.vehiclecolors vc
-                    INNER JOIN
-                        csc206cars.colors c
-                    ON
-                        vc.colorID = c.colorID
-                    GROUP BY
-                        vc.vehicleID
-                ) AS vcl
-            ON
-                v.vehicleID = vcl.vehicleID
-        '''
-
-        # Determines if vehicle is sellable
-        where_conditions = [
-            "v.vehicleID NOT IN (SELECT vehicleID FROM csc206cars.salestransactions)",
-            '''v.vehicleID NOT IN (
-                SELECT DISTINCT po.vehicleID
-                FROM csc206cars.partorders po
-                INNER JOIN csc206cars.parts p on po.part_orderID = p.part_orderID
-                WHERE p.status != 'Installed'
-            )'''
-        ]
-
-        # Applies filters using the filter key from app.py
-        # If the filter is in the dictionary, add to where condition
-        if filters:
-            if 'manID' in filters:
-                where_conditions.append(f"v.manufacturerID = {filters['manID']}")
-
-            if 'vehicletypeID' in filters:
-                where_conditions.append(f"v.vehicle_typeID = {filters['vehicletypeID']}")
-
-            if 'modelname' in filters:
-                where_conditions.append(f"v.model_name = '{filters['modelname']}'")
-
-            if 'model_year' in filters:
-                where_conditions.append(f"v.model_year = {filters['model_year']}")
-
-            if 'fueltype' in filters:
-                where_conditions.append(f"v.fuel_type = '{filters['fueltype']}'")
-
-
-            # Ewwwww multiple colors
-            color_condition = None
-            if 'colorid' in filters:
-                color_condition = f"vc.colorID = {filters['colorid']}"
-            elif 'colorname' in filters:
-                color_condition = f"c.color_name = '{filters['colorname']}'"
-
-            if color_condition:
-                color_exists_clause = f'''
-                EXISTS (
-                    SELECT 1
-                    FROM csc206cars.vehiclecolors vc
-                    INNER JOIN csc206cars.colors c ON vc.colorID = c.colorID
-                    WHERE vc.vehicleID = v.vehicleID AND {color_condition}
-                )
-                '''
-                where_conditions.append(color_exists_clause)
-
-        # Combines sellable condtion with possible filters
-        where_clause = "WHERE\n" + "\nAND ".join(where_conditions)
-
-        # Lets assemble this silly query
-        sql = f'''
-            {sql_base}
-            {where_clause}
-            ORDER BY
-                v.model_name DESC,
-                m.manufacturer_name ASC
-        '''
-        return sql
+    def sellable_vehicles(self, filters: dict | None = None, page=None):
+        return listing_statement('sellable', filters, page)
 
     # Returns all unsold vehicles, regardless of part installation status
-    def unsold_vehicles(self, filters: dict | None = None):
+    def unsold_vehicles(self, filters: dict | None = None, page=None):
+        return listing_statement('unsold', filters, page)
 
+    # Vehicle counts for every combination of the filter bar's fields within the filtered listing,
+    # one aggregate pass that facets.py adds up per field (colors come as the rollup's name list)
+    def facet_counts(self, filters: dict | None = None, sellable=True):
         sql_base = '''
             SELECT
-                v.*,
-                vcl.concatenated_colors,
-                vtn.vehicle_type_name,
-                m.manufacturer_name,
-                pt.purchase_price AS purchase_price,
-                pt.vehicle_condition AS vehicle_condition,
-                vpc.total_cost AS total_cost
+                v.manufacturerID,
+                v.vehicle_typeID,
+                v.model_year,
+                v.fuel_type,
+                vr.concatenated_colors,
+                COUNT(*) AS vehicle_count
             FROM
                 csc206cars.vehicles v
             LEFT JOIN
-                csc206cars.manufacturers m
+                csc206cars.vehicle_rollup vr
             ON
-                v.manufacturerID = m.manufacturerID
-            LEFT JOIN
-                csc206cars.vehicletypes vtn
-            ON
-                v.vehicle_typeID = vtn.vehicle_typeID
-            LEFT JOIN
-                csc206cars.purchasetransactions pt
-            ON
-                v.vehicleID = pt.vehicleID
-            LEFT JOIN
-                (
-                    SELECT
-                        po.vehicleID,
-                        SUM(p.cost) AS total_cost
-                    FROM
-                        csc206cars.partorders po
-                    INNER JOIN
-                        csc206cars.parts p
-                    ON
-                        po.part_orderID = p.part_orderID
-                    GROUP BY
-                        po.vehicleID
-                ) AS vpc
-            ON
-                v.vehicleID = vpc.vehicleID
-            LEFT JOIN
-                (
-                    SELECT
-                        vc.vehicleID,
-                        GROUP_CONCAT(c.color_name ORDER BY c.color_name ASC SEPARATOR ', ') AS concatenated_colors
-                    FROM
-                        csc206cars.vehiclecolors vc
-                    INNER JOIN
-                        csc206cars.colors c
-                    ON
-                        vc.colorID = c.colorID
-                    GROUP BY
-                        vc.vehicleID
-                ) AS vcl
-            ON
-                v.vehicleID = vcl.vehicleID
+                v.vehicleID = vr.vehicleID
         '''
 
-        where_conditions = [
-            "v.vehicleID NOT IN (SELECT vehicleID FROM csc206cars.salestransactions)"
-        ]
-
-        if filters:
-            if 'manID' in filters:
-                where_conditions.append(f"v.manufacturerID = {filters['manID']}")
-
-            if 'vehicletypeID' in filters:
-                where_conditions.append(f"v.vehicle_typeID = {filters['vehicletypeID']}")
-
-            if 'modelname' in filters:
-                where_conditions.append(f"v.model_name = '{filters['modelname']}'")
-
-            if 'model_year' in filters:
-                where_conditions.append(f"v.model_year = {filters['model_year']}")
-
-            if 'fueltype' in filters:
-                where_conditions.append(f"v.fuel_type = '{filters['fueltype']}'")
-
-            color_condition = None
-            if 'colorid' in filters:
-                color_condition = f"vc.colorID = {filters['colorid']}"
-            elif 'colorname' in filters:
-                color_condition = f"c.color_name = '{filters['colorname']}'"
-
-            if color_condition:
-                color_exists_clause = f'''
-                EXISTS (
-                    SELECT 1
-                    FROM csc206cars.vehiclecolors vc
-                    INNER JOIN csc206cars.colors c ON vc.colorID = c.colorID
-                    WHERE vc.vehicleID = v.vehicleID AND {color_condition}
-                )
-                '''
-                where_conditions.append(color_exists_clause)
-
-        where_clause = "WHERE\n" + "\nAND ".join(where_conditions)
-
-        sql = f'''
-            {sql_base}
-            {where_clause}
-            ORDER BY
-                v.model_name DESC,
-                m.manufacturer_name ASC
-        '''
-        return sql
+        query = SelectBuilder(sql_base)
+        self.listing_conditions(query, sellable)
+        self.apply_filters(query, filters)
+        query.end('''
+            GROUP BY
+                v.manufacturerID,
+                v.vehicle_typeID,
+                v.model_year,
+                v.fuel_type,
+                vr.concatenated_colors
+        ''')
+
+        return query.build()
+
+    # Rows for the in-process search index (search.py), the whole inventory or one vehicle
+    def search_documents(self, vehicle_id=None):
+        if vehicle_id is None:
+            return INVENTORY_QUERIES['vehicles.search_documents'].sql
+        return Statement(INVENTORY_QUERIES['vehicles.search_document'].sql, (vehicle_id,))
 
     # Get a single vehicle by its ID using LIMIT
     def vehicle_details(self, vehicle_id):
-        sql = f'''
-            SELECT
-                v.*,
-                vcl.concatenated_colors,
-                vtn.vehicle_type_name,
-                m.manufacturer_name,
-                pt.purchase_price AS purchase_price,
-                pt.purchase_date AS purchase_date,
-                pt.vehicle_condition AS vehicle_condition,
-                vpc.total_cost AS total_cost
-            FROM
-                csc206cars.vehicles v
-            LEFT JOIN
-                csc206cars.manufacturers m
-            ON
-                v.manufacturerID = m.manufacturerID
-            LEFT JOIN
-                csc206cars.vehicletypes vtn
-            ON
-                v.vehicle_typeID = vtn.vehicle_typeID
-            LEFT JOIN
-                csc206cars.purchasetransactions pt
-            ON
-                v.vehicleID = pt.vehicleID
-            LEFT JOIN
-                (
-                    SELECT
-                        po.vehicleID,
-                        SUM(p.cost) AS total_cost
-                    FROM
-                        csc206cars.partorders po
-                    INNER JOIN
-                        csc206cars.parts p
-                    ON
-                        po.part_orderID = p.part_orderID
-                    GROUP BY
-                        po.vehicleID
-                ) AS vpc
-            ON
-                v.vehicleID = vpc.vehicleID
-            LEFT JOIN
-                (
-                    SELECT
-                        vc.vehicleID,
-                        GROUP_CONCAT(c.color_name ORDER BY c.color_name ASC SEPARATOR ', ') AS concatenated_colors
-                    FROM
-                        csc206cars.vehiclecolors vc
-                    INNER JOIN
-                        csc206cars.colors c
-                    ON
-                        vc.colorID = c.colorID
-                    GROUP BY
-                        vc.vehicleID
-                ) AS vcl
-            ON
-                v.vehicleID = vcl.vehicleID
-            WHERE
-                v.vehicleID = {vehicle_id}
-            LIMIT 1
-        '''
-        return sql
+        return Statement(INVENTORY_QUERIES['vehicles.details'].sql, (vehicle_id,))
 
-    # Gets parts for a specific vehicle
-    def parts_for_vehicle(self, vehicle_id):
-        sql = f'''
-            SELECT
-                p.partID,
-                p.part_orderID,
-                p.part_number,
-                p.cost,
-                p.description,
-                p.quantity,
-                p.status,
-                po.order_number,
-                v.vehicleID,
-                v.model_name,
-                v.model_year
-            FROM
-                csc206cars.partorders po
-            INNER JOIN
-                csc206cars.parts p
-            ON
-                po.part_orderID = p.part_orderID
-            INNER JOIN
-                csc206cars.vehicles v
-            ON
-                po.vehicleID = v.vehicleID
-            WHERE
-                v.vehicleID = {vehicle_id}
-            ORDER BY
-                po.part_orderID, p.partID
-        '''
-        return sql
-
-    # Gets buyer and seller information for a specific vehicle ID
-    def transaction_customers(self, vehicle_id):
-        sql = f'''
-            SELECT
-                pt.customerID AS seller_customerID,
-                c1.first_name AS seller_first_name,
-                c1.last_name AS seller_last_name,
-                c1.street AS seller_street,
-                c1.city AS seller_city,
-                c1.state AS seller_state,
-                c1.postal_code AS seller_postal_code,
-                c1.phone_number AS seller_phone_number,
-                c1.email_address AS seller_email_address,
-                s.customerID AS buyer_customerID,
-                c2.first_name AS buyer_first_name,
-                c2.last_name AS buyer_last_name,
-                c2.street AS buyer_street,
-                c2.city AS buyer_city,
-                c2.state AS buyer_state,
-                c2.postal_code AS buyer_postal_code,
-                c2.phone_number AS buyer_phone_number,
-                c2.email_address AS buyer_email_address
-            FROM
-                csc206cars.vehicles v
-            LEFT JOIN
-                csc206cars.purchasetransactions pt
-            ON
-                v.vehicleID = pt.vehicleID
-            LEFT JOIN
-                csc206cars.customers c1
-            ON
-                pt.customerID = c1.customerID
-            LEFT JOIN
-                csc206cars.salestransactions s
-            ON
-                v.vehicleID = s.vehicleID
-            LEFT JOIN
-                csc206cars.customers c2
-            ON
-                s.customerID = c2.customerID
-            WHERE
-                v.vehicleID = {vehicle_id}
-            LIMIT 1
-        '''
-        return sql
+    # Everything the details page needs in one round trip: the vehicle row, its seller and buyer,
+    # its parts packed into a JSON array, and whether it can be sold (its stored inventory state)
+    def vehicle_page(self, vehicle_id):
+        return Statement(INVENTORY_QUERIES['vehicles.page'].sql, (vehicle_id,))
 
     # 3 Queries below done with help of ma boi
 
@@ -0,0 +1,71 @@
+from sql.builder import named_queries, Statement
+
+
+# Columns the customer picker shows for each match
+CUSTOMER_FIELDS = 'customerID, first_name, last_name, business_name, phone_number, email_address'
+
+
+# Escapes LIKE wildcards in what the user typed, so "100%" only matches a literal 100%
+def like_prefix(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+# Customer lookups for the typeahead on the select and sell pages
+@named_queries
+class customerSQL():
+
+    # Prefix match on last name, first name, phone, email or ID number, at most `limit` rows.
+    # Each branch is a range scan on its own index (migration 3) and stops after `limit` rows,
+    # "jane do" also tries first name "jane" + last name "do"
+    def search(self, term, limit):
+        prefix = like_prefix(term)
+        branches = [
+            ('last_name LIKE %s', (prefix,), 'last_name, first_name'),
+            ('first_name LIKE %s', (prefix,), 'first_name, last_name'),
+            ('phone_number LIKE %s', (prefix,), 'phone_number'),
+            ('email_address LIKE %s', (prefix,), 'email_address'),
+            ('id_number LIKE %s', (prefix,), 'id_number'),
+        ]
+        first, _, rest = term.partition(' ')
+        if rest.strip():
+            branches.append(('last_name LIKE %s AND first_name LIKE %s',
+                             (like_prefix(rest.strip()), like_prefix(first)), 'last_name, first_name'))
+
+        parts = []
+        params = ()
+        for condition, values, order in branches:
+            parts.append(f'''
+            (
+            SELECT
+                {CUSTOMER_FIELDS}
+            FROM
+                csc206cars.customers
+            WHERE
+                {condition}
+            ORDER BY
+                {order}
+            LIMIT %s
+            )''')
+            params += values + (limit,)
+
+        sql = '\n            UNION\n'.join(parts) + '''
+            ORDER BY
+                last_name,
+                first_name,
+                customerID
+            LIMIT %s
+        '''
+        return Statement(sql, params + (limit,))
+
+    # The one customer a page starts with, e.g. the one just created
+    def by_id(self, customer_id):
+        sql = f'''
+            SELECT
+                {CUSTOMER_FIELDS}
+            FROM
+                csc206cars.customers
+            WHERE
+                customerID = %s
+            LIMIT 1
+        '''
+        return Statement(sql, (customer_id,))
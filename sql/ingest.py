@@ -0,0 +1,103 @@
+from sql.builder import named_queries, Statement, placeholders
+
+
+# Queries for the bulk ingest pipeline (ingest.py), the INSERTs are meant for executemany
+@named_queries
+class ingestSQL():
+
+    # Name -> ID maps the ingest resolves against, keyed by the name the input files use
+    def lookups(self):
+        return {
+            'manufacturer': 'SELECT manufacturer_name AS name, manufacturerID AS id FROM csc206cars.manufacturers',
+            'vehicle_type': 'SELECT vehicle_type_name AS name, vehicle_typeID AS id FROM csc206cars.vehicletypes',
+            'color': 'SELECT color_name AS name, colorID AS id FROM csc206cars.colors',
+            'vendor': 'SELECT vendor_name AS name, vendorID AS id FROM csc206cars.vendors',
+            'user': 'SELECT username AS name, userID AS id FROM csc206cars.users',
+        }
+
+    def customer_ids(self):
+        return 'SELECT customerID FROM csc206cars.customers'
+
+    # VINs from the chunk that are already in the database
+    def existing_vins(self, vins):
+        sql = f'''
+            SELECT
+                vin
+            FROM
+                csc206cars.vehicles
+            WHERE
+                vin IN ({placeholders(vins)})
+        '''
+        return Statement(sql, tuple(vins))
+
+    # The IDs MySQL gave the chunk's vehicles, found again through the unique VIN
+    def vehicle_ids(self, vins):
+        sql = f'''
+            SELECT
+                vin,
+                vehicleID
+            FROM
+                csc206cars.vehicles
+            WHERE
+                vin IN ({placeholders(vins)})
+        '''
+        return Statement(sql, tuple(vins))
+
+    # Same for part orders, through the unique (order_number, vehicleID) key
+    def part_order_ids(self, vehicle_ids):
+        sql = f'''
+            SELECT
+                part_orderID,
+                vehicleID,
+                order_number
+            FROM
+                csc206cars.partorders
+            WHERE
+                vehicleID IN ({placeholders(vehicle_ids)})
+        '''
+        return Statement(sql, tuple(vehicle_ids))
+
+    def insert_vehicles(self):
+        sql = '''
+            INSERT INTO csc206cars.vehicles
+                (vin, mileage, description, model_name, model_year, fuel_type, manufacturerID, vehicle_typeID)
+            VALUES
+                (%s, %s, %s, %s, %s, %s, %s, %s)
+        '''
+        return sql
+
+    def insert_vehicle_colors(self):
+        sql = '''
+            INSERT INTO csc206cars.vehiclecolors
+                (vehicleID, colorID)
+            VALUES
+                (%s, %s)
+        '''
+        return sql
+
+    def insert_purchases(self):
+        sql = '''
+            INSERT INTO csc206cars.purchasetransactions
+                (vehicleID, userID, customerID, purchase_price, purchase_date, vehicle_condition)
+            VALUES
+                (%s, %s, %s, %s, %s, %s)
+        '''
+        return sql
+
+    def insert_part_orders(self):
+        sql = '''
+            INSERT INTO csc206cars.partorders
+                (order_number, vehicleID, vendorID)
+            VALUES
+                (%s, %s, %s)
+        '''
+        return sql
+
+    def insert_parts(self):
+        sql = '''
+            INSERT INTO csc206cars.parts
+                (part_orderID, part_number, cost, description, quantity, status)
+            VALUES
+                (%s, %s, %s, %s, %s, %s)
+        '''
+        return sql
@@ -0,0 +1,285 @@
+from collections import namedtuple
+
+from sql.builder import named_queries, Statement
+from sql.rollup import list_price_sql
+
+
+# A secondary index a migration adds on the way up and drops on the way down. The runner checks
+# information_schema first, so a migration that died halfway (DDL commits as it goes) can just be run again
+Index = namedtuple('Index', ['table', 'name', 'columns'])
+
+# Same for a column, definition is everything after the name in ADD COLUMN
+Column = namedtuple('Column', ['table', 'name', 'definition'])
+
+# Runs the Index or Column it wraps the other way round, dropping it on the way up and adding it back on the way down
+Drop = namedtuple('Drop', ['step'])
+
+# version: applied in ascending order, never reuse or renumber one that has shipped
+# up/down: steps run in order, each a SQL string, an Index, a Column or a Drop
+Migration = namedtuple('Migration', ['version', 'name', 'up', 'down'])
+
+
+# Bookkeeping for migrate.py, the applied versions live in csc206cars.schema_migrations
+@named_queries
+class migrationSQL():
+
+    def create_table(self):
+        sql = '''
+            CREATE TABLE IF NOT EXISTS csc206cars.schema_migrations (
+                version int(11) NOT NULL,
+                name varchar(255) NOT NULL,
+                applied_at datetime NOT NULL,
+                PRIMARY KEY (version)
+            ) ENGINE=InnoDB DEFAULT CHARSET=latin1
+        '''
+        return sql
+
+    def applied(self):
+        sql = '''
+            SELECT
+                version,
+                name,
+                applied_at
+            FROM
+                csc206cars.schema_migrations
+            ORDER BY
+                version
+        '''
+        return sql
+
+    def record(self, version, name):
+        sql = '''
+            INSERT INTO csc206cars.schema_migrations (version, name, applied_at)
+            VALUES (%s, %s, NOW())
+        '''
+        return Statement(sql, (version, name))
+
+    def forget(self, version):
+        sql = '''
+            DELETE FROM csc206cars.schema_migrations
+            WHERE version = %s
+        '''
+        return Statement(sql, (version,))
+
+    def index_exists(self, table, name):
+        sql = '''
+            SELECT 1
+            FROM information_schema.statistics
+            WHERE table_schema = 'csc206cars' AND table_name = %s AND index_name = %s
+            LIMIT 1
+        '''
+        return Statement(sql, (table, name))
+
+    def column_exists(self, table, name):
+        sql = '''
+            SELECT 1
+            FROM information_schema.columns
+            WHERE table_schema = 'csc206cars' AND table_name = %s AND column_name = %s
+            LIMIT 1
+        '''
+        return Statement(sql, (table, name))
+
+    # Table, index and column names come from the Index/Column entries below, never from input
+    def create_index(self, index):
+        return f"ALTER TABLE csc206cars.{index.table} ADD INDEX {index.name} ({', '.join(index.columns)})"
+
+    def drop_index(self, index):
+        return f"ALTER TABLE csc206cars.{index.table} DROP INDEX {index.name}"
+
+    def add_column(self, column):
+        return f"ALTER TABLE csc206cars.{column.table} ADD COLUMN {column.name} {column.definition}"
+
+    def drop_column(self, column):
+        return f"ALTER TABLE csc206cars.{column.table} DROP COLUMN {column.name}"
+
+
+# Indexes for the vehicleSQL queries. The seed schema only has the PK, FK and unique keys,
+# so every filter, GROUP BY and ORDER BY below was a full scan of its table.
+# InnoDB secondary indexes carry the primary key, so a trailing vehicleID/partID is free
+PARTS_STATUS_INDEX = Index('parts', 'ix_parts_status_order', ('status', 'part_orderID'))
+
+QUERY_INDEXES = [
+    # The sellable NOT IN subquery of the old listing_conditions. Dropped again by migration 6,
+    # listed here so version 1 stays what it shipped as
+    PARTS_STATUS_INDEX,
+
+    # statistics: cost and quantity per part order without reading the parts rows
+    Index('parts', 'ix_parts_order_cost', ('part_orderID', 'cost', 'quantity')),
+
+    # facet_counts: GROUP BY over all four filter columns reads only this index,
+    # and apply_filters gets a prefix for manID (+ vehicletypeID ...)
+    Index('vehicles', 'ix_vehicles_facets', ('manufacturerID', 'vehicle_typeID', 'model_year', 'fuel_type')),
+
+    # apply_filters on model_year (+ fuel_type), and vehicle_years' DISTINCT ... ORDER BY model_year
+    Index('vehicles', 'ix_vehicles_year_fuel', ('model_year', 'fuel_type')),
+
+    # apply_filters on fuel_type alone, and vehicle_fuel_type's DISTINCT
+    Index('vehicles', 'ix_vehicles_fuel', ('fuel_type',)),
+
+    # keyset: the model_name half of the page cursor condition and ORDER BY model_name DESC
+    Index('vehicles', 'ix_vehicles_model', ('model_name',)),
+
+    # all_vehicles: model names per manufacturer straight from the index
+    Index('vehicles', 'ix_vehicles_manufacturer_model', ('manufacturerID', 'model_name')),
+
+    # seller: GROUP BY customerID with the vehicle count and price sum covered
+    Index('purchasetransactions', 'ix_purchases_customer_price', ('customerID', 'vehicleID', 'purchase_price')),
+
+    # sale: GROUP BY userID joining on vehicleID, both in the index
+    Index('salestransactions', 'ix_sales_user_vehicle', ('userID', 'vehicleID')),
+
+    # Sales over a date range for the reports
+    Index('salestransactions', 'ix_sales_date', ('sales_date',)),
+
+    # customers: ORDER BY last_name, first_name, customerID comes along as the primary key
+    Index('customers', 'ix_customers_name', ('last_name', 'first_name')),
+]
+
+
+# Stored inventory state (in_prep / sellable / sold) on vehicle_rollup, kept by the write paths in
+# sql/rollup.py. The listings filter on it instead of the NOT IN subqueries over sales and parts
+INVENTORY_STATE_COLUMN = Column('vehicle_rollup', 'inventory_state',
+                                "enum('in_prep','sellable','sold') NOT NULL DEFAULT 'in_prep' AFTER uninstalled_part_count")
+INVENTORY_STATE_INDEX = Index('vehicle_rollup', 'ix_vehicle_rollup_state', ('inventory_state',))
+
+# vehicle_rollup as it stood at this migration. Frozen here rather than calling rollupSQL().create_table(),
+# which follows the current schema, later migrations add their columns to it themselves
+ROLLUP_TABLE = '''
+    CREATE TABLE IF NOT EXISTS csc206cars.vehicle_rollup (
+        vehicleID int(11) NOT NULL,
+        total_cost decimal(10,2) DEFAULT NULL,
+        concatenated_colors varchar(1024) DEFAULT NULL,
+        uninstalled_part_count int(11) NOT NULL DEFAULT 0,
+        inventory_state enum('in_prep','sellable','sold') NOT NULL DEFAULT 'in_prep',
+        PRIMARY KEY (vehicleID),
+        KEY ix_vehicle_rollup_state (inventory_state),
+        CONSTRAINT fk_VehicleRollup_vehicleID_Vehicles_vehicleID FOREIGN KEY (vehicleID) REFERENCES vehicles (vehicleID)
+    ) ENGINE=InnoDB DEFAULT CHARSET=latin1
+'''
+
+INVENTORY_STATE = [
+    # A fresh database gets the whole table (the Column and Index steps then skip), one that already
+    # had the rollup from rebuild-rollup gets the state column and its index added
+    ROLLUP_TABLE,
+    INVENTORY_STATE_COLUMN,
+    INVENTORY_STATE_INDEX,
+
+    # Backfill a row per vehicle from the base tables, so the listings aren't empty until the next
+    # rebuild-rollup. Spelled out here for the same reason as the table, rollupSQL().rebuild() would
+    # trip over later migrations' columns
+    '''
+    INSERT INTO csc206cars.vehicle_rollup
+        (vehicleID, total_cost, concatenated_colors, uninstalled_part_count, inventory_state)
+    SELECT
+        v.vehicleID,
+        vpc.total_cost,
+        vcl.concatenated_colors,
+        COALESCE(vpc.uninstalled_part_count, 0),
+        CASE
+            WHEN st.vehicleID IS NOT NULL THEN 'sold'
+            WHEN COALESCE(vpc.uninstalled_part_count, 0) > 0 THEN 'in_prep'
+            ELSE 'sellable'
+        END
+    FROM
+        csc206cars.vehicles v
+    LEFT JOIN
+        (
+            SELECT
+                po.vehicleID,
+                SUM(p.cost) AS total_cost,
+                SUM(p.status != 'Installed') AS uninstalled_part_count
+            FROM
+                csc206cars.partorders po
+            INNER JOIN
+                csc206cars.parts p
+            ON
+                po.part_orderID = p.part_orderID
+            GROUP BY
+                po.vehicleID
+        ) AS vpc
+    ON
+        v.vehicleID = vpc.vehicleID
+    LEFT JOIN
+        (
+            SELECT
+                vc.vehicleID,
+                GROUP_CONCAT(c.color_name ORDER BY c.color_name ASC SEPARATOR ', ') AS concatenated_colors
+            FROM
+                csc206cars.vehiclecolors vc
+            INNER JOIN
+                csc206cars.colors c
+            ON
+                vc.colorID = c.colorID
+            GROUP BY
+                vc.vehicleID
+        ) AS vcl
+    ON
+        v.vehicleID = vcl.vehicleID
+    LEFT JOIN
+        csc206cars.salestransactions st
+    ON
+        v.vehicleID = st.vehicleID
+    ON DUPLICATE KEY UPDATE
+        total_cost = VALUES(total_cost),
+        concatenated_colors = VALUES(concatenated_colors),
+        uninstalled_part_count = VALUES(uninstalled_part_count),
+        inventory_state = VALUES(inventory_state)
+    ''',
+]
+
+# The rollup only holds derived data, rebuild-rollup recreates it for code from before this migration
+INVENTORY_STATE_DOWN = [
+    'DROP TABLE IF EXISTS csc206cars.vehicle_rollup',
+]
+
+
+# Prefix lookups for the customer typeahead (customerSQL.search), last name is covered by ix_customers_name
+CUSTOMER_SEARCH_INDEXES = [
+    Index('customers', 'ix_customers_first_name', ('first_name', 'last_name')),
+    Index('customers', 'ix_customers_phone', ('phone_number',)),
+    Index('customers', 'ix_customers_email', ('email_address',)),
+    Index('customers', 'ix_customers_id_number', ('id_number',)),
+]
+
+
+# Bumped by every vehicle_rollup write, rendered vehicle cards are cached per (vehicleID, row_version)
+ROW_VERSION_COLUMN = Column('vehicle_rollup', 'row_version', "int(11) NOT NULL DEFAULT 0 AFTER inventory_state")
+
+
+# Sticker price kept per vehicle so listings can filter and sort on it, indexed behind the
+# inventory state because every listing filters on that first
+LIST_PRICE_COLUMN = Column('vehicle_rollup', 'list_price', "decimal(12,2) NOT NULL DEFAULT 0 AFTER row_version")
+LIST_PRICE_INDEX = Index('vehicle_rollup', 'ix_vehicle_rollup_state_price', ('inventory_state', 'list_price'))
+
+LIST_PRICE = [
+    LIST_PRICE_COLUMN,
+    LIST_PRICE_INDEX,
+
+    # Backfill from the purchase price and the part cost the rollup already holds
+    f'''
+    UPDATE
+        csc206cars.vehicle_rollup vr
+    LEFT JOIN
+        csc206cars.purchasetransactions pt
+    ON
+        vr.vehicleID = pt.vehicleID
+    SET
+        vr.list_price = {list_price_sql('pt.purchase_price', 'vr.total_cost')},
+        vr.row_version = vr.row_version + 1
+    ''',
+]
+
+
+# Since the listings read the stored inventory state nothing filters parts on status first: the rollup
+# rebuild and partSQL reach parts through part_orderID, so the index was only slowing down status updates
+DROP_PARTS_STATUS = [Drop(PARTS_STATUS_INDEX)]
+
+
+MIGRATIONS = [
+    Migration(1, 'query_indexes', up=QUERY_INDEXES, down=list(reversed(QUERY_INDEXES))),
+    Migration(2, 'inventory_state', up=INVENTORY_STATE, down=INVENTORY_STATE_DOWN),
+    Migration(3, 'customer_search', up=CUSTOMER_SEARCH_INDEXES, down=list(reversed(CUSTOMER_SEARCH_INDEXES))),
+    Migration(4, 'rollup_row_version', up=[ROW_VERSION_COLUMN], down=[ROW_VERSION_COLUMN]),
+    Migration(5, 'list_price', up=LIST_PRICE, down=[LIST_PRICE_INDEX, LIST_PRICE_COLUMN]),
+    Migration(6, 'drop_parts_status_index', up=DROP_PARTS_STATUS, down=DROP_PARTS_STATUS),
+]
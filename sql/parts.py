@@ -0,0 +1,70 @@
+from sql.builder import named_queries, Statement, id_tuple, placeholders
+
+
+# Order parts move through, a batch only ever moves them forward
+PART_STATUSES = ('Ordered', 'Received', 'Installed')
+
+
+# Batch status changes for the parts on one vehicle
+@named_queries
+class partSQL():
+
+    # Moves parts to `status` in a single UPDATE. Scope is every part on the vehicle, one part order
+    # (part_order_id) or a list of parts (part_ids), always limited to that vehicle's parts
+    def transition(self, vehicle_id, status, part_order_id=None, part_ids=None):
+        if status not in PART_STATUSES:
+            raise ValueError(f'Unknown part status {status!r}')
+
+        sql = '''
+            UPDATE
+                csc206cars.parts p
+            INNER JOIN
+                csc206cars.partorders po
+            ON
+                p.part_orderID = po.part_orderID
+            SET
+                p.status = %s
+            WHERE
+                po.vehicleID = %s
+                AND FIELD(COALESCE(p.status, 'Ordered'), 'Ordered', 'Received', 'Installed')
+                    < FIELD(%s, 'Ordered', 'Received', 'Installed')
+        '''
+        params = (status, vehicle_id, status)
+
+        if part_order_id is not None:
+            sql += '''
+                AND p.part_orderID = %s
+            '''
+            params += (part_order_id,)
+        elif part_ids is not None:
+            part_ids = id_tuple(part_ids)
+            sql += f'''
+                AND p.partID IN ({placeholders(part_ids)})
+            '''
+            params += part_ids
+
+        return Statement(sql, params)
+
+    # Where the vehicle stands after a batch: parts per status and whether it can be sold now.
+    # Read after rollupSQL.rebuild() in the same transaction so the inventory state is the new one
+    def eligibility(self, vehicle_id):
+        sql = '''
+            SELECT
+                SUM(COALESCE(p.status, 'Ordered') = 'Ordered') AS ordered,
+                SUM(p.status = 'Received') AS received,
+                SUM(p.status = 'Installed') AS installed,
+                (
+                    SELECT vr.inventory_state <=> 'sellable'
+                    FROM csc206cars.vehicle_rollup vr
+                    WHERE vr.vehicleID = %s
+                ) AS eligible_for_sale
+            FROM
+                csc206cars.partorders po
+            INNER JOIN
+                csc206cars.parts p
+            ON
+                po.part_orderID = p.part_orderID
+            WHERE
+                po.vehicleID = %s
+        '''
+        return Statement(sql, (vehicle_id, vehicle_id))
@@ -0,0 +1,199 @@
+from sql.builder import named_queries, Statement, id_tuple, placeholders
+from sql.cars import vehicleSQL
+
+
+# Summary tables behind the /sales, /seller and /statistics reports. Write paths keep them
+# up to date a row at a time and rebuild() recomputes them from the transaction tables
+@named_queries
+class reportSQL():
+
+    def create_tables(self):
+        return [
+            '''
+            CREATE TABLE IF NOT EXISTS csc206cars.report_sales_snapshot (
+                userID int(11) NOT NULL,
+                salesperson varchar(511) NOT NULL,
+                vehicles_sold int(11) NOT NULL DEFAULT 0,
+                total_sold_price decimal(14,2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (userID)
+            ) ENGINE=InnoDB DEFAULT CHARSET=latin1
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS csc206cars.report_seller_snapshot (
+                customerID int(11) NOT NULL,
+                seller_name varchar(511) NOT NULL,
+                vehicles_sold_to_dealer int(11) NOT NULL DEFAULT 0,
+                total_paid decimal(14,2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (customerID)
+            ) ENGINE=InnoDB DEFAULT CHARSET=latin1
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS csc206cars.report_vendor_snapshot (
+                vendorID int(11) NOT NULL,
+                vendor_name varchar(255) NOT NULL,
+                parts_purchased int(11) NOT NULL DEFAULT 0,
+                total_spent decimal(14,2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (vendorID)
+            ) ENGINE=InnoDB DEFAULT CHARSET=latin1
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS csc206cars.report_snapshot_meta (
+                report_name varchar(50) NOT NULL,
+                as_of datetime NOT NULL,
+                rebuilt_at datetime NOT NULL,
+                PRIMARY KEY (report_name)
+            ) ENGINE=InnoDB DEFAULT CHARSET=latin1
+            ''',
+        ]
+
+    # Full recompute from the live aggregation queries in vehicleSQL, run inside one transaction
+    def rebuild(self):
+        vSQL = vehicleSQL()
+        return [
+            'DELETE FROM csc206cars.report_sales_snapshot',
+            f'''
+            INSERT INTO csc206cars.report_sales_snapshot (userID, salesperson, vehicles_sold, total_sold_price)
+            SELECT userID, salesperson, vehicles_sold, COALESCE(total_sold_price, 0)
+            FROM ({vSQL.sale().strip().rstrip(';')}) AS live
+            ''',
+            'DELETE FROM csc206cars.report_seller_snapshot',
+            f'''
+            INSERT INTO csc206cars.report_seller_snapshot (customerID, seller_name, vehicles_sold_to_dealer, total_paid)
+            SELECT customerID, seller_name, vehicles_sold_to_dealer, COALESCE(total_paid, 0)
+            FROM ({vSQL.seller().strip().rstrip(';')}) AS live
+            ''',
+            'DELETE FROM csc206cars.report_vendor_snapshot',
+            f'''
+            INSERT INTO csc206cars.report_vendor_snapshot (vendorID, vendor_name, parts_purchased, total_spent)
+            SELECT vendorID, vendor_name, COALESCE(parts_purchased, 0), COALESCE(total_spent, 0)
+            FROM ({vSQL.statistics().strip().rstrip(';')}) AS live
+            ''',
+            '''
+            REPLACE INTO csc206cars.report_snapshot_meta (report_name, as_of, rebuilt_at)
+            VALUES ('sale', NOW(), NOW()), ('seller', NOW(), NOW()), ('statistics', NOW(), NOW())
+            ''',
+        ]
+
+    # Run after inserting purchasetransactions rows (one vehicle or a list): adds them to the selling customers' totals
+    def record_purchase(self, vehicle_id):
+        vehicle_ids = id_tuple(vehicle_id)
+        sql = f'''
+            INSERT INTO csc206cars.report_seller_snapshot (customerID, seller_name, vehicles_sold_to_dealer, total_paid)
+            SELECT
+                c.customerID,
+                CONCAT(c.first_name, ' ', c.last_name),
+                COUNT(*),
+                SUM(pt.purchase_price)
+            FROM
+                csc206cars.purchasetransactions pt
+            JOIN
+                csc206cars.customers c
+            ON
+                pt.customerID = c.customerID
+            WHERE
+                pt.vehicleID IN ({placeholders(vehicle_ids)})
+            GROUP BY
+                c.customerID,
+                c.first_name,
+                c.last_name
+            ON DUPLICATE KEY UPDATE
+                vehicles_sold_to_dealer = vehicles_sold_to_dealer + VALUES(vehicles_sold_to_dealer),
+                total_paid = total_paid + VALUES(total_paid)
+        '''
+        return [Statement(sql, vehicle_ids), self.touch('seller')]
+
+    # Run after inserting the parts of a part order (or a list of them): adds them to the vendors' totals
+    def record_part_order(self, part_order_id):
+        part_order_ids = id_tuple(part_order_id)
+        sql = f'''
+            INSERT INTO csc206cars.report_vendor_snapshot (vendorID, vendor_name, parts_purchased, total_spent)
+            SELECT
+                v.vendorID,
+                v.vendor_name,
+                SUM(p.quantity),
+                SUM(p.cost * p.quantity)
+            FROM
+                csc206cars.partorders po
+            JOIN
+                csc206cars.vendors v
+            ON
+                po.vendorID = v.vendorID
+            JOIN
+                csc206cars.parts p
+            ON
+                p.part_orderID = po.part_orderID
+            WHERE
+                po.part_orderID IN ({placeholders(part_order_ids)})
+            GROUP BY
+                v.vendorID,
+                v.vendor_name
+            ON DUPLICATE KEY UPDATE
+                parts_purchased = parts_purchased + VALUES(parts_purchased),
+                total_spent = total_spent + VALUES(total_spent)
+        '''
+        return [Statement(sql, part_order_ids), self.touch('statistics')]
+
+    # Moves the report's "as of" time forward. Only updates, so a report that was never
+    # rebuilt keeps reading live data instead of a partial snapshot
+    def touch(self, report):
+        sql = '''
+            UPDATE csc206cars.report_snapshot_meta
+            SET as_of = NOW()
+            WHERE report_name = %s
+        '''
+        return Statement(sql, (report,))
+
+    def as_of(self, report):
+        sql = '''
+            SELECT as_of
+            FROM csc206cars.report_snapshot_meta
+            WHERE report_name = %s
+        '''
+        return Statement(sql, (report,))
+
+    # The report pages read these instead of the live GROUP BY queries
+    def sale(self):
+        sql = '''
+            SELECT
+                userID,
+                salesperson,
+                vehicles_sold,
+                total_sold_price,
+                CASE WHEN vehicles_sold > 0 THEN total_sold_price / vehicles_sold END AS avg_sale_price
+            FROM
+                csc206cars.report_sales_snapshot
+            ORDER BY
+                vehicles_sold DESC,
+                total_sold_price DESC
+        '''
+        return Statement(sql, ())
+
+    def seller(self):
+        sql = '''
+            SELECT
+                customerID,
+                seller_name,
+                vehicles_sold_to_dealer,
+                total_paid
+            FROM
+                csc206cars.report_seller_snapshot
+            ORDER BY
+                vehicles_sold_to_dealer DESC,
+                total_paid ASC
+        '''
+        return Statement(sql, ())
+
+    def statistics(self):
+        sql = '''
+            SELECT
+                vendorID,
+                vendor_name,
+                parts_purchased,
+                total_spent,
+                CASE WHEN parts_purchased > 0 THEN total_spent / parts_purchased ELSE NULL END AS avg_cost_per_part
+            FROM
+                csc206cars.report_vendor_snapshot
+            ORDER BY
+                parts_purchased DESC
+        '''
+        return Statement(sql, ())
@@ -0,0 +1,187 @@
+import os
+from decimal import Decimal
+
+from sql.builder import named_queries, Statement, id_tuple, placeholders
+
+
+# Where a vehicle is in the lot: waiting on parts, ready to sell, or gone. Stored per vehicle in
+# vehicle_rollup.inventory_state so the listings filter on one indexed column
+INVENTORY_STATES = ('in_prep', 'sellable', 'sold')
+
+# Sticker price markups: list_price = PURCHASE_MARKUP * purchase price + PARTS_MARKUP * parts cost.
+# After changing them, `flask --app app rebuild-rollup` reprices the lot
+PURCHASE_MARKUP = Decimal(os.getenv('LIST_PRICE_PURCHASE_MARKUP', '1.4'))
+PARTS_MARKUP = Decimal(os.getenv('LIST_PRICE_PARTS_MARKUP', '1.2'))
+
+
+# SQL expression for the list price, the markups go in as numeric literals
+def list_price_sql(purchase_price, parts_cost):
+    return f'ROUND({PURCHASE_MARKUP} * COALESCE({purchase_price}, 0) + {PARTS_MARKUP} * COALESCE({parts_cost}, 0), 2)'
+
+
+# Queries for the vehicle_rollup table, which keeps each vehicle's part cost, color list,
+# number of parts that still need installing and inventory state so the listings don't rebuild them every time.
+# Every write here bumps row_version, which is what cached vehicle cards are keyed on (fragments.py)
+@named_queries
+class rollupSQL():
+
+    def create_table(self):
+        sql = '''
+            CREATE TABLE IF NOT EXISTS csc206cars.vehicle_rollup (
+                vehicleID int(11) NOT NULL,
+                total_cost decimal(10,2) DEFAULT NULL,
+                concatenated_colors varchar(1024) DEFAULT NULL,
+                uninstalled_part_count int(11) NOT NULL DEFAULT 0,
+                inventory_state enum('in_prep','sellable','sold') NOT NULL DEFAULT 'in_prep',
+                row_version int(11) NOT NULL DEFAULT 0,
+                list_price decimal(12,2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (vehicleID),
+                KEY ix_vehicle_rollup_state (inventory_state),
+                KEY ix_vehicle_rollup_state_price (inventory_state, list_price),
+                CONSTRAINT fk_VehicleRollup_vehicleID_Vehicles_vehicleID FOREIGN KEY (vehicleID) REFERENCES vehicles (vehicleID)
+            ) ENGINE=InnoDB DEFAULT CHARSET=latin1
+        '''
+        return sql
+
+    # Recomputes the rollup from the base tables, for every vehicle, one, or a list of them
+    def rebuild(self, vehicle_id=None):
+        sql = f'''
+            INSERT INTO csc206cars.vehicle_rollup
+                (vehicleID, total_cost, concatenated_colors, uninstalled_part_count, inventory_state, list_price)
+            SELECT
+                v.vehicleID,
+                vpc.total_cost,
+                vcl.concatenated_colors,
+                COALESCE(vpc.uninstalled_part_count, 0),
+                CASE
+                    WHEN st.vehicleID IS NOT NULL THEN 'sold'
+                    WHEN COALESCE(vpc.uninstalled_part_count, 0) > 0 THEN 'in_prep'
+                    ELSE 'sellable'
+                END,
+                {list_price_sql('pt.purchase_price', 'vpc.total_cost')}
+            FROM
+                csc206cars.vehicles v
+            LEFT JOIN
+                (
+                    SELECT
+                        po.vehicleID,
+                        SUM(p.cost) AS total_cost,
+                        SUM(p.status != 'Installed') AS uninstalled_part_count
+                    FROM
+                        csc206cars.partorders po
+                    INNER JOIN
+                        csc206cars.parts p
+                    ON
+                        po.part_orderID = p.part_orderID
+                    {{vehicle_filter}}
+                    GROUP BY
+                        po.vehicleID
+                ) AS vpc
+            ON
+                v.vehicleID = vpc.vehicleID
+            LEFT JOIN
+                (
+                    SELECT
+                        vc.vehicleID,
+                        GROUP_CONCAT(c.color_name ORDER BY c.color_name ASC SEPARATOR ', ') AS concatenated_colors
+                    FROM
+                        csc206cars.vehiclecolors vc
+                    INNER JOIN
+                        csc206cars.colors c
+                    ON
+                        vc.colorID = c.colorID
+                    {{color_filter}}
+                    GROUP BY
+                        vc.vehicleID
+                ) AS vcl
+            ON
+                v.vehicleID = vcl.vehicleID
+            LEFT JOIN
+                csc206cars.salestransactions st
+            ON
+                v.vehicleID = st.vehicleID
+            LEFT JOIN
+                csc206cars.purchasetransactions pt
+            ON
+                v.vehicleID = pt.vehicleID
+            {{outer_filter}}
+            ON DUPLICATE KEY UPDATE
+                total_cost = VALUES(total_cost),
+                concatenated_colors = VALUES(concatenated_colors),
+                uninstalled_part_count = VALUES(uninstalled_part_count),
+                inventory_state = VALUES(inventory_state),
+                list_price = VALUES(list_price),
+                row_version = row_version + 1
+        '''
+
+        if vehicle_id is None:
+            return sql.format(vehicle_filter='', color_filter='', outer_filter='')
+
+        # For a single vehicle (or a few), push the filter into the derived tables so only their rows are read
+        vehicle_ids = id_tuple(vehicle_id)
+        if len(vehicle_ids) == 1:
+            condition = '= %s'
+        else:
+            condition = f'IN ({placeholders(vehicle_ids)})'
+        sql = sql.format(
+            vehicle_filter=f'WHERE po.vehicleID {condition}',
+            color_filter=f'WHERE vc.vehicleID {condition}',
+            outer_filter=f'WHERE v.vehicleID {condition}',
+        )
+        return Statement(sql, vehicle_ids * 3)
+
+    # Run before marking a part installed: takes it off the vehicle's uninstalled count
+    # unless it was already installed, so the rollup stays right without a recount.
+    # The second statement moves the vehicle to sellable once that was its last part
+    def part_installed(self, part_id):
+        sql = '''
+            UPDATE
+                csc206cars.vehicle_rollup vr
+            INNER JOIN
+                csc206cars.partorders po
+            ON
+                vr.vehicleID = po.vehicleID
+            INNER JOIN
+                csc206cars.parts p
+            ON
+                po.part_orderID = p.part_orderID
+            SET
+                vr.uninstalled_part_count = vr.uninstalled_part_count - 1,
+                vr.row_version = vr.row_version + 1
+            WHERE
+                p.partID = %s
+                AND p.status != 'Installed'
+        '''
+        ready = '''
+            UPDATE
+                csc206cars.vehicle_rollup vr
+            INNER JOIN
+                csc206cars.partorders po
+            ON
+                vr.vehicleID = po.vehicleID
+            INNER JOIN
+                csc206cars.parts p
+            ON
+                po.part_orderID = p.part_orderID
+            SET
+                vr.inventory_state = 'sellable',
+                vr.row_version = vr.row_version + 1
+            WHERE
+                p.partID = %s
+                AND vr.inventory_state = 'in_prep'
+                AND vr.uninstalled_part_count <= 0
+        '''
+        return [Statement(sql, (part_id,)), Statement(ready, (part_id,))]
+
+    # Run in the same transaction as inserting a salestransactions row
+    def sold(self, vehicle_id):
+        sql = '''
+            UPDATE
+                csc206cars.vehicle_rollup
+            SET
+                inventory_state = 'sold',
+                row_version = row_version + 1
+            WHERE
+                vehicleID = %s
+        '''
+        return Statement(sql, (vehicle_id,))
@@ -0,0 +1,53 @@
+from sql.builder import named_queries, Statement
+
+
+# Queries for logging in, kept apart from vehicleSQL so password rows never end up in a listing or cache
+@named_queries
+class userSQL():
+
+    # One user by username, served by the UNIQUE KEY on users.username
+    def by_username(self, username):
+        sql = '''
+            SELECT
+                userID,
+                username,
+                password,
+                role,
+                first_name,
+                last_name
+            FROM
+                csc206cars.users
+            WHERE
+                username = %s
+            LIMIT 1
+        '''
+        return Statement(sql, (username,))
+
+    # The seed schema only has room for 50 characters, a salted hash needs more
+    def widen_password_column(self):
+        sql = '''
+            ALTER TABLE csc206cars.users
+                MODIFY password varchar(255) NOT NULL
+        '''
+        return sql
+
+    def all_passwords(self):
+        sql = '''
+            SELECT
+                userID,
+                password
+            FROM
+                csc206cars.users
+        '''
+        return sql
+
+    def set_password(self, user_id, password_hash):
+        sql = '''
+            UPDATE
+                csc206cars.users
+            SET
+                password = %s
+            WHERE
+                userID = %s
+        '''
+        return Statement(sql, (password_hash, user_id))
@@ -0,0 +1,91 @@
+// Wait for the webpage to load
+document.addEventListener('DOMContentLoaded', () => {
+
+    // Typeahead for the customer pickers (customer_picker.html), asks the server once typing pauses
+    document.querySelectorAll('.customer-picker').forEach(picker => {
+        const query = picker.querySelector('.customer-query');
+        const hidden = picker.querySelector('input[name="customerID"]');
+        const results = picker.querySelector('.customer-results');
+        let timer = null;
+        let inflight = null;
+
+        // Keeps dropdown.js from closing the list when the click was inside the picker
+        picker.addEventListener('click', event => event.stopPropagation());
+
+        const choose = customer => {
+            hidden.value = customer.customerID;
+            query.value = `${customer.first_name} ${customer.last_name}`;
+            query.classList.remove('is-danger');
+            picker.classList.remove('is-active');
+        };
+
+        const show = customers => {
+            results.replaceChildren();
+            if (!customers.length) {
+                const empty = document.createElement('div');
+                empty.className = 'dropdown-item';
+                empty.textContent = 'No matching customers';
+                results.append(empty);
+            }
+            customers.forEach(customer => {
+                const item = document.createElement('a');
+                item.className = 'dropdown-item';
+                item.href = '#';
+                item.textContent = `${customer.first_name} ${customer.last_name}`
+                    + (customer.business_name ? ` (${customer.business_name})` : '');
+
+                const contact = document.createElement('small');
+                contact.className = 'is-block has-text-grey';
+                contact.textContent = [customer.phone_number, customer.email_address].filter(Boolean).join(' · ');
+                item.append(contact);
+
+                item.addEventListener('click', event => {
+                    event.preventDefault();
+                    choose(customer);
+                });
+                results.append(item);
+            });
+            picker.classList.add('is-active');
+        };
+
+        query.addEventListener('input', () => {
+            // Typing again means the earlier pick no longer matches what's in the box
+            hidden.value = '';
+            clearTimeout(timer);
+
+            const term = query.value.trim();
+            if (term.length < 2) {
+                picker.classList.remove('is-active');
+                return;
+            }
+
+            timer = setTimeout(() => {
+                // Only the newest request matters, drop one that is still on its way
+                if (inflight) {
+                    inflight.abort();
+                }
+                inflight = new AbortController();
+                fetch(`${picker.dataset.url}?q=${encodeURIComponent(term)}`, { signal: inflight.signal })
+                    .then(response => response.json())
+                    .then(data => show(data.customers))
+                    .catch(error => {
+                        if (error.name !== 'AbortError') {
+                            console.error(error);
+                        }
+                    });
+            }, 250);
+        });
+
+        // The hidden field can't be `required`, so check for a pick before the form goes out
+        const form = picker.closest('form');
+        if (form) {
+            form.addEventListener('submit', event => {
+                if (!hidden.value) {
+                    event.preventDefault();
+                    query.classList.add('is-danger');
+                    query.focus();
+                }
+            });
+        }
+    });
+});
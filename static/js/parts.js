@@ -0,0 +1,15 @@
+// Wait for the webpage to load
+document.addEventListener('DOMContentLoaded', () => {
+
+    // The header checkbox ticks or unticks every part in the table
+    const selectAll = document.getElementById('select-all-parts');
+    if (!selectAll) {
+        return;
+    }
+
+    selectAll.addEventListener('change', () => {
+        document.querySelectorAll('#parts-form input[name="part_ids"]').forEach(box => {
+            box.checked = selectAll.checked;
+        });
+    });
+});